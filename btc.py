@@ -1,28 +1,3820 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+_MODULE_IMPORT_START = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox
-import pandas as pd
-import numpy as np
-import ccxt
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from datetime import datetime, timedelta
 import threading
-import time
 import json
 import os
 import sys  # 添加 sys 模块导入
-from sklearn.ensemble import RandomForestClassifier
+import shutil
+import random
+import itertools
+import importlib
+import bisect
+import copy
+import math
+import decimal
+import re
+import heapq
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tkinter import filedialog
-from tkcalendar import DateEntry
-import pickle
 
-# 设置matplotlib的默认编码
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']  # 设置中文字体
-plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
-plt.rcParams['font.family'] = ['sans-serif']  # 设置字体族
+
+class LazyModule:
+    """模块代理，首次访问属性时才真正导入，用于推迟重型依赖的导入
+
+    导入后把模块级的同名全局变量 alias 直接换成真正的模块，
+    之后的属性访问不再经过代理（热路径上每次经过 __getattr__ 要慢几十倍）。
+    """
+
+    def __init__(self, name, alias, setup=None):
+        self._name = name
+        self._alias = alias
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._setup:
+                        self._setup(module)
+                    self._module = module
+                    if globals().get(self._alias) is self:
+                        globals()[self._alias] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def _setup_matplotlib(module):
+    """设置matplotlib的默认编码"""
+    import matplotlib
+    matplotlib.rcParams['font.sans-serif'] = ['Microsoft YaHei']  # 设置中文字体
+    matplotlib.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+    matplotlib.rcParams['font.family'] = ['sans-serif']  # 设置字体族
+
+
+# 重型依赖在首次使用时才导入，以加快启动
+pd = LazyModule('pandas', 'pd')
+np = LazyModule('numpy', 'np')
+ccxt = LazyModule('ccxt', 'ccxt')
+plt = LazyModule('matplotlib.pyplot', 'plt', setup=_setup_matplotlib)
+# 图表绘制只需要这两个子模块，离屏快照进程不必导入 pyplot
+mcollections = LazyModule('matplotlib.collections', 'mcollections', setup=_setup_matplotlib)
+mdates = LazyModule('matplotlib.dates', 'mdates', setup=_setup_matplotlib)
+
+# 内存映射模型格式
+MAPPED_FOREST_VERSION = 1
+MAPPED_FOREST_ARRAYS = ('roots', 'children_left', 'children_right', 'feature', 'threshold', 'value')
+
+
+def get_process_rss():
+    """获取当前进程的常驻内存(字节)，无法获取时返回None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def forest_to_arrays(model):
+    """将随机森林的所有树展平为连续的节点数组"""
+    if isinstance(model, MappedForest):
+        arrays = {name: np.asarray(getattr(model, name)) for name in MAPPED_FOREST_ARRAYS}
+        return arrays, model.classes_, model.n_features_in_
+
+    roots, lefts, rights, features, thresholds, values = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        left = tree.children_left.astype(np.int32)
+        right = tree.children_right.astype(np.int32)
+        # 子节点索引转换为全局索引，叶子节点保持-1
+        lefts.append(np.where(left >= 0, left + offset, -1).astype(np.int32))
+        rights.append(np.where(right >= 0, right + offset, -1).astype(np.int32))
+        features.append(tree.feature.astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        # 节点的类别分布归一化为概率，兼容计数和比例两种存储方式
+        value = tree.value[:, 0, :].astype(np.float64)
+        total = value.sum(axis=1, keepdims=True)
+        values.append(np.divide(value, total, out=np.zeros_like(value), where=total > 0))
+        roots.append(offset)
+        offset += tree.node_count
+
+    arrays = {
+        'roots': np.asarray(roots, dtype=np.int32),
+        'children_left': np.concatenate(lefts),
+        'children_right': np.concatenate(rights),
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'value': np.concatenate(values)
+    }
+    return arrays, model.classes_, int(model.n_features_in_)
+
+
+def save_mapped_forest(model, path, extra_meta=None):
+    """以可内存映射的目录格式保存随机森林"""
+    arrays, classes, n_features = forest_to_arrays(model)
+
+    # 先写入临时目录再替换，避免读取方看到写了一半的模型
+    tmp_path = path + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), np.ascontiguousarray(arr))
+
+    meta = {
+        'version': MAPPED_FOREST_VERSION,
+        'n_trees': int(len(arrays['roots'])),
+        'n_nodes': int(len(arrays['feature'])),
+        'n_features': int(n_features),
+        'classes': np.asarray(classes).tolist()
+    }
+    if extra_meta:
+        meta.update(extra_meta)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return meta
+
+
+class MappedForest:
+    """只读内存映射的随机森林，多个进程加载同一模型时共享物理内存页"""
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != MAPPED_FOREST_VERSION:
+            raise ValueError(f"不支持的模型格式版本: {self.meta.get('version')}")
+
+        for name in MAPPED_FOREST_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+        self.classes_ = np.asarray(self.meta['classes'])
+        self.n_features_in_ = self.meta['n_features']
+
+    def __reduce__(self):
+        # 传给工作进程时只传路径，由子进程重新映射同一份文件
+        return (self.__class__, (self.path,))
+
+    @property
+    def nbytes(self):
+        """节点数组总字节数"""
+        return sum(getattr(self, name).nbytes for name in MAPPED_FOREST_ARRAYS)
+
+    def apply(self, X):
+        """返回每个样本在每棵树中落入的叶子节点索引"""
+        X = np.asarray(X, dtype=np.float32)
+        n_samples = X.shape[0]
+        nodes = np.tile(np.asarray(self.roots, dtype=np.int64), (n_samples, 1))
+        active = self.children_left[nodes] >= 0
+
+        # 所有样本和所有树同时逐层向下遍历
+        while active.any():
+            rows, cols = np.nonzero(active)
+            current = nodes[rows, cols]
+            go_left = X[rows, self.feature[current]] <= self.threshold[current]
+            nxt = np.where(go_left, self.children_left[current], self.children_right[current])
+            nodes[rows, cols] = nxt
+            active[rows, cols] = self.children_left[nxt] >= 0
+
+        return nodes
+
+    def predict_proba(self, X):
+        """预测各类别概率（各树概率的平均值）"""
+        leaves = self.apply(X)
+        return np.asarray(self.value[leaves]).mean(axis=1)
+
+    def predict(self, X):
+        """预测类别"""
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+# 特征定义的版本，build_feature_frame 的计算方式变化时递增；
+# 版本1为旧的 prepare_data（简单平均RSI、样本标准差布林带），与当前特征不兼容
+FEATURE_SET_VERSION = 2
+
+# 模型与特征的默认参数
+DEFAULT_MODEL_PARAMS = {'n_estimators': 100, 'random_state': 42}
+DEFAULT_FEATURE_PARAMS = {'rsi_period': 14, 'bb_window': 20, 'bb_std': 2}
+
+# 参数搜索的默认搜索空间
+DEFAULT_MODEL_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [None, 8, 16],
+    'min_samples_leaf': [1, 5, 20],
+    'max_features': ['sqrt', 0.5]
+}
+DEFAULT_FEATURE_GRID = {
+    'rsi_period': [7, 14, 21],
+    'bb_window': [10, 20]
+}
+
+
+def build_feature_frame(df, rsi_period=14, bb_window=20, bb_std=2):
+    """按参数向量化计算模型特征"""
+    close = df['close'].astype(float)
+    volume = df['volume'].astype(float)
+    
+    features = pd.DataFrame(index=df.index)
+    features['close'] = close
+    features['volume'] = volume
+    
+    # Wilder平滑的RSI
+    delta = close.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1.0 / rsi_period, adjust=False).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1.0 / rsi_period, adjust=False).mean()
+    features['rsi'] = 100 - 100 / (1 + gain / loss)
+    
+    # OBV
+    direction = np.sign(close.diff().fillna(0).values)
+    direction[0] = 1
+    features['obv'] = np.cumsum(direction * volume.values)
+    
+    # 布林带
+    ma = close.rolling(window=bb_window).mean()
+    std = close.rolling(window=bb_window).std(ddof=0)
+    features['bollinger_upper'] = ma + std * bb_std
+    features['bollinger_lower'] = ma - std * bb_std
+    
+    return features
+
+
+def compute_indicators(df):
+    """计算图表、信号和评分使用的指标列（MA、布林带、RSI、MACD），直接添加到 df 并返回"""
+    # 计算MA
+    df['MA5'] = df['close'].rolling(window=5).mean()
+    df['MA10'] = df['close'].rolling(window=10).mean()
+    
+    # 计算布林带
+    df['MA20'] = df['close'].rolling(window=20).mean()
+    df['std'] = df['close'].rolling(window=20).std()
+    df['upper'] = df['MA20'] + (df['std'] * 2)
+    df['lower'] = df['MA20'] - (df['std'] * 2)
+    
+    # 计算RSI
+    delta = df['close'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rs = gain / loss
+    df['RSI'] = 100 - (100 / (1 + rs))
+    
+    # 计算MACD
+    exp1 = df['close'].ewm(span=12, adjust=False).mean()
+    exp2 = df['close'].ewm(span=26, adjust=False).mean()
+    df['MACD'] = exp1 - exp2
+    df['Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
+    df['Histogram'] = df['MACD'] - df['Signal']
+    
+    return df
+
+
+def update_indicators_tail(df, candle):
+    """只有最后一根未收盘K线变化时，在上一次 compute_indicators 的结果上只重算最后一行
+
+    df 不会被修改，返回更新后的副本；candle 为新的 [时间戳, 开, 高, 低, 收, 量]。
+    滚动窗口类指标用最后一个窗口重算；EMA 是收盘价的线性递推，按收盘价的变化量修正最后一行即可。
+    """
+    df = df.copy()
+    old_close = float(df['close'].iat[-1])
+    for column, value in zip(['open', 'high', 'low', 'close', 'volume'], candle[1:6]):
+        df.iloc[-1, df.columns.get_loc(column)] = value
+    close = df['close'].to_numpy(dtype=float)
+    
+    def set_last(column, value):
+        df.iloc[-1, df.columns.get_loc(column)] = value
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        set_last('MA5', close[-5:].mean())
+        set_last('MA10', close[-10:].mean())
+        ma20, std = close[-20:].mean(), close[-20:].std(ddof=1)
+        set_last('MA20', ma20)
+        set_last('std', std)
+        set_last('upper', ma20 + std * 2)
+        set_last('lower', ma20 - std * 2)
+        
+        delta = np.diff(close[-15:])
+        gain = np.where(delta > 0, delta, 0).mean()
+        loss = np.where(delta < 0, -delta, 0).mean()
+        set_last('RSI', 100 - (100 / (1 + gain / loss)))
+    
+    change = close[-1] - old_close
+    macd = df['MACD'].iat[-1] + (2 / 13 - 2 / 27) * change
+    signal = df['Signal'].iat[-1] + 2 / 10 * (macd - df['MACD'].iat[-1])
+    set_last('MACD', macd)
+    set_last('Signal', signal)
+    set_last('Histogram', macd - signal)
+    return df
+
+
+def walk_forward_splits(n_samples, n_folds=5, test_size=None, min_train_size=None,
+                        max_train_size=None, gap=0):
+    """生成按时间顺序的前推验证折，返回 (训练起止, 测试起止) 列表"""
+    if test_size is None:
+        test_size = n_samples // (n_folds + 1)
+    if min_train_size is None:
+        min_train_size = test_size
+    
+    folds = []
+    first_test = n_samples - n_folds * test_size
+    for k in range(n_folds):
+        test_start = first_test + k * test_size
+        test_end = min(n_samples, test_start + test_size)
+        train_end = test_start - gap
+        if train_end < min_train_size or test_start >= test_end:
+            continue
+        train_start = 0 if max_train_size is None else max(0, train_end - max_train_size)
+        folds.append(((train_start, train_end), (test_start, test_end)))
+    return folds
+
+
+def fold_metrics(y_true, y_pred, returns):
+    """计算单个测试折的准确率、精确率和收益加权指标"""
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    returns = np.asarray(returns, dtype=float)
+    correct = y_true == y_pred
+    predicted_up = y_pred == 1
+    weights = np.abs(returns)
+    
+    return {
+        'accuracy': float(correct.mean()) if len(correct) else 0.0,
+        'precision': float(correct[predicted_up].mean()) if predicted_up.any() else 0.0,
+        'return_weighted_accuracy': float((weights * correct).sum() / weights.sum()) if weights.sum() > 0 else 0.0,
+        # 仅在预测上涨时做多的累计收益
+        'strategy_return': float(np.prod(1 + returns * predicted_up) - 1),
+        'samples': int(len(y_true))
+    }
+
+
+# 参数搜索工作进程的数据，由初始化函数在每个进程中设置一次
+_WALK_FORWARD_STATE = {}
+
+
+def _walk_forward_init(close, volume, folds):
+    """工作进程初始化：保存行情数据和折划分"""
+    _WALK_FORWARD_STATE['frame'] = pd.DataFrame({'close': close, 'volume': volume})
+    _WALK_FORWARD_STATE['folds'] = folds
+    _WALK_FORWARD_STATE['features'] = {}
+
+
+def _walk_forward_dataset(feature_params):
+    """按特征参数构建数据集，同一进程内按参数缓存"""
+    key = tuple(sorted(feature_params.items()))
+    cache = _WALK_FORWARD_STATE['features']
+    if key not in cache:
+        frame = _WALK_FORWARD_STATE['frame']
+        features = build_feature_frame(frame, **feature_params)
+        returns = frame['close'].shift(-1) / frame['close'] - 1
+        labels = (returns > 0).astype(int)
+        # 缺少特征或下一根K线的行不参与评估
+        valid = features.notna().all(axis=1).values & returns.notna().values
+        cache[key] = (features.values, labels.values, returns.values, valid)
+    return cache[key]
+
+
+def evaluate_walk_forward(model_params, feature_params):
+    """在所有前推折上评估一组参数"""
+    from sklearn.ensemble import RandomForestClassifier
+    
+    X, y, returns, valid = _walk_forward_dataset(feature_params)
+    results = []
+    for (train_start, train_end), (test_start, test_end) in _WALK_FORWARD_STATE['folds']:
+        train_mask = valid[train_start:train_end]
+        test_mask = valid[test_start:test_end]
+        X_train = X[train_start:train_end][train_mask]
+        y_train = y[train_start:train_end][train_mask]
+        X_test = X[test_start:test_end][test_mask]
+        if len(X_train) == 0 or len(X_test) == 0 or len(np.unique(y_train)) < 2:
+            continue
+        
+        model = RandomForestClassifier(n_jobs=1, **model_params)
+        model.fit(X_train, y_train)
+        metrics = fold_metrics(y[test_start:test_end][test_mask], model.predict(X_test),
+                               returns[test_start:test_end][test_mask])
+        metrics['train'] = [int(train_start), int(train_end)]
+        metrics['test'] = [int(test_start), int(test_end)]
+        results.append(metrics)
+    
+    summary = {}
+    for key in ('accuracy', 'precision', 'return_weighted_accuracy', 'strategy_return'):
+        summary[key] = float(np.mean([r[key] for r in results])) if results else 0.0
+    return {
+        'model_params': model_params,
+        'feature_params': feature_params,
+        'folds': results,
+        'summary': summary
+    }
+
+
+def expand_param_grid(grid):
+    """展开参数网格为参数字典列表"""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def hyperparameter_search(df, model_grid=None, feature_grid=None, search='grid', n_iter=20,
+                          n_folds=5, test_size=None, gap=0, max_workers=None,
+                          score_metric='return_weighted_accuracy', seed=42):
+    """多进程并行的前推验证参数搜索，返回按得分排序的结果"""
+    model_grid = model_grid or DEFAULT_MODEL_GRID
+    feature_grid = feature_grid or DEFAULT_FEATURE_GRID
+    
+    folds = walk_forward_splits(len(df), n_folds=n_folds, test_size=test_size, gap=gap)
+    if not folds:
+        raise ValueError("历史数据不足，无法划分前推验证折")
+    
+    tasks = [(dict(DEFAULT_MODEL_PARAMS, **m), dict(DEFAULT_FEATURE_PARAMS, **f))
+             for f in expand_param_grid(feature_grid) for m in expand_param_grid(model_grid)]
+    if search == 'random' and n_iter < len(tasks):
+        tasks = random.Random(seed).sample(tasks, n_iter)
+        # 相同特征参数的任务相邻提交，提高进程内特征缓存命中率
+        tasks.sort(key=lambda t: sorted(t[1].items()))
+    
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    close = df['close'].astype(float).values
+    volume = df['volume'].astype(float).values
+    results = []
+    # 搜索从 Tk 后台线程发起，fork 不安全，统一用 spawn
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_walk_forward_init,
+                             initargs=(close, volume, folds),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(evaluate_walk_forward, m, f) for m, f in tasks]
+        for future in as_completed(futures):
+            results.append(future.result())
+    
+    results.sort(key=lambda r: r['summary'][score_metric], reverse=True)
+    return results
+
+
+class OnlineSignalModel:
+    """在线逻辑回归分类器，随每根收盘K线增量更新，内存占用固定"""
+
+    def __init__(self, decay=0.01, learning_rate=0.05, l2=1e-4):
+        self.decay = decay  # 标准化统计量的指数衰减系数，越大越快遗忘旧数据
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.classes_ = (0, 1)
+        self.n_features = None
+        self.n_updates = 0
+        self.last_timestamps = {}  # (交易对, 周期) -> 最后一根参与训练的K线时间
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        # 旧版本只记录一个不分交易对的时间，无法判断属于哪个序列，丢弃
+        state.pop('last_timestamp', None)
+        state.setdefault('last_timestamps', {})
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _init_state(self, n_features):
+        """初始化权重和标准化统计量"""
+        self.n_features = n_features
+        self.mean = np.zeros(n_features)
+        self.var = np.zeros(n_features)
+        self.coef = np.zeros(n_features)
+        self.intercept = 0.0
+
+    def _scale(self, X):
+        """按当前统计量标准化特征"""
+        z = (X - self.mean) / np.sqrt(self.var + 1e-12)
+        return np.clip(z, -10, 10)
+
+    def _partial_fit(self, X, y):
+        """partial_fit 的实现，调用方需持有 self._lock"""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        y = np.asarray(y, dtype=float).ravel()
+        if self.n_features is None:
+            self._init_state(X.shape[1])
+        for x, target in zip(X, y):
+            if not np.isfinite(x).all():
+                continue
+            # 样本较少时退化为普通均值方差，之后按 decay 指数遗忘
+            alpha = max(self.decay, 1.0 / (self.n_updates + 1))
+            diff = x - self.mean
+            self.mean += alpha * diff
+            self.var = (1 - alpha) * (self.var + alpha * diff * diff)
+            
+            z = self._scale(x)
+            p = 1.0 / (1.0 + np.exp(-(z @ self.coef + self.intercept)))
+            error = p - target
+            self.coef -= self.learning_rate * (error * z + self.l2 * self.coef)
+            self.intercept -= self.learning_rate * error
+            self.n_updates += 1
+
+    def partial_fit(self, X, y):
+        """按时间顺序逐样本更新模型"""
+        with self._lock:
+            self._partial_fit(X, y)
+        return self
+
+    def learn(self, key, X, y, timestamps):
+        """只学习 key（交易对, 周期）上还没有学过的K线，timestamps 为各行的K线时间，返回学习的行数"""
+        timestamps = pd.Index(timestamps)
+        # 过滤、训练和记录时间要在同一把锁内完成，否则两个线程可能把同一批K线各学一遍
+        with self._lock:
+            last = self.last_timestamps.get(key)
+            if last is not None:
+                new_rows = np.asarray(timestamps > last)
+                X, y, timestamps = np.asarray(X)[new_rows], np.asarray(y)[new_rows], timestamps[new_rows]
+            if len(timestamps) == 0:
+                return 0
+            self._partial_fit(X, y)
+            self.last_timestamps[key] = timestamps[-1]
+        return len(timestamps)
+
+    def predict_proba(self, X):
+        """预测各类别概率"""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        with self._lock:
+            if self.n_features is None:
+                p = np.full(len(X), 0.5)
+            else:
+                p = 1.0 / (1.0 + np.exp(-(self._scale(X) @ self.coef + self.intercept)))
+        return np.column_stack([1 - p, p])
+
+    def predict(self, X):
+        """预测类别"""
+        return np.asarray(self.classes_)[(self.predict_proba(X)[:, 1] > 0.5).astype(int)]
+
+
+class SymbolIndex:
+    """交易对的内存检索索引，支持前缀二分查找和子序列模糊匹配"""
+
+    def __init__(self, symbols):
+        self.symbols = sorted(symbols)
+        self._compact = [self.normalize(sym) for sym in self.symbols]
+        
+        # 同时索引原始写法和去掉分隔符的写法，如 ETH/USDT 和 ETHUSDT
+        entries = set()
+        for sym, compact in zip(self.symbols, self._compact):
+            entries.add((sym.upper(), sym))
+            entries.add((compact, sym))
+        entries = sorted(entries)
+        self._keys = [key for key, _ in entries]
+        self._values = [sym for _, sym in entries]
+
+    @staticmethod
+    def normalize(text):
+        """统一大小写并去掉分隔符"""
+        return text.upper().replace('/', '').replace(':', '').replace('-', '')
+
+    def prefix(self, text, limit=50):
+        """前缀匹配"""
+        query = text.strip().upper()
+        results = []
+        seen = set()
+        for q in (query, self.normalize(query)):
+            lo = bisect.bisect_left(self._keys, q)
+            hi = bisect.bisect_right(self._keys, q + '\uffff')
+            for sym in self._values[lo:hi]:
+                if sym not in seen:
+                    seen.add(sym)
+                    results.append(sym)
+        # 短的交易对优先，BTC 应先于 BTCDOM
+        results.sort(key=lambda sym: (len(sym), sym))
+        return results[:limit]
+
+    def search(self, text, limit=50):
+        """先前缀匹配，不足时补充子序列模糊匹配"""
+        query = self.normalize(text.strip())
+        if not query:
+            return self.symbols[:limit]
+        
+        results = self.prefix(text, limit)
+        if len(results) < limit:
+            seen = set(results)
+            for sym, compact in zip(self.symbols, self._compact):
+                if sym in seen:
+                    continue
+                chars = iter(compact)
+                if all(c in chars for c in query):
+                    results.append(sym)
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+# 价格精度的表示方式，与 ccxt 的 precisionMode 常量取值一致
+PRECISION_DECIMAL_PLACES = 2  # 精度为小数位数
+PRECISION_SIGNIFICANT_DIGITS = 3  # 精度为有效数字位数
+PRECISION_TICK_SIZE = 4  # 精度为最小变动价位
+
+
+class MarketCatalog:
+    """交易对元数据（精度、限制、状态）的磁盘缓存，过期后在后台刷新"""
+
+    def __init__(self, cache_file='markets_cache.json', ttl=6 * 3600):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.markets = {}
+        self.fetched_at = 0
+        self.precision_mode = None  # 交易所的 precisionMode，旧缓存中没有时为 None
+        self.index = SymbolIndex([])
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def load_cache(self):
+        """从磁盘加载缓存，返回是否加载成功"""
+        if not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            self._set_markets(cache.get('markets', {}), cache.get('fetched_at', 0), cache.get('precision_mode'))
+            return True
+        except Exception as e:
+            print(f"加载交易对缓存错误: {str(e)}")
+            return False
+
+    def is_stale(self):
+        """缓存是否已过期"""
+        return time.time() - self.fetched_at > self.ttl
+
+    def _set_markets(self, markets, fetched_at, precision_mode=None):
+        index = SymbolIndex([sym for sym, m in markets.items() if m.get('active', True) is not False])
+        with self._lock:
+            self.markets = markets
+            self.fetched_at = fetched_at
+            self.precision_mode = precision_mode
+            self.index = index
+
+    @staticmethod
+    def extract(market):
+        """只保留界面和下单需要的字段"""
+        info = market.get('info') or {}
+        return {
+            'base': market.get('base'),
+            'quote': market.get('quote'),
+            'type': market.get('type'),
+            'active': market.get('active'),
+            'status': info.get('status') if isinstance(info, dict) else None,
+            'precision': market.get('precision') or {},
+            'limits': market.get('limits') or {}
+        }
+
+    def refresh(self, load_markets, precision_mode=None):
+        """从交易所重新获取元数据并写入缓存
+
+        precision_mode 为交易所的 precisionMode，也可以是返回它的函数（在刷新线程中调用，
+        以免在界面线程中创建交易所实例）。
+        """
+        raw = load_markets()
+        if callable(precision_mode):
+            precision_mode = precision_mode()
+        markets = {symbol: self.extract(market) for symbol, market in raw.items()}
+        fetched_at = time.time()
+        
+        # 先写临时文件再替换，避免缓存文件写坏
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'fetched_at': fetched_at, 'precision_mode': precision_mode, 'markets': markets},
+                      f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+        
+        self._set_markets(markets, fetched_at, precision_mode)
+
+    def refresh_async(self, load_markets, on_done=None, precision_mode=None):
+        """在后台线程刷新，已有刷新在进行时直接返回"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        
+        def worker():
+            try:
+                self.refresh(load_markets, precision_mode)
+                if on_done:
+                    on_done()
+            except Exception as e:
+                print(f"刷新交易对列表错误: {str(e)}")
+            finally:
+                self._refreshing = False
+        
+        threading.Thread(target=worker, daemon=True).start()
+
+    def symbols(self):
+        """所有可用交易对"""
+        return self.index.symbols
+
+    def get(self, symbol):
+        """获取单个交易对的元数据"""
+        return self.markets.get(symbol)
+
+    def price_digits(self, symbol, default=2):
+        """根据价格精度返回显示的小数位数"""
+        precision = (self.markets.get(symbol) or {}).get('precision', {}).get('price')
+        if precision is None or precision < 0:
+            return default
+        mode = self.precision_mode
+        if mode is None:
+            # 旧缓存没有记录模式：不小于1的整数按小数位数处理，否则按最小变动价位处理
+            mode = PRECISION_DECIMAL_PLACES if float(precision).is_integer() and precision >= 1 else PRECISION_TICK_SIZE
+        if mode == PRECISION_DECIMAL_PLACES:
+            return int(precision)
+        if mode != PRECISION_TICK_SIZE or precision == 0:
+            return default
+        # 最小变动价位的小数位数，如 0.01 -> 2、0.025 -> 3、1 -> 0
+        return max(0, -decimal.Decimal(repr(float(precision))).normalize().as_tuple().exponent)
+
+# 请求优先级，数值越小越优先
+PRIORITY_LIVE = 0       # 实时行情
+PRIORITY_MTF = 1        # 多时间框架刷新
+PRIORITY_BACKFILL = 2   # 补数据、元数据
+PRIORITY_HISTORY = 3    # 历史数据下载
+
+# 各接口的请求权重（参考币安现货REST接口权重）
+REQUEST_WEIGHTS = {
+    'load_markets': 20,
+    'load_time_difference': 1,
+    'fetch_time': 1,
+    'fetch_ticker': 2,
+    'fetch_trades': 2
+}
+
+
+def estimate_request_weight(method, kwargs):
+    """估算一次交易所请求消耗的权重"""
+    limit = kwargs.get('limit')
+    if method == 'fetch_ohlcv':
+        limit = limit or 500
+        if limit < 100:
+            return 1
+        if limit < 500:
+            return 2
+        return 5 if limit <= 1000 else 10
+    if method == 'fetch_order_book':
+        limit = limit or 100
+        if limit <= 100:
+            return 5
+        if limit <= 500:
+            return 25
+        return 50 if limit <= 1000 else 250
+    return REQUEST_WEIGHTS.get(method, 1)
+
+
+def is_rate_limit_error(error):
+    """判断异常是否为限流（429/418）"""
+    if isinstance(error, (ccxt.RateLimitExceeded, ccxt.DDoSProtection)):
+        return True
+    text = str(error)
+    return '429' in text or '418' in text
+
+
+class RequestScheduler:
+    """全局交易所请求调度器：按权重令牌桶限流、按优先级出队、合并相同的在途请求"""
+
+    def __init__(self, weight_limit=1200, window=60.0, safety=0.9, burst_ratio=0.1, max_workers=4):
+        self.weight_limit = weight_limit  # 整个 IP 的每分钟权重额度
+        self.reserved = 0  # 让给其他进程的额度
+        self.window = window
+        self.safety = safety
+        self.burst_ratio = burst_ratio
+        self._configure()
+        self.tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        
+        self._queue = []
+        self._inflight = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exchange')
+        self.stats = {'requests': 0, 'coalesced': 0, 'rate_limited': 0, 'weight': 0}
+        
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def _configure(self):
+        budget = max(0, self.weight_limit - self.reserved)
+        self.rate = max(budget * self.safety / self.window, 1e-3)  # 每秒补充的权重
+        self.capacity = max(1.0, budget * self.burst_ratio)
+        self.tokens = min(getattr(self, 'tokens', self.capacity), self.capacity)
+
+    def set_weight_limit(self, weight_limit):
+        """按交易所公布的每分钟权重额度调整限流速度"""
+        with self._cond:
+            self.weight_limit = weight_limit
+            self._configure()
+            self._cond.notify()
+
+    def reserve(self, weight):
+        """把 weight 的额度让给同一 IP 下的其他进程，之后用 release 归还"""
+        with self._cond:
+            self.reserved += weight
+            self._configure()
+
+    def release(self, weight):
+        with self._cond:
+            self.reserved = max(0, self.reserved - weight)
+            self._configure()
+            self._cond.notify()
+
+    @staticmethod
+    def request_key(func, args, kwargs):
+        """相同对象上的相同方法和参数视为同一请求"""
+        owner = getattr(func, '__self__', None)
+        return repr((id(owner), getattr(func, '__name__', func), args, sorted(kwargs.items())))
+
+    def submit(self, func, *args, priority=PRIORITY_BACKFILL, weight=None, **kwargs):
+        """提交请求，返回 Future；相同请求在途时返回同一个 Future"""
+        if weight is None:
+            weight = estimate_request_weight(getattr(func, '__name__', ''), kwargs)
+        key = self.request_key(func, args, kwargs)
+        
+        with self._cond:
+            request = self._inflight.get(key)
+            if request is not None:
+                self.stats['coalesced'] += 1
+                # 更高优先级的请求合并进来时提升排队位置
+                if not request['dispatched'] and priority < request['priority']:
+                    request['priority'] = priority
+                    heapq.heappush(self._queue, (priority, next(self._seq), request))
+                    self._cond.notify()
+                return request['future']
+            
+            request = {
+                'key': key,
+                'func': func,
+                'args': args,
+                'kwargs': kwargs,
+                'priority': priority,
+                'weight': weight,
+                'future': Future(),
+                'dispatched': False
+            }
+            self._inflight[key] = request
+            heapq.heappush(self._queue, (priority, next(self._seq), request))
+            self._cond.notify()
+        return request['future']
+
+    def call(self, func, *args, priority=PRIORITY_BACKFILL, weight=None, timeout=None, **kwargs):
+        """提交请求并等待结果"""
+        return self.submit(func, *args, priority=priority, weight=weight, **kwargs).result(timeout)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        return now
+
+    def _dispatch(self):
+        """调度线程：按优先级取请求，等待令牌足够后交给线程池执行"""
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                
+                priority, _, request = self._queue[0]
+                if request['dispatched'] or priority != request['priority']:
+                    heapq.heappop(self._queue)
+                    continue
+                
+                now = self._refill()
+                # 超过桶容量的大请求在桶满时放行，之后以负余额偿还
+                need = min(request['weight'], self.capacity)
+                wait = max(self._paused_until - now, (need - self.tokens) / self.rate)
+                if wait > 0:
+                    # 等待期间可能有更高优先级的请求到达，醒来后重新选择
+                    self._cond.wait(wait)
+                    continue
+                
+                heapq.heappop(self._queue)
+                request['dispatched'] = True
+                self.tokens -= request['weight']
+                self.stats['requests'] += 1
+                self.stats['weight'] += request['weight']
+            self._executor.submit(self._execute, request)
+
+    def _execute(self, request):
+        """执行请求并根据响应头校准剩余额度"""
+        future = request['future']
+        try:
+            result = request['func'](*request['args'], **request['kwargs'])
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.penalize()
+            result = None
+            error = e
+        else:
+            error = None
+        finally:
+            with self._cond:
+                if self._inflight.get(request['key']) is request:
+                    del self._inflight[request['key']]
+            self._sync_used_weight(getattr(request['func'], '__self__', None))
+        
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _sync_used_weight(self, exchange):
+        """根据 x-mbx-used-weight-1m 响应头同步服务器端已用权重"""
+        headers = getattr(exchange, 'last_response_headers', None)
+        if not headers:
+            return
+        try:
+            used = int(headers.get('x-mbx-used-weight-1m') or headers.get('X-MBX-USED-WEIGHT-1M'))
+        except (TypeError, ValueError):
+            return
+        
+        with self._cond:
+            self._refill()
+            # 已用权重是整个 IP 的总和，与总额度比较
+            remaining = self.weight_limit * self.safety - used
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0:
+                # 本分钟额度已用完，暂停到下一个统计窗口
+                self._paused_until = time.monotonic() + (self.window - time.time() % self.window)
+            self._cond.notify()
+
+    def penalize(self, seconds=None):
+        """收到限流响应后暂停所有请求"""
+        with self._cond:
+            self.stats['rate_limited'] += 1
+            self._paused_until = time.monotonic() + (seconds or self.window)
+            self.tokens = min(self.tokens, 0)
+            self._cond.notify()
+
+    def stop(self):
+        """停止调度线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False)
+
+
+def exchange_weight_limit(exchange, default=1200):
+    """交易所每分钟的请求权重额度，由 ccxt 的 rateLimit（每单位权重的最小间隔毫秒数）换算"""
+    rate_limit = getattr(exchange, 'rateLimit', None)
+    if not rate_limit or rate_limit <= 0:
+        return default
+    return int(60000 / rate_limit)
+
+
+# 币安现货API的备用域名，主域名请求过慢时向备用域名发出对冲请求
+BINANCE_API_HOST = 'api.binance.com'
+BINANCE_ALTERNATE_HOSTS = ['api1.binance.com', 'api2.binance.com', 'api3.binance.com', 'api4.binance.com']
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """带完全抖动的指数退避时间"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def replace_api_host(urls, host):
+    """将交易所URL配置中的API域名替换为备用域名"""
+    if isinstance(urls, dict):
+        return {key: replace_api_host(value, host) for key, value in urls.items()}
+    if isinstance(urls, list):
+        return [replace_api_host(value, host) for value in urls]
+    if isinstance(urls, str):
+        return urls.replace(BINANCE_API_HOST, host)
+    return urls
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出"""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"{endpoint} 熔断中，{retry_after:.0f} 秒后重试")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """单个接口的熔断器：连续失败达到阈值后打开，冷却后放行一次试探请求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否允许发出请求"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            return self.state == 'closed'
+
+    def retry_after(self):
+        """距离允许试探请求的剩余秒数"""
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class ResilientFetcher:
+    """带重试退避、按接口熔断和备用域名对冲请求的交易所访问层"""
+
+    def __init__(self, scheduler, primary, alternates, max_attempts=3,
+                 hedge_min_delay=0.5, hedge_max_delay=5.0):
+        self.scheduler = scheduler
+        self.primary = primary        # 返回主交易所实例的函数
+        self.alternates = alternates  # 返回备用域名交易所实例列表的函数
+        self.max_attempts = max_attempts
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.breakers = {}
+        self.latency = None  # 请求耗时的指数移动平均
+        self._next_alternate = 0
+        self.stats = {'retries': 0, 'hedged': 0, 'hedge_wins': 0, 'circuit_open': 0}
+
+    def breaker(self, endpoint):
+        """获取接口对应的熔断器"""
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker()
+        return self.breakers[endpoint]
+
+    @staticmethod
+    def is_retryable(error):
+        """网络类错误可以重试，参数或权限错误不重试"""
+        return isinstance(error, (ccxt.NetworkError, OSError))
+
+    def fetch(self, method, *args, priority=PRIORITY_LIVE, endpoint=None, **kwargs):
+        """带熔断、重试和对冲的请求"""
+        endpoint = endpoint or method
+        breaker = self.breaker(endpoint)
+        for attempt in range(self.max_attempts):
+            if not breaker.allow():
+                self.stats['circuit_open'] += 1
+                raise CircuitOpenError(endpoint, breaker.retry_after())
+            try:
+                result = self._hedged(method, args, kwargs, priority)
+                breaker.record_success()
+                return result
+            except Exception as e:
+                breaker.record_failure()
+                if not self.is_retryable(e) or attempt == self.max_attempts - 1:
+                    raise
+                self.stats['retries'] += 1
+                time.sleep(backoff_delay(attempt))
+
+    def _hedge_delay(self):
+        """主请求超过约两倍平均耗时仍未返回时发出对冲请求"""
+        if self.latency is None:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, self.latency * 2))
+
+    def _hedged(self, method, args, kwargs, priority):
+        start = time.monotonic()
+        primary = self.scheduler.submit(getattr(self.primary(), method), *args,
+                                        priority=priority, **kwargs)
+        futures = [primary]
+        done, _ = wait(futures, timeout=self._hedge_delay())
+        
+        alternates = self.alternates()
+        if not done and alternates:
+            exchange = alternates[self._next_alternate % len(alternates)]
+            self._next_alternate += 1
+            self.stats['hedged'] += 1
+            futures.append(self.scheduler.submit(getattr(exchange, method), *args,
+                                                 priority=priority, **kwargs))
+        
+        # 取最先成功的结果；全部失败时抛出主请求的异常
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self.stats['hedge_wins'] += 1
+                    self._record_latency(time.monotonic() - start)
+                    return future.result()
+        return primary.result()
+
+    def _record_latency(self, seconds):
+        self.latency = seconds if self.latency is None else self.latency * 0.8 + seconds * 0.2
+
+
+class ExchangeTransport:
+    """交易所共用的持久HTTP连接池，只在代理设置变化时重建"""
+
+    def __init__(self, pool_connections=4, pool_maxsize=10):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.signature = None
+        self.session = None
+        self.adapter = None
+        self.proxies = None
+        self.rebuilds = 0
+        self._retired = {'requests': 0, 'connections': 0, 'tls_handshakes': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_proxies(use_proxy, proxy_type, host, port):
+        """根据代理设置生成 requests 的代理配置"""
+        if not use_proxy:
+            return None
+        # socks5h 由代理端解析域名
+        scheme = 'socks5h' if proxy_type == 'socks5' else 'http'
+        proxy = f'{scheme}://{host}:{port}'
+        return {'http': proxy, 'https': proxy}
+
+    def configure(self, use_proxy, proxy_type, host, port):
+        """应用代理设置，设置未变化时不做任何事；返回是否重建了连接池"""
+        import requests
+        
+        signature = (use_proxy, proxy_type, host, port) if use_proxy else (False,)
+        with self._lock:
+            if signature == self.signature and self.session is not None:
+                return False
+            
+            if use_proxy and proxy_type == 'socks5':
+                try:
+                    import socks  # noqa: F401
+                except ImportError:
+                    print("使用SOCKS代理需要安装 PySocks (pip install requests[socks])")
+            
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                    pool_maxsize=self.pool_maxsize,
+                                                    max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            
+            # 旧连接池的计数累加保留，然后关闭
+            if self.session is not None:
+                for key, value in self._pool_stats().items():
+                    self._retired[key] += value
+                self.session.close()
+            
+            self.session = session
+            self.adapter = adapter
+            self.proxies = self.build_proxies(use_proxy, proxy_type, host, port)
+            self.signature = signature
+            self.rebuilds += 1
+            return True
+
+    def attach(self, exchange):
+        """让交易所实例使用共享的连接池和代理"""
+        exchange.session = self.session
+        exchange.proxies = self.proxies
+
+    @staticmethod
+    def detach(exchange):
+        """丢弃交易所实例前先解除共享连接池：ccxt 在实例回收时会关闭 exchange.session"""
+        if exchange is not None:
+            exchange.session = None
+
+    def _pools(self):
+        """遍历连接池（直连和经代理的）"""
+        managers = [self.adapter.poolmanager] + list(self.adapter.proxy_manager.values())
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def _pool_stats(self):
+        stats = {'requests': 0, 'connections': 0, 'tls_handshakes': 0}
+        if self.adapter is None:
+            return stats
+        for pool in self._pools():
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+            if pool.scheme == 'https':
+                stats['tls_handshakes'] += pool.num_connections
+        return stats
+
+    def stats(self):
+        """连接复用统计：请求数、新建连接数、复用次数、TLS握手次数、重建次数"""
+        with self._lock:
+            current = self._pool_stats()
+            totals = {key: current[key] + self._retired[key] for key in current}
+        totals['reused'] = max(0, totals['requests'] - totals['connections'])
+        totals['rebuilds'] = self.rebuilds
+        return totals
+
+# 各周期K线内的刷新间隔（秒）；收盘时刻另外对齐唤醒
+DEFAULT_REFRESH_INTERVALS = {
+    '1s': 1,
+    '5s': 1,
+    '15s': 2,
+    '1m': 5,
+    '5m': 15,
+    '15m': 30,
+    '30m': 60,
+    '1h': 120,
+    '4h': 300,
+    '1d': 900,
+    '1w': 3600
+}
+TIMEFRAME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+# 由逐笔成交在本地聚合的秒级周期，交易所K线接口不提供
+TRADE_TIMEFRAMES = ('1s', '5s', '15s')
+TRADE_BACKFILL_PAGES = 5  # 两次轮询之间漏掉成交时，每轮最多按编号向后补取的页数
+
+
+def timeframe_to_seconds(timeframe):
+    """将周期字符串转换为秒数，如 '15m' -> 900"""
+    return int(timeframe[:-1]) * TIMEFRAME_UNITS[timeframe[-1]]
+
+
+def kline_timeframe(timeframe):
+    """交易所K线接口可用的周期：本地聚合的秒级周期退回到 1m"""
+    return '1m' if timeframe in TRADE_TIMEFRAMES else timeframe
+
+
+class CandleClock:
+    """按交易所服务器时间计算K线收盘时刻和下一次唤醒时间"""
+
+    # 币安周线从周一 00:00 UTC 开始，而 Unix 纪元是周四
+    WEEK_ORIGIN_MS = 4 * 86400 * 1000
+
+    def __init__(self, close_delay=1.5):
+        self.close_delay = close_delay  # 收盘后稍等再取数据，确保交易所已生成收盘K线
+        self.offset_ms = 0  # 服务器时间 - 本地时间
+
+    def sync(self, exchange):
+        """从 load_time_difference 的结果同步服务器时间偏差"""
+        difference = exchange.options.get('timeDifference')
+        if difference is not None:
+            self.offset_ms = -difference
+
+    def server_time_ms(self):
+        """当前服务器时间（毫秒）"""
+        return time.time() * 1000 + self.offset_ms
+
+    def next_close_ms(self, timeframe, now_ms=None):
+        """下一根K线的收盘时间（毫秒）"""
+        if now_ms is None:
+            now_ms = self.server_time_ms()
+        period = timeframe_to_seconds(timeframe) * 1000
+        origin = self.WEEK_ORIGIN_MS if timeframe.endswith('w') else 0
+        return ((now_ms - origin) // period + 1) * period + origin
+
+    def next_wakeup(self, timeframe, refresh_interval):
+        """返回 (等待秒数, 是否为收盘唤醒)"""
+        now_ms = self.server_time_ms()
+        close_wakeup = self.next_close_ms(timeframe, now_ms) + self.close_delay * 1000
+        if close_wakeup - now_ms <= refresh_interval * 1000:
+            return (close_wakeup - now_ms) / 1000, True
+        return refresh_interval, False
+
+
+class TradeCandleBuilder:
+    """由逐笔成交聚合秒级K线：OHLC、成交量、VWAP，以及主动买入/卖出量
+
+    每批成交只排序一次，再按时间桶用 reduceat 向量化聚合；与最后一根未收盘K线同桶的成交并入该K线。
+    没有成交的时间段补一根开高低收都等于前收盘价的无量K线，保证时间轴连续。
+    只保留最近 max_candles 根。成交编号为连续整数时，编号不连续说明有成交没取到，
+    计入 missed_trades，相应K线的量价并不完整。
+    """
+
+    COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume',
+               'buy_volume', 'sell_volume', 'quote_volume')
+
+    def __init__(self, timeframe, max_candles=1000):
+        self.timeframe = timeframe
+        self.interval = timeframe_to_seconds(timeframe) * 1000
+        self.max_candles = max_candles
+        self.data = np.empty((0, len(self.COLUMNS)))
+        self.last_trade = None  # 已处理的最新成交 (时间戳, 编号)
+        self.last_keys = set()  # 没有整数编号时，最新时间戳上已处理成交的标识
+        self.trades = 0
+        self.missed_trades = 0
+
+    @property
+    def next_id(self):
+        """下一笔应当收到的成交编号，没有整数编号时为 None"""
+        if self.last_trade is None or self.last_trade[1] is None:
+            return None
+        return self.last_trade[1] + 1
+
+    def add_trades(self, trades):
+        """写入 fetch_trades 返回的成交列表，忽略已处理过的成交，返回新处理的成交数"""
+        if not trades:
+            return 0
+        count = len(trades)
+        timestamps = np.fromiter((trade['timestamp'] for trade in trades), dtype=np.int64, count=count)
+        prices = np.fromiter((trade['price'] for trade in trades), dtype=float, count=count)
+        amounts = np.fromiter((trade['amount'] for trade in trades), dtype=float, count=count)
+        buys = np.fromiter((trade.get('side') == 'buy' for trade in trades), dtype=bool, count=count)
+        try:
+            ids = np.fromiter((int(trade['id']) for trade in trades), dtype=np.int64, count=count)
+            keys = None
+        except (KeyError, TypeError, ValueError):
+            ids = None
+            keys = [trade.get('id') for trade in trades]
+        return self.add_arrays(timestamps, prices, amounts, buys, ids, keys)
+
+    def add_arrays(self, timestamps, prices, amounts, buys, ids=None, keys=None):
+        """写入成交数组（逐笔推送也可以攒成一批后调用），buys 为主动买入标记
+
+        ids 为整数成交编号；没有时可以用 keys 给出任意可哈希的成交标识，
+        都没有时以 (价格, 数量, 方向) 区分同一毫秒内的成交。
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        prices = np.asarray(prices, dtype=float)
+        amounts = np.asarray(amounts, dtype=float)
+        buys = np.asarray(buys, dtype=bool)
+        if keys is None or None in keys:
+            keys = None if ids is not None else list(zip(prices.tolist(), amounts.tolist(), buys.tolist()))
+        
+        # 轮询的成交列表互相重叠，按编号去掉已处理的部分；没有编号时按时间，
+        # 与上次最新成交同一毫秒的成交再按标识去重
+        if self.last_trade is not None:
+            last_timestamp, last_id = self.last_trade
+            if ids is not None and last_id is not None:
+                keep = ids > last_id
+            else:
+                keep = timestamps > last_timestamp
+                for i in np.flatnonzero(timestamps == last_timestamp):
+                    keep[i] = keys is None or keys[i] not in self.last_keys
+            timestamps, prices, amounts, buys = timestamps[keep], prices[keep], amounts[keep], buys[keep]
+            if ids is not None:
+                ids = ids[keep]
+            else:
+                keys = [key for key, kept in zip(keys, keep) if kept]
+        if len(timestamps) == 0:
+            return 0
+        if ids is not None and self.next_id is not None and ids.min() > self.next_id:
+            self.missed_trades += int(ids.min() - self.next_id)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, prices, amounts, buys = timestamps[order], prices[order], amounts[order], buys[order]
+        if ids is not None:
+            ids = ids[order]
+        else:
+            keys = [keys[i] for i in order]
+        
+        buckets = timestamps // self.interval * self.interval
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)] - 1
+        buy_amounts = np.where(buys, amounts, 0.0)
+        candles = np.column_stack([
+            buckets[starts].astype(float),
+            prices[starts],
+            np.maximum.reduceat(prices, starts),
+            np.minimum.reduceat(prices, starts),
+            prices[ends],
+            np.add.reduceat(amounts, starts),
+            np.add.reduceat(buy_amounts, starts),
+            np.add.reduceat(amounts - buy_amounts, starts),
+            np.add.reduceat(prices * amounts, starts),
+        ])
+        self._append(candles)
+        if ids is not None:
+            self.last_trade = (int(timestamps[-1]), int(ids.max()))
+        else:
+            last_timestamp = int(timestamps[-1])
+            if self.last_trade is None or self.last_trade[0] != last_timestamp:
+                self.last_keys = set()
+            self.last_keys.update(keys[i] for i in np.flatnonzero(timestamps == last_timestamp))
+            self.last_trade = (last_timestamp, None)
+        self.trades += len(timestamps)
+        return len(timestamps)
+
+    def _append(self, candles):
+        if len(self.data):
+            last = self.data[-1]
+            # 迟到的成交落在已经过去的K线中，直接丢弃
+            candles = candles[candles[:, 0] >= last[0]]
+            if len(candles) and candles[0, 0] == last[0]:
+                first = candles[0]
+                last[2] = max(last[2], first[2])
+                last[3] = min(last[3], first[3])
+                last[4] = first[4]
+                last[5:] += first[5:]
+                candles = candles[1:]
+            if len(candles) == 0:
+                return
+            # 中断太久时不补空K线，直接重新开始
+            if (candles[0, 0] - last[0]) / self.interval > self.max_candles:
+                self.data = np.empty((0, len(self.COLUMNS)))
+            else:
+                candles = np.vstack([last[None, :], candles])
+                self.data = self.data[:-1]
+        self.data = np.vstack([self.data, self._fill_gaps(candles)])[-self.max_candles:]
+
+    def _fill_gaps(self, candles):
+        """补齐时间桶之间缺失的K线，用前收盘价作为开高低收"""
+        positions = ((candles[:, 0] - candles[0, 0]) // self.interval).astype(np.int64)
+        if positions[-1] == len(candles) - 1:
+            return candles
+        filled = np.zeros((positions[-1] + 1, candles.shape[1]))
+        present = np.zeros(len(filled), dtype=bool)
+        present[positions] = True
+        filled[positions] = candles
+        source = np.maximum.accumulate(np.where(present, np.arange(len(filled)), 0))
+        gaps = ~present
+        filled[gaps, 1:5] = filled[source[gaps], 4][:, None]
+        filled[:, 0] = candles[0, 0] + np.arange(len(filled)) * self.interval
+        return filled
+
+    def ohlcv(self, limit=None):
+        """与 fetch_ohlcv 相同格式的 [时间戳, 开, 高, 低, 收, 量] 列表"""
+        data = self.data if limit is None else self.data[-limit:]
+        return [[int(row[0])] + row[1:6].tolist() for row in data]
+
+    def frame(self):
+        """含 VWAP 和主动买卖量的 DataFrame"""
+        df = pd.DataFrame(self.data, columns=self.COLUMNS)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df['vwap'] = np.where(df['volume'] > 0, df['quote_volume'] / df['volume'], df['close'])
+        df['timestamp'] = pd.to_datetime(df['timestamp'].astype(np.int64), unit='ms')
+        return df.set_index('timestamp')
+
+    def __len__(self):
+        return len(self.data)
+
+
+# 内置信号规则：与原先 check_signals / check_indicators 中的条件一一对应
+# 表达式为 JSON：字符串为数据列（如 close、MA5）或 $参数，数字为常量，{运算符: [参数...]} 为运算
+DEFAULT_SIGNAL_RULES = [
+    {'name': '金叉', 'group': 'ma_cross', 'when': {'cross_above': ['MA5', 'MA10']}},
+    {'name': '死叉', 'group': 'ma_cross', 'when': {'cross_below': ['MA5', 'MA10']}},
+    {'name': '突破布林上轨', 'group': 'bollinger', 'when': {'gt': ['close', 'upper']}},
+    {'name': '突破布林下轨', 'group': 'bollinger', 'when': {'lt': ['close', 'lower']}},
+    {'name': '价格变动上涨', 'group': 'price',
+     'when': {'ge': [{'pct_change': ['close', '$price_bars']}, '$price_threshold']}},
+    {'name': '价格变动下跌', 'group': 'price',
+     'when': {'le': [{'pct_change': ['close', '$price_bars']}, {'neg': '$price_threshold'}]}},
+    {'name': '成交量异常放', 'group': 'volume',
+     'when': {'gt': ['volume', {'mul': [{'sma': ['volume', 20]}, 2]}]}},
+    {'name': '向上突破20日均线', 'group': 'trend', 'when': {'cross_above': ['close', {'sma': ['close', 20]}]}},
+    {'name': '向下突破20日均线', 'group': 'trend', 'when': {'cross_below': ['close', {'sma': ['close', 20]}]}},
+    {'name': 'MACD金叉', 'group': 'macd_cross', 'when': {'cross_above': ['MACD', 'Signal']}},
+    {'name': 'MACD死叉', 'group': 'macd_cross', 'when': {'cross_below': ['MACD', 'Signal']}},
+    # 技术指标：波动大时布林带窗口取10、RSI阈值取80/20，否则取20和70/30
+    {'name': '价格突破布林带上轨，可能回调', 'group': 'indicators',
+     'when': {'gt': ['close', {'where': [{'gt': [{'std': ['close', 20, 0]}, 0.02]},
+                                        {'add': [{'sma': ['close', 10]}, {'mul': [{'std': ['close', 10, 0]}, 2]}]},
+                                        {'add': [{'sma': ['close', 20]}, {'mul': [{'std': ['close', 20, 0]}, 2]}]}]}]}},
+    {'name': '价格跌破布林带下轨，可能反弹', 'group': 'indicators',
+     'when': {'lt': ['close', {'where': [{'gt': [{'std': ['close', 20, 0]}, 0.02]},
+                                        {'sub': [{'sma': ['close', 10]}, {'mul': [{'std': ['close', 10, 0]}, 2]}]},
+                                        {'sub': [{'sma': ['close', 20]}, {'mul': [{'std': ['close', 20, 0]}, 2]}]}]}]}},
+    {'name': 'RSI超买（>80），可能回调', 'group': 'indicators',
+     'when': {'all': [{'gt': [{'std': ['close', 20, 0]}, 0.02]}, {'gt': [{'rsi': ['close', 14]}, 80]}]}},
+    {'name': 'RSI超买（>70），可能回调', 'group': 'indicators',
+     'when': {'all': [{'not': {'gt': [{'std': ['close', 20, 0]}, 0.02]}}, {'gt': [{'rsi': ['close', 14]}, 70]}]}},
+    {'name': 'RSI超卖（<20），可能反弹', 'group': 'indicators',
+     'when': {'all': [{'gt': [{'std': ['close', 20, 0]}, 0.02]}, {'lt': [{'rsi': ['close', 14]}, 20]}]}},
+    {'name': 'RSI超卖（<30），可能反弹', 'group': 'indicators',
+     'when': {'all': [{'not': {'gt': [{'std': ['close', 20, 0]}, 0.02]}}, {'lt': [{'rsi': ['close', 14]}, 30]}]}},
+    {'name': 'OBV上升，可能看涨', 'group': 'indicators', 'when': {'gt': [{'obv': ['close', 'volume']}, 0]}},
+    {'name': 'OBV下降，可能看跌', 'group': 'indicators', 'when': {'lt': [{'obv': ['close', 'volume']}, 0]}},
+    {'name': 'RSI看涨背离', 'group': 'momentum', 'when': {'bullish_divergence': ['high', 'low', 'RSI']}},
+    {'name': 'RSI看跌背离', 'group': 'momentum', 'when': {'bearish_divergence': ['high', 'low', 'RSI']}},
+    {'name': 'RSI隐藏看涨背离', 'group': 'momentum', 'when': {'hidden_bullish_divergence': ['high', 'low', 'RSI']}},
+    {'name': 'RSI隐藏看跌背离', 'group': 'momentum', 'when': {'hidden_bearish_divergence': ['high', 'low', 'RSI']}},
+    {'name': 'MACD看涨背离', 'group': 'momentum', 'when': {'bullish_divergence': ['high', 'low', 'MACD']}},
+    {'name': 'MACD看跌背离', 'group': 'momentum', 'when': {'bearish_divergence': ['high', 'low', 'MACD']}},
+    {'name': 'OBV看涨背离', 'group': 'momentum',
+     'when': {'bullish_divergence': ['high', 'low', {'obv': ['close', 'volume']}]}},
+    {'name': 'OBV看跌背离', 'group': 'momentum',
+     'when': {'bearish_divergence': ['high', 'low', {'obv': ['close', 'volume']}]}},
+]
+
+
+def _rolling(x, window, method, **kwargs):
+    """对 symbols × time 矩阵沿时间轴做滚动计算，窗口内有 NaN 或数据不足时为 NaN"""
+    window = int(window)
+    result = np.full(x.shape, np.nan)
+    if window < 1 or x.shape[1] < window:
+        return result
+    windows = np.lib.stride_tricks.sliding_window_view(x, window, axis=1)
+    result[:, window - 1:] = getattr(windows, method)(axis=-1, **kwargs)
+    return result
+
+
+def _shift(x, periods):
+    """沿时间轴平移，空出的位置填 NaN"""
+    periods = int(periods)
+    result = np.full(x.shape, np.nan)
+    if periods == 0:
+        return x.astype(float)
+    if periods > 0:
+        result[:, periods:] = x[:, :-periods]
+    else:
+        result[:, :periods] = x[:, -periods:]
+    return result
+
+
+def _ema(x, span):
+    return pd.DataFrame(x.T).ewm(span=span, adjust=False).mean().to_numpy().T
+
+
+def _wilder_rsi(close, period):
+    """Wilder 平滑的RSI，与 calculate_rsi 的计算方式一致（前 period 根用首段均值作为种子）"""
+    period = int(period)
+    rsi = np.full(close.shape, np.nan)
+    if close.shape[1] <= period:
+        return rsi
+    deltas = np.diff(close, axis=1)
+    up = np.where(deltas > 0, deltas, 0.0)
+    down = np.where(deltas < 0, -deltas, 0.0)
+    avg_up = up[:, :period].sum(axis=1) / period
+    avg_down = down[:, :period].sum(axis=1) / period
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi[:, :period] = (100. - 100. / (1. + avg_up / avg_down))[:, None]
+        for i in range(period, close.shape[1]):
+            avg_up = (avg_up * (period - 1) + up[:, i - 1]) / period
+            avg_down = (avg_down * (period - 1) + down[:, i - 1]) / period
+            rsi[:, i] = 100. - 100. / (1. + avg_up / avg_down)
+    return rsi
+
+
+def _obv(close, volume):
+    """OBV，首根K线取其成交量，与 calculate_obv 一致"""
+    direction = np.sign(np.diff(close, axis=1))
+    flow = np.concatenate([volume[:, :1], direction * volume[:, 1:]], axis=1)
+    return np.cumsum(flow, axis=1)
+
+
+def _cross(a, b, above):
+    a_prev, b_prev = _shift(a, 1), _shift(b, 1)
+    with np.errstate(invalid='ignore'):
+        if above:
+            return (a_prev <= b_prev) & (a > b)
+        return (a_prev >= b_prev) & (a < b)
+
+
+def _reduce_all(*args):
+    return np.logical_and.reduce(np.broadcast_arrays(*args))
+
+
+def _reduce_any(*args):
+    return np.logical_or.reduce(np.broadcast_arrays(*args))
+
+
+def _compare(op):
+    def compare(a, b):
+        with np.errstate(invalid='ignore'):
+            return op(a, b)
+    return compare
+
+
+def _divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(a, b)
+
+
+def _window_lookback(n, *_):
+    return int(n) - 1
+
+
+def swing_mask(x, order, mode='high'):
+    """S×T 矩阵每行的摆动高/低点：该点是前后各 order 根K线中最高/最低的（相等时取最早的一个）
+
+    最后 order 根K线右侧数据不足，尚不能确认，结果为 False。
+    """
+    x = np.asarray(x, dtype=float)
+    mask = np.zeros(x.shape, dtype=bool)
+    order = int(order)
+    if x.shape[1] < 2 * order + 1:
+        return mask
+    # NaN 在比较中会被当作极值，先替换掉
+    filler = -np.inf if mode == 'high' else np.inf
+    windows = np.lib.stride_tricks.sliding_window_view(np.where(np.isnan(x), filler, x), 2 * order + 1, axis=1)
+    position = windows.argmax(axis=-1) if mode == 'high' else windows.argmin(axis=-1)
+    center = x[:, order:x.shape[1] - order]
+    mask[:, order:x.shape[1] - order] = (position == order) & np.isfinite(center)
+    return mask
+
+
+def swing_points(values, order, mode='high'):
+    """一维序列的摆动高/低点下标，见 swing_mask"""
+    return np.flatnonzero(swing_mask(np.asarray(values, dtype=float)[None, :], order, mode)[0])
+
+
+def _centered_extreme(x, order, mode):
+    """以每个点为中心、前后各 order 根K线内的最高/最低值，忽略 NaN"""
+    filler = -np.inf if mode == 'high' else np.inf
+    pad = np.full((x.shape[0], order), filler)
+    padded = np.concatenate([pad, np.where(np.isnan(x), filler, x), pad], axis=1)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * order + 1, axis=1)
+    extreme = windows.max(axis=-1) if mode == 'high' else windows.min(axis=-1)
+    return np.where(np.isfinite(extreme), extreme, np.nan)
+
+
+def _previous_index(mask):
+    """每个位置之前（不含自身）最近一个 True 的下标，没有时为 -1"""
+    index = np.where(mask, np.arange(mask.shape[1]), -1)
+    latest = np.maximum.accumulate(index, axis=1)
+    return np.concatenate([np.full((mask.shape[0], 1), -1), latest[:, :-1]], axis=1)
+
+
+DIVERGENCE_KINDS = ('regular_bullish', 'regular_bearish', 'hidden_bullish', 'hidden_bearish')
+
+
+def divergence_pairs(high, low, indicator, order=3, max_gap=60):
+    """对 S×T 矩阵的全部历史一次性找出价格与指标的背离
+
+    相邻两个价格摆动高点：价格创新高而指标走低为常规看跌，价格走低而指标走高为隐藏看跌；
+    相邻两个摆动低点：价格创新低而指标走高为常规看涨，价格抬高而指标走低为隐藏看涨。
+    指标取摆动点前后 order 根K线内的最高/最低值，指标拐点与价格错开一两根K线也能匹配。
+    返回 {类型: (行, 前一摆动点, 后一摆动点)} 的下标数组；后一摆动点要再过 order 根K线才确认。
+    """
+    high, low, indicator = (np.asarray(a, dtype=float) for a in (high, low, indicator))
+    order = int(order)
+    pairs = {}
+    for mode, price in (('high', high), ('low', low)):
+        mask = swing_mask(price, order, mode)
+        value = _centered_extreme(indicator, order, mode)
+        previous = _previous_index(mask)
+        rows, current = np.nonzero(mask & (previous >= 0))
+        before = previous[rows, current]
+        keep = current - before <= max_gap
+        rows, current, before = rows[keep], current[keep], before[keep]
+        with np.errstate(invalid='ignore'):
+            price_up = price[rows, current] > price[rows, before]
+            price_down = price[rows, current] < price[rows, before]
+            value_up = value[rows, current] > value[rows, before]
+            value_down = value[rows, current] < value[rows, before]
+        if mode == 'high':
+            kinds = {'regular_bearish': price_up & value_down, 'hidden_bearish': price_down & value_up}
+        else:
+            kinds = {'regular_bullish': price_down & value_up, 'hidden_bullish': price_up & value_down}
+        for kind, selected in kinds.items():
+            pairs[kind] = (rows[selected], before[selected], current[selected])
+    return pairs
+
+
+def _divergence(kind):
+    """规则运算符：在背离被确认的那根K线上为 True"""
+    def divergence(high, low, indicator, order=3, max_gap=60):
+        order = int(order)
+        rows, _, current = divergence_pairs(high, low, indicator, order, int(max_gap))[kind]
+        mask = np.zeros(np.broadcast_shapes(np.shape(high), np.shape(low), np.shape(indicator)), dtype=bool)
+        mask[rows, current + order] = True
+        return mask
+    return divergence
+
+
+class CandleBars:
+    """K线形态用的 OHLC 数组（S×T），实体、影线等派生量只算一次，前几根K线的平移结果按需缓存"""
+
+    def __init__(self, open, high, low, close):
+        self.open, self.high, self.low, self.close = (np.asarray(x, dtype=float) for x in (open, high, low, close))
+        self.body = np.abs(self.close - self.open)
+        self.range = self.high - self.low
+        self.top = np.maximum(self.open, self.close)
+        self.bottom = np.minimum(self.open, self.close)
+        self.upper = self.high - self.top
+        self.lower = self.bottom - self.low
+        self.mid = (self.open + self.close) / 2
+        self.bullish = self.close > self.open
+        self.bearish = self.close < self.open
+        self._previous = {0: self}
+
+    def prev(self, n=1):
+        """前第 n 根K线对齐到当前位置，开头不足的位置为 NaN"""
+        if n not in self._previous:
+            self._previous[n] = CandleBars(*(_shift(x, n) for x in (self.open, self.high, self.low, self.close)))
+        return self._previous[n]
+
+
+def _doji(bars, ratio=0.1):
+    return (bars.range > 0) & (bars.body <= bars.range * ratio)
+
+
+def _hammer(bars, threshold=0.3):
+    # 下影线超过实体两倍，上影线小于实体的 threshold 倍
+    return (bars.lower > 2 * bars.body) & (bars.upper < bars.body * threshold)
+
+
+def _inverted_hammer(bars, threshold=0.3):
+    return (bars.upper > 2 * bars.body) & (bars.lower < bars.body * threshold)
+
+
+def _engulfing(bars, bullish):
+    p = bars.prev(1)
+    if bullish:
+        return p.bearish & bars.bullish & (bars.open < p.close) & (bars.close > p.open)
+    return p.bullish & bars.bearish & (bars.open > p.close) & (bars.close < p.open)
+
+
+def _harami(bars, bullish):
+    p = bars.prev(1)
+    if bullish:
+        return p.bearish & bars.bullish & (bars.open > p.close) & (bars.close < p.open)
+    return p.bullish & bars.bearish & (bars.open < p.close) & (bars.close > p.open)
+
+
+def _piercing(bars, bullish):
+    """刺透形态 / 乌云盖顶：反向开盘后收回前一根实体的一半以上"""
+    p = bars.prev(1)
+    if bullish:
+        return p.bearish & bars.bullish & (bars.open < p.close) & (bars.close > p.mid) & (bars.close < p.open)
+    return p.bullish & bars.bearish & (bars.open > p.close) & (bars.close < p.mid) & (bars.close > p.open)
+
+
+def _star(bars, bullish, long_ratio=0.5, small_ratio=0.3):
+    """启明星 / 黄昏星：长实体、小实体、反向K线收进第一根实体的一半以上"""
+    first, middle = bars.prev(2), bars.prev(1)
+    base = (first.body > first.range * long_ratio) & (middle.body < first.body * small_ratio)
+    if bullish:
+        return base & first.bearish & bars.bullish & (bars.close > first.mid)
+    return base & first.bullish & bars.bearish & (bars.close < first.mid)
+
+
+def _three_soldiers(bars, bullish, shadow=0.3):
+    """红三兵 / 三只乌鸦：三根同向K线依次创新高（低），开盘在前一根实体内，收盘靠近极值"""
+    first, second = bars.prev(2), bars.prev(1)
+    mask = np.ones(bars.close.shape, dtype=bool)
+    for before, after in ((first, second), (second, bars)):
+        if bullish:
+            mask &= (after.close > before.close) & (after.open > before.open) & (after.open <= before.close)
+        else:
+            mask &= (after.close < before.close) & (after.open < before.open) & (after.open >= before.close)
+    for candle in (first, second, bars):
+        if bullish:
+            mask &= candle.bullish & (candle.upper <= candle.body * shadow)
+        else:
+            mask &= candle.bearish & (candle.lower <= candle.body * shadow)
+    return mask
+
+
+# 形态 -> (实现, 需要的K线数, 名称, 方向)
+CANDLESTICK_PATTERNS = {
+    'doji': (_doji, 1, '十字星', 'neutral'),
+    'hammer': (_hammer, 1, '锤子线', 'bullish'),
+    'inverted_hammer': (_inverted_hammer, 1, '倒锤子线', 'bullish'),
+    'bullish_engulfing': (lambda bars: _engulfing(bars, True), 2, '看涨吞没', 'bullish'),
+    'bearish_engulfing': (lambda bars: _engulfing(bars, False), 2, '看跌吞没', 'bearish'),
+    'bullish_harami': (lambda bars: _harami(bars, True), 2, '看涨孕线', 'bullish'),
+    'bearish_harami': (lambda bars: _harami(bars, False), 2, '看跌孕线', 'bearish'),
+    'piercing_line': (lambda bars: _piercing(bars, True), 2, '刺透形态', 'bullish'),
+    'dark_cloud_cover': (lambda bars: _piercing(bars, False), 2, '乌云盖顶', 'bearish'),
+    'morning_star': (lambda bars: _star(bars, True), 3, '启明星', 'bullish'),
+    'evening_star': (lambda bars: _star(bars, False), 3, '黄昏星', 'bearish'),
+    'three_white_soldiers': (lambda bars: _three_soldiers(bars, True), 3, '红三兵', 'bullish'),
+    'three_black_crows': (lambda bars: _three_soldiers(bars, False), 3, '三只乌鸦', 'bearish'),
+}
+
+
+def candlestick_masks(open, high, low, close, names=None):
+    """在整段 OHLC 上一次性识别K线形态，返回 {形态: 布尔数组}
+
+    输入可以是单个品种的一维数组或 S×T 矩阵，结果与输入同形状；
+    形态在其最后一根K线的位置为 True，开头K线数不足的位置为 False。
+    """
+    arrays = [np.asarray(x, dtype=float) for x in (open, high, low, close)]
+    squeeze = arrays[0].ndim == 1
+    if squeeze:
+        arrays = [x[None, :] for x in arrays]
+    with np.errstate(invalid='ignore'):
+        bars = CandleBars(*arrays)
+        masks = {name: CANDLESTICK_PATTERNS[name][0](bars) for name in (names or CANDLESTICK_PATTERNS)}
+    return {name: mask[0] if squeeze else mask for name, mask in masks.items()}
+
+
+def latest_candlestick_patterns(open, high, low, close, names=None):
+    """实时检查：只取最后几根K线，返回最后一根K线上成立的形态"""
+    names = list(names or CANDLESTICK_PATTERNS)
+    if not names or len(close) == 0:
+        return []
+    bars = max(CANDLESTICK_PATTERNS[name][1] for name in names)
+    tail = [np.asarray(x, dtype=float)[-bars:] for x in (open, high, low, close)]
+    masks = candlestick_masks(*tail, names=names)
+    return [name for name in names if masks[name][-1]]
+
+
+def _candle_operator(name):
+    def pattern(open, high, low, close):
+        return candlestick_masks(open, high, low, close, names=[name])[name]
+    return pattern
+
+
+# 运算符 -> (实现, 参数个数, 回看长度)
+# 参数个数为 None 表示不定；回看长度为得到最后 k 个结果需要额外向前多取的K线数：
+# 整数表示固定值，None 表示依赖全部历史，函数表示由窗口参数决定（此时只有第一个参数是序列）
+RULE_OPERATORS = {
+    'gt': (_compare(lambda a, b: a > b), 2, 0),
+    'lt': (_compare(lambda a, b: a < b), 2, 0),
+    'ge': (_compare(lambda a, b: a >= b), 2, 0),
+    'le': (_compare(lambda a, b: a <= b), 2, 0),
+    'eq': (_compare(lambda a, b: a == b), 2, 0),
+    'cross_above': (lambda a, b: _cross(a, b, True), 2, 1),
+    'cross_below': (lambda a, b: _cross(a, b, False), 2, 1),
+    'all': (_reduce_all, None, 0),
+    'any': (_reduce_any, None, 0),
+    'not': (lambda a: ~np.asarray(a, dtype=bool), 1, 0),
+    'add': (lambda a, b: a + b, 2, 0),
+    'sub': (lambda a, b: a - b, 2, 0),
+    'mul': (lambda a, b: a * b, 2, 0),
+    'div': (_divide, 2, 0),
+    'neg': (lambda a: -a, 1, 0),
+    'abs': (lambda a: np.abs(a), 1, 0),
+    'where': (lambda cond, a, b: np.where(cond, a, b), 3, 0),
+    'shift': (_shift, 2, lambda n: max(int(n), 0)),
+    'sma': (lambda x, n: _rolling(x, n, 'mean'), 2, _window_lookback),
+    'std': (lambda x, n, ddof=1: _rolling(x, n, 'std', ddof=int(ddof)), None, _window_lookback),
+    'max': (lambda x, n: _rolling(x, n, 'max'), 2, _window_lookback),
+    'min': (lambda x, n: _rolling(x, n, 'min'), 2, _window_lookback),
+    'ema': (_ema, 2, None),
+    'pct_change': (lambda x, n: _divide(x - _shift(x, n), _shift(x, n)) * 100, 2, lambda n: int(n)),
+    'rsi': (_wilder_rsi, 2, None),
+    'obv': (_obv, 2, None),
+    'bullish_divergence': (_divergence('regular_bullish'), None, None),
+    'bearish_divergence': (_divergence('regular_bearish'), None, None),
+    'hidden_bullish_divergence': (_divergence('hidden_bullish'), None, None),
+    'hidden_bearish_divergence': (_divergence('hidden_bearish'), None, None),
+}
+# K线形态运算符，参数为 open、high、low、close，例如 {'hammer': ['open', 'high', 'low', 'close']}
+RULE_OPERATORS.update({name: (_candle_operator(name), 4, bars - 1)
+                       for name, (_, bars, _, _) in CANDLESTICK_PATTERNS.items()})
+
+
+def _tail(value, tail):
+    """取矩阵最后 tail 列；标量原样返回"""
+    if tail is None or np.ndim(value) < 2:
+        return value
+    return value[:, -tail:]
+
+
+class SignalRuleSet:
+    """把声明式信号规则编译为基于 symbols × time 矩阵的向量化表达式
+
+    相同的子表达式只编译一次，并在一次求值中只计算一次，
+    因此大量规则共享同一组均线、RSI 等中间结果。只需要最近几根K线时，
+    每个运算只向子表达式索取它真正需要的K线数，实时检查不必在整段历史上求值。
+    """
+
+    def __init__(self, rules, params=None):
+        self.params = dict(params or {})
+        self._nodes = {}  # 子表达式键 -> 编译后的函数
+        self.rules = []  # [(名称, 分组, 函数)]
+        for rule in rules:
+            try:
+                self.rules.append((rule['name'], rule.get('group', 'custom'), self._compile(rule['when'])))
+            except Exception as e:
+                print(f"信号规则 {rule.get('name')} 编译错误: {str(e)}")
+
+    def _compile(self, node):
+        key = json.dumps(node, sort_keys=True, ensure_ascii=False)
+        compiled = self._nodes.get(key)
+        if compiled is not None:
+            return compiled
+        
+        if isinstance(node, bool) or not isinstance(node, (str, int, float, dict)):
+            raise ValueError(f'无法识别的表达式: {node!r}')
+        if isinstance(node, (int, float)):
+            def compiled(ctx, tail, value=node):
+                return value
+        elif isinstance(node, str) and node.startswith('$'):
+            def compiled(ctx, tail, name=node[1:]):
+                return ctx['params'][name]
+        elif isinstance(node, str):
+            def compiled(ctx, tail, name=node):
+                return _tail(ctx['fields'][name], tail)
+        else:
+            if len(node) != 1:
+                raise ValueError(f'每个运算只能有一个运算符: {node!r}')
+            op, args = next(iter(node.items()))
+            if op not in RULE_OPERATORS:
+                raise ValueError(f'未知运算符: {op}')
+            func, arity, lookback = RULE_OPERATORS[op]
+            if not isinstance(args, list):
+                args = [args]
+            if arity is not None and len(args) != arity:
+                raise ValueError(f'{op} 需要 {arity} 个参数')
+            children = [self._compile(arg) for arg in args]
+            
+            def compiled(ctx, tail, key=key, func=func, lookback=lookback, children=children):
+                cache = ctx['cache']
+                cache_key = (key, tail)
+                if cache_key not in cache:
+                    if callable(lookback):
+                        options = [child(ctx, None) for child in children[1:]]
+                        extra = lookback(*options)
+                        values = [children[0](ctx, None if tail is None else tail + extra)] + options
+                    else:
+                        child_tail = None if tail is None or lookback is None else tail + lookback
+                        values = [child(ctx, child_tail) for child in children]
+                    cache[cache_key] = _tail(func(*values), tail)
+                return cache[cache_key]
+        
+        self._nodes[key] = compiled
+        return compiled
+
+    def groups(self):
+        """规则中出现的全部分组"""
+        return {group for _, group, _ in self.rules}
+
+    def evaluate(self, fields, params=None, groups=None, tail=None):
+        """求值规则，返回 {规则名: S×T 布尔矩阵}
+
+        groups 为 None 时求值全部规则；tail 为 None 时在整段历史上求值（回测），
+        否则只返回最后 tail 根K线的结果（实时检查）。
+        """
+        ctx = {'fields': fields, 'params': {**self.params, **(params or {})}, 'cache': {}}
+        n_symbols, n_bars = next(iter(fields.values())).shape
+        shape = (n_symbols, n_bars if tail is None else min(tail, n_bars))
+        results = {}
+        for name, group, compiled in self.rules:
+            if groups is not None and group not in groups:
+                continue
+            try:
+                results[name] = np.broadcast_to(np.asarray(compiled(ctx, tail), dtype=bool), shape)
+            except Exception as e:
+                print(f"信号规则 {name} 求值错误: {str(e)}")
+        return results
+
+    def latest(self, fields, params=None, groups=None):
+        """只取最后一根K线：返回每个品种当前触发的规则名列表"""
+        results = self.evaluate(fields, params, groups, tail=1)
+        n_symbols = next(iter(fields.values())).shape[0]
+        fired = [[] for _ in range(n_symbols)]
+        if not results:
+            return fired
+        names = list(results)
+        hits = np.stack([results[name][:, -1] for name in names], axis=1)
+        for row, column in zip(*np.nonzero(hits)):
+            fired[row].append(names[column])
+        return fired
+
+
+def frame_fields(df):
+    """把单个品种的 DataFrame 转成 1×T 的规则输入"""
+    return {column: df[column].to_numpy(dtype=float)[None, :]
+            for column in df.columns if pd.api.types.is_numeric_dtype(df[column])}
+
+
+def stack_fields(frames):
+    """把多个对齐的 DataFrame（同长度）堆叠成 S×T 的规则输入"""
+    columns = set.intersection(*[set(frame_fields(df)) for df in frames])
+    return {column: np.vstack([df[column].to_numpy(dtype=float) for df in frames])
+            for column in columns}
+
+
+DIVERGENCE_INDICATORS = ('RSI', 'MACD', 'OBV')
+DIVERGENCE_COLUMNS = ['symbol', 'indicator', 'kind', 'start', 'end', 'confirmed',
+                      'price_start', 'price_end', 'value_start', 'value_end']
+
+
+def scan_divergences(fields, times=None, symbols=None, indicators=DIVERGENCE_INDICATORS, order=3, max_gap=60):
+    """扫描 S×T 字段矩阵全部历史中的价格/指标背离，返回每次背离一行的 DataFrame
+
+    fields 同 frame_fields / stack_fields / indicator_fields，需包含 high、low；没有 OBV 列时由 close、volume 计算。
+    times 为长度 T 的时间轴或 S×T 的毫秒时间戳，默认取 fields 中的 timestamp；symbols 为各行的名称。
+    start/end 为两个摆动点的位置，confirmed 为背离得到确认的位置（end 之后 order 根K线），
+    回测或实时提醒都应以 confirmed 为准，否则会用到未来数据。
+    """
+    high, low = fields['high'], fields['low']
+    if times is None:
+        times = fields.get('timestamp')
+    if times is not None:
+        times = np.asarray(times)
+        if np.issubdtype(times.dtype, np.number):
+            times = pd.to_datetime(times.ravel(), unit='ms').to_numpy().reshape(times.shape)
+        times = np.broadcast_to(times, high.shape)
+    
+    frames = []
+    for name in indicators:
+        values = fields.get(name)
+        if values is None and name == 'OBV':
+            values = _obv(fields['close'], fields['volume'])
+        if values is None:
+            continue
+        extremes = {'high': _centered_extreme(values, order, 'high'), 'low': _centered_extreme(values, order, 'low')}
+        for kind, (rows, before, current) in divergence_pairs(high, low, values, order, max_gap).items():
+            mode = 'high' if kind.endswith('bearish') else 'low'
+            price = high if mode == 'high' else low
+            frame = pd.DataFrame({
+                'symbol': np.asarray(symbols)[rows] if symbols is not None else rows,
+                'indicator': name,
+                'kind': kind,
+                'start': before,
+                'end': current,
+                'confirmed': current + order,
+                'price_start': price[rows, before],
+                'price_end': price[rows, current],
+                'value_start': extremes[mode][rows, before],
+                'value_end': extremes[mode][rows, current],
+            })
+            if times is not None:
+                frame['start_time'] = times[rows, before]
+                frame['end_time'] = times[rows, current]
+                frame['confirmed_time'] = times[rows, current + order]
+            frames.append(frame)
+    
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=DIVERGENCE_COLUMNS)
+    result = pd.concat(frames, ignore_index=True)
+    return result.sort_values(['symbol', 'confirmed', 'indicator', 'kind'], kind='stable').reset_index(drop=True)
+
+
+def find_divergences(df, **kwargs):
+    """单个品种 DataFrame（含 compute_indicators 生成的列）的背离，时间取 df 的索引"""
+    return scan_divergences(frame_fields(df), times=df.index, **kwargs)
+
+
+def load_signal_rules(path='signal_rules.json'):
+    """内置规则加上用户规则文件；用户规则与内置规则同名时覆盖内置规则"""
+    rules = {rule['name']: rule for rule in DEFAULT_SIGNAL_RULES}
+    params = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for rule in data.get('rules', []):
+                rules[rule['name']] = rule
+            params = data.get('params', {})
+        except Exception as e:
+            print(f"加载信号规则错误: {str(e)}")
+    return list(rules.values()), params
+
+
+def indicator_fields(ohlcv):
+    """compute_indicators 的矩阵版本：输入 S×T×6 的 OHLCV 数组，返回 {列名: S×T 数组}"""
+    ohlcv = np.asarray(ohlcv, dtype=float)
+    fields = {name: ohlcv[:, :, i] for i, name in enumerate(['timestamp', 'open', 'high', 'low', 'close', 'volume'])}
+    close = fields['close']
+    
+    fields['MA5'] = _rolling(close, 5, 'mean')
+    fields['MA10'] = _rolling(close, 10, 'mean')
+    fields['MA20'] = _rolling(close, 20, 'mean')
+    fields['std'] = _rolling(close, 20, 'std', ddof=1)
+    fields['upper'] = fields['MA20'] + fields['std'] * 2
+    fields['lower'] = fields['MA20'] - fields['std'] * 2
+    
+    # 与 compute_indicators 相同：首根的涨跌按0计入14周期简单平均
+    delta = np.diff(close, axis=1, prepend=np.nan)
+    gain = _rolling(np.where(delta > 0, delta, 0.0), 14, 'mean')
+    loss = _rolling(np.where(delta < 0, -delta, 0.0), 14, 'mean')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fields['RSI'] = 100 - (100 / (1 + gain / loss))
+    
+    fields['MACD'] = _ema(close, 12) - _ema(close, 26)
+    fields['Signal'] = _ema(fields['MACD'], 9)
+    fields['Histogram'] = fields['MACD'] - fields['Signal']
+    return fields
+
+
+# 策略评分各分项的默认权重，可在配置文件的 score_weights 中覆盖
+DEFAULT_SCORE_WEIGHTS = {
+    'trend': 0.35,
+    'momentum': 0.25,
+    'volume': 0.2,
+    'tech': 0.2,
+    'book': 0.15  # 盘口分，只在有订单簿数据时参与加权
+}
+SCORE_FIELDS = ('close', 'volume', 'RSI', 'MACD', 'Signal', 'upper', 'lower', 'MA5', 'MA10')
+# 评分用到的最长回看：MA50，再加上最近3根的成交量均值和均线交叉
+SCORE_LOOKBACK = 50 + 2
+
+
+def score_matrix(fields, weights=None, tail=None):
+    """对 symbols × time 矩阵批量计算策略评分
+
+    fields 为 {列名: S×T 数组}（见 frame_fields / stack_fields），需要包含 SCORE_FIELDS。
+    返回 {'trend'/'momentum'/'volume'/'tech'/'total': S×T 数组}；
+    tail 不为 None 时只计算最后 tail 根K线，输入只截取所需的回看长度。
+    """
+    weights = dict(DEFAULT_SCORE_WEIGHTS, **(weights or {}))
+    if tail is not None:
+        fields = {name: fields[name][:, -(tail + SCORE_LOOKBACK):] for name in SCORE_FIELDS}
+    close = fields['close']
+    volume = fields['volume']
+    rsi = fields['RSI']
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 1. 趋势得分：价格在MA20/MA50上方，MA20在MA50上方
+        ma20 = _rolling(close, 20, 'mean')
+        ma50 = _rolling(close, 50, 'mean')
+        trend = 50 + 15 * (close > ma20) + 15 * (close > ma50) + 20 * (ma20 > ma50)
+        
+        # 2. 动量得分：RSI所处区域，MACD在信号线上方
+        rsi_points = np.select(
+            [(rsi >= 40) & (rsi <= 60),
+             ((rsi >= 30) & (rsi < 40)) | ((rsi > 60) & (rsi <= 70)),
+             (rsi < 30) | (rsi > 70)],
+            [10, 20, 30], default=0)
+        momentum = 50 + rsi_points + 20 * (fields['MACD'] > fields['Signal'])
+        
+        # 3. 成交量得分：相对20均量的倍数，近3根成交量高于均量
+        volume_ma = _rolling(volume, 20, 'mean')
+        volume_ratio = volume / volume_ma
+        volume_points = np.select([volume_ratio > 2, volume_ratio > 1.5, volume_ratio > 1], [30, 20, 10], default=0)
+        volume_trend = _rolling(volume, 3, 'mean') > _rolling(volume_ma, 3, 'mean')
+        volume_score = 50 + volume_points + 20 * volume_trend
+        
+        # 4. 技术指标得分：价格在布林带内，MA5上穿MA10
+        in_band = (fields['lower'] <= close) & (close <= fields['upper'])
+        golden_cross = _cross(fields['MA5'], fields['MA10'], True)
+        tech = 50 + 20 * in_band + 30 * golden_cross
+    
+    scores = {
+        'trend': np.clip(trend, 0, 100),
+        'momentum': np.clip(momentum, 0, 100),
+        'volume': np.clip(volume_score, 0, 100),
+        'tech': np.clip(tech, 0, 100),
+    }
+    # 加权平均；默认权重之和为1
+    total_weight = sum(weights[key] for key in scores)
+    scores['total'] = np.round(sum(scores[key] * weights[key] for key in scores) / total_weight, 1)
+    if tail is not None:
+        scores = {key: value[:, -tail:] for key, value in scores.items()}
+    return scores
+
+
+ORDER_BOOK_DEPTH = 100  # 每侧保留的档位数；币安 limit<=100 时权重为5
+ORDER_BOOK_BAND = 0.01  # 深度和不平衡度只统计中间价上下1%以内的挂单
+ORDER_BOOK_WALL_RATIO = 5  # 挂单量达到该侧平均档位量的倍数视为大单墙
+
+
+class OrderBook:
+    """固定容量的订单簿，每侧一对有序的 NumPy 数组（价格键、数量）
+
+    买盘存负价格，两侧都按键升序排列、最优价在下标0；单档变化用 searchsorted 二分定位，
+    插入和删除只在该侧数组内移动一段，超出容量的远端档位直接丢弃，内存大小固定。
+    """
+
+    def __init__(self, depth=ORDER_BOOK_DEPTH):
+        self.depth = depth
+        self.keys = {side: np.empty(depth) for side in ('bids', 'asks')}
+        self.amounts = {side: np.empty(depth) for side in ('bids', 'asks')}
+        self.counts = {'bids': 0, 'asks': 0}
+        self.update_id = None  # 交易所的盘口更新编号，用于校验增量是否连续
+        self.timestamp = None
+
+    @staticmethod
+    def _key(side, price):
+        return -price if side == 'bids' else price
+
+    def clear(self):
+        self.counts = {'bids': 0, 'asks': 0}
+        self.update_id = None
+        self.timestamp = None
+
+    def apply_snapshot(self, book):
+        """用 fetch_order_book 的结果整体替换订单簿"""
+        for side in ('bids', 'asks'):
+            levels = np.asarray(book.get(side) or np.empty((0, 2)), dtype=float).reshape(-1, 2)
+            levels = levels[levels[:, 1] > 0]
+            keys = self._key(side, levels[:, 0])
+            order = np.argsort(keys, kind='stable')[:self.depth]
+            count = len(order)
+            self.keys[side][:count] = keys[order]
+            self.amounts[side][:count] = levels[order, 1]
+            self.counts[side] = count
+        self.update_id = book.get('nonce')
+        self.timestamp = book.get('timestamp')
+
+    def update(self, side, price, amount):
+        """更新一个价位，数量为0表示撤掉该价位"""
+        keys = self.keys[side]
+        amounts = self.amounts[side]
+        count = self.counts[side]
+        key = self._key(side, price)
+        i = int(np.searchsorted(keys[:count], key))
+        if i < count and keys[i] == key:
+            if amount > 0:
+                amounts[i] = amount
+            else:
+                keys[i:count - 1] = keys[i + 1:count]
+                amounts[i:count - 1] = amounts[i + 1:count]
+                self.counts[side] = count - 1
+            return
+        if amount <= 0 or i >= self.depth:
+            return
+        # 满容量时挤掉最远的一档
+        end = min(count, self.depth - 1)
+        keys[i + 1:end + 1] = keys[i:end]
+        amounts[i + 1:end + 1] = amounts[i:end]
+        keys[i] = key
+        amounts[i] = amount
+        self.counts[side] = end + 1
+
+    def apply_diff(self, bids=(), asks=(), first_id=None, last_id=None):
+        """应用一次增量更新（币安 depthUpdate 的 U/u 语义）
+
+        已包含在当前订单簿中的旧增量被忽略；编号不连续时返回 False，调用方应重新拉取快照。
+        """
+        if last_id is not None and self.update_id is not None:
+            if last_id <= self.update_id:
+                return True
+            if first_id is not None and first_id > self.update_id + 1:
+                return False
+        for price, amount in bids:
+            self.update('bids', float(price), float(amount))
+        for price, amount in asks:
+            self.update('asks', float(price), float(amount))
+        if last_id is not None:
+            self.update_id = last_id
+        return True
+
+    def levels(self, side):
+        """该侧的 (价格, 数量) 数组，从最优价开始"""
+        count = self.counts[side]
+        keys = self.keys[side][:count]
+        return (-keys if side == 'bids' else keys.copy()), self.amounts[side][:count].copy()
+
+    def best(self, side):
+        if self.counts[side] == 0:
+            return None
+        key = self.keys[side][0]
+        return float(-key if side == 'bids' else key)
+
+    def metrics(self, band=ORDER_BOOK_BAND, wall_ratio=ORDER_BOOK_WALL_RATIO):
+        """盘口指标：价差、中间价附近的深度和不平衡度、大单墙；任一侧为空时返回 None"""
+        bid, ask = self.best('bids'), self.best('asks')
+        if bid is None or ask is None:
+            return None
+        mid = (bid + ask) / 2
+        result = {
+            'bid': bid,
+            'ask': ask,
+            'mid': mid,
+            'spread': ask - bid,
+            'spread_bps': (ask - bid) / mid * 10000,
+        }
+        walls = []
+        for side, sign in (('bids', -1), ('asks', 1)):
+            prices, amounts = self.levels(side)
+            near = np.abs(prices - mid) <= mid * band
+            result[f'{side}_depth'] = float(np.sum(prices[near] * amounts[near]))
+            average = amounts.mean() if len(amounts) else 0.0
+            for index in np.flatnonzero(amounts >= average * wall_ratio) if average > 0 else ():
+                walls.append({'side': side, 'price': float(prices[index]), 'amount': float(amounts[index]),
+                              'distance': float(sign * (prices[index] - mid) / mid)})
+        total = result['bids_depth'] + result['asks_depth']
+        result['imbalance'] = (result['bids_depth'] - result['asks_depth']) / total if total > 0 else 0.0
+        result['walls'] = walls
+        return result
+
+
+def book_score(metrics, band=ORDER_BOOK_BAND):
+    """盘口得分：买卖深度的不平衡度，加上中间价附近的买墙/卖墙"""
+    score = 50 + 30 * metrics['imbalance']
+    for wall in metrics['walls']:
+        if wall['distance'] <= band:
+            score += 10 if wall['side'] == 'bids' else -10
+    return float(np.clip(score, 0, 100))
+
+
+def weighted_total(scores, weights=None):
+    """按权重对已有的各分项求加权平均"""
+    weights = dict(DEFAULT_SCORE_WEIGHTS, **(weights or {}))
+    components = [key for key in ('trend', 'momentum', 'volume', 'tech', 'book') if key in scores]
+    total_weight = sum(weights[key] for key in components)
+    return round(sum(scores[key] * weights[key] for key in components) / total_weight, 1)
+
+
+def add_book_score(scores, metrics, weights=None):
+    """在评分中加入盘口分，并按权重重新计算总分"""
+    scores = dict(scores, book=book_score(metrics))
+    scores['total'] = weighted_total(scores, weights)
+    return scores
+
+
+# 支撑/压力位引擎的默认参数，可在配置文件的 sr_params 中覆盖
+DEFAULT_SR_PARAMS = {
+    'volume_lookback': 5000,  # 成交量分布统计的K线数
+    'pivot_lookback': 500,  # 寻找摆动高低点的K线数
+    'pivot_order': 3,  # 高低点左右各需要的K线数
+    'bin_pct': 0.001,  # 价格分箱宽度，相对首个收盘价
+    'cluster_pct': 0.003,  # 相近价位合并的容差
+    'max_levels': 6,
+}
+
+
+class SupportResistanceEngine:
+    """支撑/压力位：成交量价格分布的高成交量节点 + 摆动高低点聚类，按强度排序
+
+    成交量分布用差分数组维护：每根收盘K线把成交量均摊到 [最低, 最高] 覆盖的价格箱，
+    只需在两端各加减一次；超出 volume_lookback 的K线按同样方式减去。查询时对差分数组
+    累加一次即得到分布，开销只和价格箱数量有关，与统计了多少根K线无关。
+    """
+
+    def __init__(self, params=None):
+        self.params = dict(DEFAULT_SR_PARAMS, **(params or {}))
+        self.bin_width = None
+        self.origin = 0  # 差分数组下标0对应的价格箱编号
+        self.diff = np.zeros(0)
+        self.window = deque()  # 统计窗口内每根K线的 (起始箱, 结束箱, 每箱成交量)
+        self.recent = np.empty((0, 6))  # 最近 pivot_lookback 根收盘K线，用于找高低点
+        self.last_closed = None  # 已计入的最后一根收盘K线的时间戳
+
+    def _ensure(self, low_bin, high_bin):
+        """扩展差分数组，使其覆盖 [low_bin, high_bin + 1]"""
+        if len(self.diff) == 0:
+            self.origin = low_bin
+            self.diff = np.zeros(high_bin - low_bin + 2)
+            return
+        if low_bin < self.origin:
+            self.diff = np.concatenate([np.zeros(self.origin - low_bin), self.diff])
+            self.origin = low_bin
+        overflow = high_bin + 2 - self.origin - len(self.diff)
+        if overflow > 0:
+            self.diff = np.concatenate([self.diff, np.zeros(overflow)])
+
+    def _trim(self):
+        """K线移出后去掉两端已无成交量的价格箱，使差分数组只覆盖统计窗口内K线的价格范围"""
+        if not self.window:
+            self.diff = np.zeros(0)
+            return
+        spans = np.array(self.window)
+        low_bin, high_bin = int(spans[:, 0].min()), int(spans[:, 1].max())
+        start, stop = low_bin - self.origin, high_bin + 2 - self.origin
+        if start == 0 and stop == len(self.diff):
+            return
+        diff = self.diff[start:stop].copy()
+        # 被截去的前缀累加值并入首个箱，末尾补齐使总和为0，顺带清掉加减残留的浮点误差
+        diff[0] = np.cumsum(self.diff[:start + 1])[-1]
+        diff[-1] = -diff[:-1].sum()
+        self.origin = low_bin
+        self.diff = diff
+
+    def _apply(self, low_bins, high_bins, per_bin):
+        np.add.at(self.diff, low_bins - self.origin, per_bin)
+        np.add.at(self.diff, high_bins + 1 - self.origin, -per_bin)
+
+    def add_closed(self, candles):
+        """计入一批按时间排序的收盘K线（N×6）"""
+        candles = np.asarray(candles, dtype=float).reshape(-1, 6)
+        if self.last_closed is not None:
+            candles = candles[candles[:, 0] > self.last_closed]
+        candles = candles[np.isfinite(candles[:, 1:5]).all(axis=1)]
+        if len(candles) == 0:
+            return 0
+        if self.bin_width is None:
+            self.bin_width = candles[0, 4] * self.params['bin_pct']
+        low_bins = np.floor(candles[:, 3] / self.bin_width).astype(np.int64)
+        high_bins = np.maximum(np.floor(candles[:, 2] / self.bin_width).astype(np.int64), low_bins)
+        per_bin = candles[:, 5] / (high_bins - low_bins + 1)
+        self._ensure(int(low_bins.min()), int(high_bins.max()))
+        self._apply(low_bins, high_bins, per_bin)
+        self.window.extend(zip(low_bins.tolist(), high_bins.tolist(), per_bin.tolist()))
+        
+        # 移出超出统计窗口的K线
+        excess = len(self.window) - self.params['volume_lookback']
+        if excess > 0:
+            expired = np.array([self.window.popleft() for _ in range(excess)])
+            self._apply(expired[:, 0].astype(np.int64), expired[:, 1].astype(np.int64), -expired[:, 2])
+            if expired[:, 0].min() <= self.origin or expired[:, 1].max() + 2 - self.origin >= len(self.diff):
+                self._trim()
+        
+        self.recent = np.vstack([self.recent, candles])[-self.params['pivot_lookback']:]
+        self.last_closed = candles[-1, 0]
+        return len(candles)
+
+    def update(self, ohlcv):
+        """写入 fetch_ohlcv 格式的最新K线，最后一根视为未收盘不计入；返回新计入的K线数"""
+        data = np.asarray(ohlcv, dtype=float).reshape(-1, 6)
+        return self.add_closed(data[:-1])
+
+    def profile(self):
+        """成交量价格分布：(各价格箱的中心价, 成交量)"""
+        if self.bin_width is None:
+            return np.empty(0), np.empty(0)
+        # 加减抵消后会留下极小的浮点误差
+        volume = np.maximum(np.cumsum(self.diff)[:-1], 0.0)
+        prices = (np.arange(self.origin, self.origin + len(volume)) + 0.5) * self.bin_width
+        return prices, volume
+
+    def levels(self, price=None):
+        """按强度排序的价位 [{'price', 'kind', 'strength', 'touches', 'volume'}]
+
+        kind 相对 price（默认最后收盘价）判断为 support 或 resistance；
+        strength 0-100，由价位附近的成交量、高低点触及次数和最近一次触及的时间综合得出。
+        """
+        if self.bin_width is None or len(self.recent) == 0:
+            return []
+        params = self.params
+        if price is None:
+            price = self.recent[-1, 4]
+        tolerance = params['cluster_pct']
+        recent = self.recent
+        
+        # 候选价位：(价格, 触及次数, 最近一次触及的下标)
+        candidates = []
+        order = params['pivot_order']
+        highs = swing_points(recent[:, 2], order, 'high')
+        lows = swing_points(recent[:, 3], order, 'low')
+        pivots = np.concatenate([np.column_stack([recent[highs, 2], highs]),
+                                 np.column_stack([recent[lows, 3], lows])])
+        for price_value, index in pivots:
+            candidates.append((price_value, 1, index))
+        
+        # 成交量分布中的局部高点（高成交量节点）
+        prices, volume = self.profile()
+        band = max(1, int(round(price * tolerance / self.bin_width)))
+        sums = np.r_[0.0, np.cumsum(volume)]
+        positions = np.arange(len(volume))
+        band_volume = sums[np.minimum(positions + band + 1, len(volume))] - sums[np.maximum(positions - band, 0)]
+        if len(volume) >= 3:
+            peaks = np.flatnonzero((band_volume[1:-1] > band_volume[:-2]) & (band_volume[1:-1] >= band_volume[2:])) + 1
+            peaks = peaks[np.argsort(band_volume[peaks])[::-1][:params['max_levels']]]
+            for peak in peaks:
+                candidates.append((prices[peak], 0, -1))
+        if not candidates:
+            return []
+        
+        # 合并相近的候选价位；与簇中最低价比较，避免一串相邻价位连成很宽的簇
+        candidates.sort()
+        clusters = [[candidates[0]]]
+        for candidate in candidates[1:]:
+            if candidate[0] - clusters[-1][0][0] <= clusters[-1][0][0] * tolerance:
+                clusters[-1].append(candidate)
+            else:
+                clusters.append([candidate])
+        
+        peak_volume = band_volume.max() if len(band_volume) and band_volume.max() > 0 else 1.0
+        levels = []
+        for cluster in clusters:
+            members = np.array(cluster)
+            level_price = float(np.average(members[:, 0], weights=members[:, 1] + 1))
+            touches = int(members[:, 1].sum())
+            last_touch = members[:, 2].max()
+            position = int(np.clip(np.floor(level_price / self.bin_width) - self.origin, 0, len(volume) - 1)) if len(volume) else 0
+            level_volume = float(band_volume[position]) if len(volume) else 0.0
+            recency = (last_touch + 1) / len(recent) if last_touch >= 0 else 0.0
+            strength = 100 * (0.5 * level_volume / peak_volume + 0.35 * min(touches, 5) / 5 + 0.15 * recency)
+            levels.append({
+                'price': level_price,
+                'kind': 'support' if level_price < price else 'resistance',
+                'strength': round(float(strength), 1),
+                'touches': touches,
+                'volume': level_volume,
+            })
+        levels.sort(key=lambda level: level['strength'], reverse=True)
+        return levels[:params['max_levels']]
+
+
+def nearest_levels(levels, price):
+    """price 下方最近的支撑位和上方最近的压力位，没有时为 None"""
+    below = [level for level in levels if level['price'] < price]
+    above = [level for level in levels if level['price'] >= price]
+    support = max(below, key=lambda level: level['price']) if below else None
+    resistance = min(above, key=lambda level: level['price']) if above else None
+    return support, resistance
+
+
+def add_level_score(scores, price, levels, weights=None, distance=0.01):
+    """技术指标分加入支撑/压力位：价格贴近强支撑时加分，贴近强压力时减分，最多 ±15 分"""
+    points = 0.0
+    for level, sign in zip(nearest_levels(levels, price), (1, -1)):
+        if level is None:
+            continue
+        gap = abs(price - level['price']) / price
+        if gap <= distance:
+            points += sign * 15 * level['strength'] / 100 * (1 - gap / distance)
+    scores = dict(scores, tech=float(np.clip(scores['tech'] + points, 0, 100)))
+    scores['total'] = weighted_total(scores, weights)
+    return scores
+
+
+class RankIndex:
+    """单个指标的顺序统计索引：有序列表 + 二分查找，支持增量更新、排名和区间查询"""
+
+    def __init__(self):
+        self._keys = []  # 按 (值, 交易对) 排序
+        self._values = {}
+
+    def update(self, symbol, value):
+        """更新一个交易对的值，值为 None/NaN 时移除；返回是否有变化"""
+        if value is not None and math.isnan(value):
+            value = None
+        old = self._values.get(symbol)
+        if old == value:
+            return False
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (old, symbol))]
+            del self._values[symbol]
+        if value is not None:
+            bisect.insort(self._keys, (value, symbol))
+            self._values[symbol] = value
+        return True
+
+    def remove(self, symbol):
+        return self.update(symbol, None)
+
+    def get(self, symbol):
+        return self._values.get(symbol)
+
+    def rank(self, symbol, descending=True):
+        """交易对在该指标上的名次（从0开始），没有值时返回 None"""
+        value = self._values.get(symbol)
+        if value is None:
+            return None
+        position = bisect.bisect_left(self._keys, (value, symbol))
+        return len(self._keys) - 1 - position if descending else position
+
+    def ordered(self, descending=True):
+        """按指标排序的交易对"""
+        keys = reversed(self._keys) if descending else self._keys
+        return [symbol for _, symbol in keys]
+
+    def top(self, k, descending=True):
+        keys = self._keys[-k:][::-1] if descending else self._keys[:k]
+        return [symbol for _, symbol in keys]
+
+    def between(self, low, high):
+        """指标值在 [low, high] 区间内的交易对，按值升序"""
+        lo = bisect.bisect_left(self._keys, (low, ''))
+        hi = bisect.bisect_right(self._keys, (high, '\uffff'))
+        return [symbol for _, symbol in self._keys[lo:hi]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# 筛选器的列：(键, 标题)；除交易对外每一列都是一个排序指标
+SCREENER_COLUMNS = [
+    ('symbol', '交易对'),
+    ('total', '总分'),
+    ('trend', '趋势'),
+    ('momentum', '动量'),
+    ('volume', '成交量'),
+    ('tech', '技术'),
+    ('rsi', 'RSI'),
+    ('volume_ratio', '量比'),
+    ('change', '涨跌%'),
+    ('price', '价格'),
+]
+SCREENER_METRICS = [key for key, _ in SCREENER_COLUMNS[1:]]
+# 少于100根时币安K线接口的权重为1；评分最长回看为 SCORE_LOOKBACK
+SCREENER_CANDLE_LIMIT = 99
+SCREENER_BATCH = 20
+
+
+def screener_metrics(ohlcv, weights=None):
+    """对一组等长的K线（S×T×6）计算筛选器各列，返回 S×len(SCREENER_METRICS) 数组"""
+    fields = indicator_fields(ohlcv)
+    scores = score_matrix(fields, weights, tail=1)
+    close = fields['close']
+    volume = fields['volume']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        volume_ratio = volume[:, -1] / np.nanmean(volume[:, -20:], axis=1)
+        change = (close[:, -1] / close[:, -2] - 1) * 100 if close.shape[1] > 1 \
+            else np.full(len(close), np.nan)
+    columns = {
+        'total': scores['total'][:, -1],
+        'trend': scores['trend'][:, -1],
+        'momentum': scores['momentum'][:, -1],
+        'volume': scores['volume'][:, -1],
+        'tech': scores['tech'][:, -1],
+        'rsi': fields['RSI'][:, -1],
+        'volume_ratio': volume_ratio,
+        'change': change,
+        'price': close[:, -1],
+    }
+    return np.column_stack([columns[metric] for metric in SCREENER_METRICS]).astype(float)
+
+
+class MarketScreener:
+    """观察列表的评分排行：只重算K线有变化的交易对，并增量维护每个指标的排序索引"""
+
+    def __init__(self, weights=None):
+        self.weights = weights
+        self.rows = {}  # 交易对 -> {指标: 值}
+        self.indexes = {metric: RankIndex() for metric in SCREENER_METRICS}
+        self.symbol_order = []  # 按名称排序的交易对
+        self._fingerprints = {}
+        self.timeframe = None
+        self.version = 0  # 每次有行变化时加一，界面据此判断是否需要重绘
+        self.lock = threading.Lock()
+
+    def reset(self, timeframe):
+        """切换周期时清空全部结果"""
+        with self.lock:
+            self.rows.clear()
+            self._fingerprints.clear()
+            self.indexes = {metric: RankIndex() for metric in SCREENER_METRICS}
+            self.symbol_order = []
+            self.timeframe = timeframe
+            self.version += 1
+
+    def retain(self, symbols):
+        """移除不在观察列表中的交易对"""
+        symbols = set(symbols)
+        with self.lock:
+            removed = [symbol for symbol in self.rows if symbol not in symbols]
+            for symbol in removed:
+                self._remove(symbol)
+            if removed:
+                self.version += 1
+
+    def _remove(self, symbol):
+        self.rows.pop(symbol, None)
+        self._fingerprints.pop(symbol, None)
+        for index in self.indexes.values():
+            index.remove(symbol)
+        position = bisect.bisect_left(self.symbol_order, symbol)
+        if position < len(self.symbol_order) and self.symbol_order[position] == symbol:
+            del self.symbol_order[position]
+
+    def ingest(self, candles):
+        """写入一批 {交易对: OHLCV列表}，返回实际更新的交易对数量"""
+        changed = {}
+        for symbol, ohlcv in candles.items():
+            if not ohlcv:
+                continue
+            fingerprint = (len(ohlcv), tuple(ohlcv[0]), tuple(ohlcv[-1]))
+            if self._fingerprints.get(symbol) != fingerprint:
+                changed[symbol] = (ohlcv, fingerprint)
+        if not changed:
+            return 0
+        
+        # 按K线数量分组，每组堆叠成矩阵后一次性计算指标和评分
+        groups = {}
+        for symbol, (ohlcv, _) in changed.items():
+            groups.setdefault(len(ohlcv), []).append(symbol)
+        
+        rows = {}
+        for symbols in groups.values():
+            metrics = screener_metrics([changed[symbol][0] for symbol in symbols], self.weights)
+            for symbol, values in zip(symbols, metrics):
+                rows[symbol] = dict(zip(SCREENER_METRICS, values.tolist()))
+        
+        return self.update_rows(rows, {symbol: changed[symbol][1] for symbol in rows})
+
+    def update_rows(self, rows, fingerprints=None):
+        """写入已算好的 {交易对: {指标: 值}}，返回写入的数量"""
+        if not rows:
+            return 0
+        with self.lock:
+            for symbol, row in rows.items():
+                if symbol not in self.rows:
+                    bisect.insort(self.symbol_order, symbol)
+                self.rows[symbol] = row
+                if fingerprints is not None:
+                    self._fingerprints[symbol] = fingerprints[symbol]
+                for metric, value in row.items():
+                    self.indexes[metric].update(symbol, value)
+            self.version += 1
+        return len(rows)
+
+    def ranked(self, metric='total', descending=True, query=''):
+        """按指标排序并按名称过滤后的交易对列表；没有该指标值的排在最后"""
+        with self.lock:
+            if metric == 'symbol':
+                symbols = self.symbol_order[::-1] if descending else list(self.symbol_order)
+            else:
+                index = self.indexes[metric]
+                symbols = index.ordered(descending)
+                if len(index) < len(self.symbol_order):
+                    symbols += [symbol for symbol in self.symbol_order if index.get(symbol) is None]
+        query = SymbolIndex.normalize(query.strip())
+        if query:
+            symbols = [symbol for symbol in symbols if query in SymbolIndex.normalize(symbol)]
+        return symbols
+
+    def row(self, symbol):
+        return self.rows.get(symbol)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class SharedRowBuffer:
+    """共享内存中按行存放的 NumPy 数组，多个进程通过名字直接映射同一块内存
+
+    每行只有一个写入方，用序号锁（seqlock）保证读到完整的一行：写入前序号加一变为奇数，
+    写完再加一变回偶数；读取方在复制前后比较序号，为奇数或有变化时重读。
+    每行另有一个 tag，由写入方自行使用（例如记录结果来自哪个版本的K线）。
+    """
+
+    def __init__(self, rows, row_shape, name=None):
+        from multiprocessing import shared_memory
+        
+        self.rows = rows
+        self.row_shape = tuple(row_shape)
+        self.owner = name is None
+        header = rows * 8
+        size = 3 * header + rows * int(np.prod(self.row_shape)) * 8
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        buffer = self.shm.buf
+        self.seq = np.ndarray((rows,), np.int64, buffer, 0)
+        self.lengths = np.ndarray((rows,), np.int64, buffer, header)
+        self.tags = np.ndarray((rows,), np.int64, buffer, 2 * header)
+        self.data = np.ndarray((rows,) + self.row_shape, np.float64, buffer, 3 * header)
+        if self.owner:
+            self.seq[:] = 0
+            self.lengths[:] = 0
+            self.tags[:] = -1
+
+    @property
+    def spec(self):
+        """在其他进程中 attach 所需的参数，只包含名字和形状，可廉价地传给子进程"""
+        return self.shm.name, self.rows, self.row_shape
+
+    @classmethod
+    def attach(cls, spec):
+        name, rows, row_shape = spec
+        return cls(rows, row_shape, name=name)
+
+    def write(self, row, values, tag=0):
+        """写入一行；values 的第一维可短于行容量，超出时保留末尾"""
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == len(self.row_shape) and len(self.row_shape) > 0:
+            values = values[-self.row_shape[0]:]
+        self.seq[row] += 1
+        self.data[row, :len(values)] = values
+        self.lengths[row] = len(values)
+        self.tags[row] = tag
+        self.seq[row] += 1
+
+    def read(self, row, retries=1000):
+        """读取一行，返回 (版本, tag, 数据副本)；一直读不到完整数据时返回 None"""
+        for _ in range(retries):
+            version = int(self.seq[row])
+            if version % 2 == 0:
+                length = int(self.lengths[row])
+                tag = int(self.tags[row])
+                values = self.data[row, :length].copy()
+                if int(self.seq[row]) == version:
+                    return version, tag, values
+            time.sleep(0)
+        return None
+
+    def versions(self):
+        return self.seq.copy()
+
+    def close(self):
+        """解除映射；创建者同时释放共享内存"""
+        self.seq = self.lengths = self.tags = self.data = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# 每个进程中已映射的共享缓冲区：名字 -> SharedRowBuffer
+_SHARED_BUFFERS = {}
+
+
+def _shared_buffer(spec):
+    buffer = _SHARED_BUFFERS.get(spec[0])
+    if buffer is None:
+        buffer = _SHARED_BUFFERS[spec[0]] = SharedRowBuffer.attach(spec)
+    return buffer
+
+
+def _ingest_candles(candle_spec, symbols, timeframe, proxy, interval, stop, weight_budget):
+    """采集进程：轮询观察列表的K线并写入共享K线缓冲区，只写有变化的行
+
+    weight_budget 为 (总额度, 本进程份额)：界面进程的调度器同时让出同样的份额，两者合计不超过总额度。
+    """
+    candles = SharedRowBuffer.attach(candle_spec)
+    exchange = ccxt.binance({'enableRateLimit': False})
+    transport = ExchangeTransport()
+    transport.configure(*proxy)
+    transport.attach(exchange)
+    weight_limit, share = weight_budget
+    scheduler = RequestScheduler(weight_limit=weight_limit)
+    scheduler.reserve(weight_limit - share)
+    fingerprints = {}
+    try:
+        while not stop.is_set():
+            for start in range(0, len(symbols), SCREENER_BATCH):
+                if stop.is_set():
+                    break
+                futures = {row: scheduler.submit(exchange.fetch_ohlcv, symbols[row], timeframe,
+                                                 limit=candle_spec[2][0], priority=PRIORITY_BACKFILL)
+                           for row in range(start, min(start + SCREENER_BATCH, len(symbols)))}
+                for row, future in futures.items():
+                    try:
+                        ohlcv = future.result()
+                    except Exception as e:
+                        print(f"采集进程获取 {symbols[row]} 数据错误: {str(e)}")
+                        continue
+                    if not ohlcv:
+                        continue
+                    fingerprint = (len(ohlcv), tuple(ohlcv[0]), tuple(ohlcv[-1]))
+                    if fingerprints.get(row) != fingerprint:
+                        fingerprints[row] = fingerprint
+                        candles.write(row, ohlcv)
+            stop.wait(interval)
+    finally:
+        scheduler.stop()
+        candles.close()
+
+
+def _analyze_rows(candle_spec, result_spec, rows, weights):
+    """分析进程：计算一个分片中K线有变化的行，结果写入共享结果缓冲区，返回更新的行数"""
+    candles = _shared_buffer(candle_spec)
+    results = _shared_buffer(result_spec)
+    
+    # 按K线数量分组，每组堆叠成矩阵后一次性计算
+    groups = {}
+    for row in rows:
+        entry = candles.read(row)
+        if entry is None:
+            continue
+        version, _, ohlcv = entry
+        if len(ohlcv) == 0 or results.tags[row] == version:
+            continue
+        groups.setdefault(len(ohlcv), []).append((row, version, ohlcv))
+    
+    updated = 0
+    for group in groups.values():
+        metrics = screener_metrics(np.stack([ohlcv for _, _, ohlcv in group]), weights)
+        for (row, version, _), values in zip(group, metrics):
+            results.write(row, values, tag=version)
+            updated += 1
+    return updated
+
+
+class MarketPipeline:
+    """多进程行情流水线
+
+    采集进程把K线写入共享K线缓冲区，分析进程池按交易对分片计算指标和评分并写入共享结果缓冲区，
+    界面进程只读取结果。进程间只传递共享内存的名字和行号，K线和结果都不经过序列化。
+    """
+
+    def __init__(self, symbols, timeframe, proxy, weights=None, workers=None, interval=10,
+                 capacity=SCREENER_CANDLE_LIMIT, weight_budget=(1200, 600)):
+        self.symbols = list(symbols)
+        self.timeframe = timeframe
+        self.proxy = proxy
+        self.weight_budget = weight_budget  # (总权重额度, 采集进程份额)
+        self.weights = dict(weights) if weights else None
+        self.workers = workers or os.cpu_count() or 1
+        self.interval = interval
+        self.capacity = capacity
+        self.candles = None
+        self.results = None
+        self.process = None
+        self.pool = None
+        self._stop = None
+        self._analyzed = None  # 每行上次提交分析时的K线版本
+        self._read = None  # 每行上次读出的结果版本
+
+    def start(self, ingest=True):
+        """创建共享缓冲区、启动分析进程池；ingest 为假时由调用方自行 write K线"""
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        # Tk 主进程中 fork 不安全，统一用 spawn
+        context = multiprocessing.get_context('spawn')
+        count = len(self.symbols)
+        self.candles = SharedRowBuffer(count, (self.capacity, 6))
+        self.results = SharedRowBuffer(count, (len(SCREENER_METRICS),))
+        self._analyzed = np.zeros(count, dtype=np.int64)
+        self._read = np.zeros(count, dtype=np.int64)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        if ingest:
+            self._stop = context.Event()
+            self.process = context.Process(
+                target=_ingest_candles, daemon=True,
+                args=(self.candles.spec, self.symbols, self.timeframe, self.proxy, self.interval, self._stop,
+                      self.weight_budget))
+            self.process.start()
+        return self
+
+    def step(self):
+        """把K线有变化的行按分片交给分析进程池，等待完成，返回更新的行数"""
+        versions = self.candles.versions()
+        changed = np.flatnonzero((versions != self._analyzed) & (versions % 2 == 0))
+        if len(changed) == 0:
+            return 0
+        shard = -(-len(changed) // self.workers)
+        futures = [self.pool.submit(_analyze_rows, self.candles.spec, self.results.spec,
+                                    changed[start:start + shard].tolist(), self.weights)
+                   for start in range(0, len(changed), shard)]
+        updated = 0
+        for future in futures:
+            try:
+                updated += future.result()
+            except Exception as e:
+                print(f"分析进程错误: {str(e)}")
+        self._analyzed[changed] = versions[changed]
+        return updated
+
+    def rows(self):
+        """自上次调用以来有更新的结果 {交易对: {指标: 值}}"""
+        versions = self.results.versions()
+        rows = {}
+        for row in np.flatnonzero((versions != self._read) & (versions % 2 == 0)):
+            entry = self.results.read(row)
+            if entry is None:
+                continue
+            version, _, values = entry
+            self._read[row] = version
+            rows[self.symbols[row]] = dict(zip(SCREENER_METRICS, values.tolist()))
+        return rows
+
+    def close(self):
+        """停止采集进程和分析进程池并释放共享内存"""
+        if self._stop is not None:
+            self._stop.set()
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        for buffer in (self.candles, self.results):
+            if buffer is not None:
+                buffer.close()
+        self.candles = self.results = None
+
+
+def minmax_indices(series, start, stop, buckets):
+    """按像素分桶的最小/最大值降采样，返回 [start, stop) 内需要绘制的下标
+
+    每个桶保留每条序列最小值和最大值所在的位置，多条序列取下标并集，
+    这样同一坐标轴上的序列共用一组 x，峰值和交叉点都不会丢失。
+    """
+    count = stop - start
+    if count <= 2 * buckets:
+        return np.arange(start, stop)
+    size = -(-count // buckets)
+    n_buckets = -(-count // size)
+    pad = n_buckets * size - count
+    base = start + np.arange(n_buckets) * size
+    picks = [np.array([start, stop - 1])]
+    for y in series:
+        window = np.asarray(y[start:stop], dtype=float)
+        missing = np.isnan(window)
+        low = np.pad(np.where(missing, np.inf, window), (0, pad), constant_values=np.inf)
+        high = np.pad(np.where(missing, -np.inf, window), (0, pad), constant_values=-np.inf)
+        picks.append(base + low.reshape(n_buckets, size).argmin(axis=1))
+        picks.append(base + high.reshape(n_buckets, size).argmax(axis=1))
+    indices = np.unique(np.concatenate(picks))
+    return indices[indices < stop]
+
+
+def bucket_bounds(start, stop, buckets):
+    """把 [start, stop) 等分为最多 buckets 个桶，返回每个桶的首、末下标"""
+    size = max(1, -(-(stop - start) // buckets))
+    first = np.arange(start, stop, size)
+    return first, np.minimum(first + size, stop) - 1
+
+
+def ohlc_buckets(data, first, last):
+    """按桶合并K线，返回 (开, 高, 低, 收, 量)"""
+    start, stop = first[0], last[-1] + 1
+    offsets = first - start
+    return (data['open'][first],
+            np.maximum.reduceat(data['high'][start:stop], offsets),
+            np.minimum.reduceat(data['low'][start:stop], offsets),
+            data['close'][last],
+            np.add.reduceat(data['volume'][start:stop], offsets))
+
+
+def bar_vertices(x, bottom, top, width):
+    """生成一组矩形柱的顶点数组 (N, 4, 2)，用于 PolyCollection.set_verts"""
+    left = x - width / 2
+    right = x + width / 2
+    bottom = np.broadcast_to(bottom, np.shape(x))
+    return np.stack([np.stack([left, bottom], axis=-1), np.stack([left, top], axis=-1),
+                     np.stack([right, top], axis=-1), np.stack([right, bottom], axis=-1)], axis=1)
+
+
+CHART_OPTIONS = ('candles', 'volume', 'price', 'ma5', 'ma10', 'bollinger', 'rsi', 'macd', 'levels')
+UP_COLOR = '#23d18b'
+DOWN_COLOR = '#f14c4c'
+
+
+class ChartRenderer:
+    """K线/成交量/RSI/MACD 图表的绘制器，只依赖 matplotlib Figure，不依赖 Tk
+
+    完整数据保存在数组中，每次只把可见的 x 范围按坐标轴像素宽度降采样后交给图形对象，
+    因此无论载入多少历史K线，绘制的点数都只和图表宽度有关。K线、成交量和MACD柱
+    各用一个集合对象绘制，更新时只替换顶点数组，图形对象的数量与K线数无关。
+    """
+
+    # (列名, 图例, 颜色, 线型, 显示开关)
+    PANE_LINES = {
+        'price': [('close', '价格', '#569cd6', '-', 'price'),
+                  ('MA5', 'MA5', '#4ec9b0', '-', 'ma5'),
+                  ('MA10', 'MA10', '#ce9178', '-', 'ma10'),
+                  ('upper', '布林上轨', '#c586c0', '--', 'bollinger'),
+                  ('lower', '布林下轨', '#c586c0', '--', 'bollinger')],
+        'rsi': [('RSI', 'RSI', '#dcdcaa', '-', 'rsi')],
+        'macd': [('MACD', 'MACD', '#569cd6', '-', 'macd'),
+                 ('Signal', 'Signal', '#ce9178', '-', 'macd')],
+    }
+    DATA_COLUMNS = ('open', 'high', 'low', 'close', 'volume',
+                    'MA5', 'MA10', 'upper', 'lower', 'RSI', 'MACD', 'Signal', 'Histogram')
+    CANDLE_PIXELS = 3  # 每根K线至少占用的像素，超过时合并K线
+
+    def __init__(self, fig):
+        self.fig = fig
+        self.axes = {}
+        self.lines = []  # [(子图名, 列名, Line2D)]
+        self.collections = {}  # 'wicks' / 'bodies' / 'volume' / 'histogram'
+        self.level_artists = []  # 支撑/压力位的水平线和价格标签
+        self.options = None
+        self.colors = None
+        self._suspend_refresh = False
+        self.x = None
+        self.step = 1.0
+        self.data = {}
+        self.fig.canvas.mpl_connect('resize_event', lambda event: self.refresh())
+
+    def render(self, df, title='', options=None, colors=None, levels=None):
+        """重建图表布局并绘制 df（需包含 compute_indicators 生成的列），levels 为支撑/压力位"""
+        options = dict(dict.fromkeys(CHART_OPTIONS, True), **(options or {}))
+        self.options = options
+        self.colors = colors
+        colors = colors or {'bg': '#1e1e1e', 'fg': '#d4d4d4'}
+        collections = mcollections
+        self.fig.clear()
+        self.fig.patch.set_facecolor(colors['bg'])
+        self.lines = []
+        self.collections = {}
+        self.level_artists = []
+        
+        # 主图、成交量（可选）、RSI、MACD，共享x轴
+        panes = ['price'] + (['volume'] if options['volume'] else []) + ['rsi', 'macd']
+        gs = self.fig.add_gridspec(len(panes), 1, height_ratios=[3] + [1] * (len(panes) - 1), hspace=0.1)
+        self.axes = {}
+        for i, pane in enumerate(panes):
+            self.axes[pane] = self.fig.add_subplot(gs[i], sharex=self.axes.get('price'))
+        for ax in self.axes.values():
+            ax.set_facecolor(colors['bg'])
+            ax.grid(True, color='#404040', linestyle='--', linewidth=0.5)
+            ax.tick_params(colors=colors['fg'])
+        
+        self.load_frame(df)
+        has_ohlc = all(column in self.data for column in ('open', 'high', 'low', 'close', 'volume'))
+        
+        # 先创建空的图形对象，数据由 refresh 按可见范围填充
+        if options['candles'] and has_ohlc:
+            self.collections['wicks'] = collections.LineCollection([], linewidths=1)
+            self.collections['bodies'] = collections.PolyCollection([], linewidths=0)
+            self.axes['price'].add_collection(self.collections['wicks'])
+            self.axes['price'].add_collection(self.collections['bodies'])
+        for pane, specs in self.PANE_LINES.items():
+            for column, label, color, linestyle, option in specs:
+                if options[option] and column in self.data:
+                    line, = self.axes[pane].plot([], [], label=label, color=color, linestyle=linestyle)
+                    self.lines.append((pane, column, line))
+        
+        if 'volume' in self.axes and has_ohlc:
+            self.collections['volume'] = collections.PolyCollection([], linewidths=0, alpha=0.7)
+            self.axes['volume'].add_collection(self.collections['volume'])
+            self.axes['volume'].set_ylabel('成交量')
+        
+        if options['rsi']:
+            self.axes['rsi'].axhline(y=70, color='#f14c4c', linestyle='--', alpha=0.5)
+            self.axes['rsi'].axhline(y=30, color='#23d18b', linestyle='--', alpha=0.5)
+            self.axes['rsi'].set_ylim(0, 100)
+            self.axes['rsi'].set_ylabel('RSI')
+        
+        if options['macd'] and 'Histogram' in self.data:
+            self.collections['histogram'] = collections.PolyCollection([], linewidths=0, alpha=0.7)
+            self.axes['macd'].add_collection(self.collections['histogram'])
+            self.axes['macd'].set_ylabel('MACD')
+        
+        self.axes['price'].set_title(title, color=colors['fg'])
+        if options['levels']:
+            self.set_levels(levels)
+        
+        # 只在最底部显示时间轴
+        for pane in panes[:-1]:
+            self.axes[pane].tick_params(labelbottom=False)
+        # 缩放到几天或几年时按可见跨度自动选择日期格式
+        self.axes['macd'].xaxis_date()
+        locator = mdates.AutoDateLocator()
+        self.axes['macd'].xaxis.set_major_locator(locator)
+        self.axes['macd'].xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        
+        # 设置图例
+        for ax in self.axes.values():
+            if not ax.get_legend_handles_labels()[0]:
+                continue
+            legend = ax.legend(loc='upper left')
+            legend.get_frame().set_facecolor(colors['bg'])
+            for text in legend.get_texts():
+                text.set_color(colors['fg'])
+        
+        if len(self.x):
+            self.axes['price'].set_xlim(self.x[0] - self.step / 2, self.x[-1] + self.step / 2)
+        self.axes['price'].callbacks.connect(
+            'xlim_changed', lambda ax: None if self._suspend_refresh else self.refresh())
+        self.refresh(draw=False)
+        self.fig.canvas.draw()
+
+    def set_levels(self, levels):
+        """绘制支撑/压力位：支撑为绿色、压力为红色，越强越不透明"""
+        for artist in self.level_artists:
+            artist.remove()
+        self.level_artists = []
+        ax = self.axes['price']
+        for level in levels or ():
+            color = UP_COLOR if level['kind'] == 'support' else DOWN_COLOR
+            alpha = 0.3 + 0.6 * level['strength'] / 100
+            self.level_artists.append(ax.axhline(level['price'], color=color, linestyle=':',
+                                                 linewidth=1, alpha=alpha))
+            self.level_artists.append(ax.annotate(
+                f"{level['price']:.6g}", xy=(1, level['price']), xycoords=('axes fraction', 'data'),
+                xytext=(-2, 2), textcoords='offset points', ha='right', va='bottom',
+                color=color, alpha=alpha, fontsize=8, annotation_clip=True))
+
+    def load_frame(self, df):
+        """保存完整数据的副本，末尾K线更新时直接修改"""
+        self.x = mdates.date2num(df.index)
+        self.step = float(np.median(np.diff(self.x))) if len(self.x) > 1 else 1.0
+        self.data = {column: df[column].to_numpy(dtype=float, copy=True)
+                     for column in self.DATA_COLUMNS if column in df}
+
+    def set_data(self, df):
+        """替换数据但保留当前布局和可见范围，用于平移/缩放时载入更多历史"""
+        self.load_frame(df)
+        self.refresh()
+
+    def show(self, df, title=''):
+        """在现有布局上显示另一份数据的全部范围，用于复用图形"""
+        self.load_frame(df)
+        self.axes['price'].set_title(title, color=(self.colors or {}).get('fg', '#d4d4d4'))
+        if len(self.x):
+            self._suspend_refresh = True
+            try:
+                self.axes['price'].set_xlim(self.x[0] - self.step / 2, self.x[-1] + self.step / 2)
+            finally:
+                self._suspend_refresh = False
+        self.refresh(draw=False)
+
+    def visible_range(self):
+        """当前可见 x 范围对应的下标区间 [start, stop)，两侧各多取一个点使曲线延伸到边缘"""
+        low, high = self.axes['price'].get_xlim()
+        start = max(0, int(np.searchsorted(self.x, low, 'left')) - 1)
+        stop = min(len(self.x), int(np.searchsorted(self.x, high, 'right')) + 1)
+        return start, stop
+
+    def refresh(self, draw=True):
+        """按当前可见范围和坐标轴像素宽度重新降采样"""
+        if not self.axes or self.x is None or len(self.x) == 0:
+            return
+        start, stop = self.visible_range()
+        if stop <= start:
+            return
+        width = self.axes['price'].bbox.width
+        visible = {pane: [] for pane in self.axes}  # 各子图可见数据，用于纵轴范围
+        
+        # 折线：按像素分桶保留极值
+        for pane in self.PANE_LINES:
+            lines = [(column, line) for line_pane, column, line in self.lines if line_pane == pane]
+            if not lines:
+                continue
+            indices = minmax_indices([self.data[column] for column, _ in lines], start, stop, max(1, int(width)))
+            x = self.x[indices]
+            for column, line in lines:
+                y = self.data[column][indices]
+                line.set_data(x, y)
+                visible[pane].append(y)
+        
+        # K线、成交量和MACD柱：K线过密时按桶合并为OHLC
+        if self.collections:
+            first, last = bucket_bounds(start, stop, max(1, int(width // self.CANDLE_PIXELS)))
+            x = (self.x[first] + self.x[last]) / 2
+            bar_width = (self.x[last] - self.x[first] + self.step) * 0.6
+            if 'bodies' in self.collections or 'volume' in self.collections:
+                open_, high, low, close, volume = ohlc_buckets(self.data, first, last)
+                colors = np.where(close >= open_, UP_COLOR, DOWN_COLOR)
+            
+            if 'bodies' in self.collections:
+                wicks = np.stack([np.stack([x, low], axis=-1), np.stack([x, high], axis=-1)], axis=1)
+                self.collections['wicks'].set_segments(wicks)
+                self.collections['wicks'].set_color(colors)
+                self.collections['bodies'].set_verts(bar_vertices(x, open_, close, bar_width))
+                self.collections['bodies'].set_facecolor(colors)
+                visible['price'] += [low, high]
+            
+            if 'volume' in self.collections:
+                self.collections['volume'].set_verts(bar_vertices(x, 0.0, volume, bar_width))
+                self.collections['volume'].set_facecolor(colors)
+                visible['volume'] += [np.zeros(1), volume]
+            
+            if 'histogram' in self.collections:
+                # 每个桶保留绝对值最大的柱子
+                offsets = first - start
+                histogram = self.data['Histogram'][start:stop]
+                top = np.fmax.reduceat(histogram, offsets)
+                bottom = np.fmin.reduceat(histogram, offsets)
+                values = np.nan_to_num(np.where(np.abs(top) >= np.abs(bottom), top, bottom))
+                self.collections['histogram'].set_verts(bar_vertices(x, 0.0, values, bar_width))
+                self.collections['histogram'].set_facecolor(np.where(values >= 0, UP_COLOR, DOWN_COLOR))
+                visible['macd'].append(values)
+        
+        for pane, arrays in visible.items():
+            if pane != 'rsi' and arrays:  # RSI 固定为 0-100
+                self.autoscale_y(self.axes[pane], arrays)
+        
+        if draw:
+            self.fig.canvas.draw_idle()
+
+    @staticmethod
+    def autoscale_y(ax, arrays):
+        """根据可见数据设置纵轴范围"""
+        values = np.concatenate([np.asarray(a, dtype=float).ravel() for a in arrays])
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        low, high = values.min(), values.max()
+        margin = (high - low) * 0.05 or abs(high) * 0.01 or 1.0
+        ax.set_ylim(low - margin, high + margin)
+
+    def update_tail(self, df):
+        """只有最后一根K线变化时更新数据末尾并重绘；布局不匹配时返回 False"""
+        if not self.axes or self.x is None or len(self.x) != len(df) \
+                or self.x[-1] != mdates.date2num(df.index[-1:])[0]:
+            return False
+        for column, values in self.data.items():
+            values[-1] = df[column].iloc[-1]
+        self.refresh()
+        return True
+
+
+
+
+# 每个进程的离屏图形池：(尺寸, dpi) -> 空闲的 ChartRenderer 列表
+_SNAPSHOT_FIGURES = {}
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def _acquire_snapshot_renderer(size, dpi):
+    """从池中取一个 Agg 图形，没有空闲的就新建；不经过 pyplot，不需要显示器"""
+    key = (tuple(size), dpi)
+    with _SNAPSHOT_LOCK:
+        pool = _SNAPSHOT_FIGURES.setdefault(key, [])
+        if pool:
+            return pool.pop()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return ChartRenderer(fig)
+
+
+def _release_snapshot_renderer(renderer):
+    fig = renderer.fig
+    key = (tuple(fig.get_size_inches()), fig.dpi)
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT_FIGURES.setdefault(key, []).append(renderer)
+
+
+def render_snapshot(df, path=None, title='', options=None, colors=None, size=(10, 6), dpi=100):
+    """离屏渲染一张 K线/RSI/MACD 快照
+
+    df 需包含 compute_indicators 生成的列。返回 PNG 字节；指定 path 时写入文件并返回 path。
+    布局相同时复用池中图形已有的坐标轴和图形对象，只替换数据。
+    """
+    import io
+    
+    renderer = _acquire_snapshot_renderer(size, dpi)
+    try:
+        options = dict(dict.fromkeys(CHART_OPTIONS, True), **(options or {}))
+        if renderer.axes and renderer.options == options and renderer.colors == colors:
+            renderer.show(df, title)
+        else:
+            renderer.render(df, title, options, colors)
+        buffer = io.BytesIO()
+        # 快照以速度为先，使用低压缩级别（文件约大一倍，编码快数倍）
+        renderer.fig.savefig(buffer, format='png', facecolor=renderer.fig.get_facecolor(),
+                             pil_kwargs={'compress_level': 1})
+    finally:
+        _release_snapshot_renderer(renderer)
+    
+    if path is None:
+        return buffer.getvalue()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+    return path
+
+
+def _snapshot_worker_init(size=(10, 6), dpi=100):
+    """快照进程初始化：使用 Agg 后端并预先建好一个图形"""
+    import matplotlib
+    matplotlib.use('Agg')
+    _release_snapshot_renderer(_acquire_snapshot_renderer(size, dpi))
+
+
+def _render_snapshot_job(job):
+    return render_snapshot(**job)
+
+
+def create_snapshot_executor(max_workers=None):
+    """创建快照渲染进程池，可在多次 render_many 之间复用"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # Tk 主进程中 fork 不安全，统一用 spawn
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_snapshot_worker_init,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def render_many(jobs, max_workers=None, executor=None):
+    """在多个进程中并行渲染快照
+
+    jobs 为 render_snapshot 的参数字典列表，返回与之对应的结果列表，失败的项为 None。
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = create_snapshot_executor(max_workers)
+    try:
+        futures = [executor.submit(_render_snapshot_job, job) for job in jobs]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"渲染快照错误: {str(e)}")
+                results.append(None)
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+class CandleStore:
+    """本地K线库：每个交易对/周期一个 N×6 的 float64 .npy 文件，按时间排序，以内存映射方式读取"""
+
+    COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+    def __init__(self, root='candles'):
+        self.root = root
+        self._maps = {}
+        self.versions = {}  # 每次写入后递增，用于让已计算的窗口失效
+        self._lock = threading.Lock()
+
+    def path(self, symbol, timeframe):
+        name = symbol.replace('/', '_').replace(':', '_')
+        return os.path.join(self.root, f'{name}_{timeframe}.npy')
+
+    def load(self, symbol, timeframe):
+        """返回内存映射的K线数组，没有数据时返回 None"""
+        key = (symbol, timeframe)
+        with self._lock:
+            if key not in self._maps:
+                path = self.path(symbol, timeframe)
+                self._maps[key] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+            return self._maps[key]
+
+    def version(self, symbol, timeframe):
+        return self.versions.get((symbol, timeframe), 0)
+
+    def write(self, symbol, timeframe, ohlcv):
+        """合并写入K线，相同时间戳以新数据为准；先写临时文件再替换，返回总K线数"""
+        new = np.asarray(ohlcv, dtype=float).reshape(-1, 6)
+        key = (symbol, timeframe)
+        path = self.path(symbol, timeframe)
+        with self._lock:
+            # 先释放内存映射，Windows 下才能替换文件
+            self._maps.pop(key, None)
+            merged = np.concatenate([np.load(path), new]) if os.path.exists(path) else new
+            # 倒序后取每个时间戳第一次出现的行，即最后写入的数据；np.unique 同时按时间排序
+            merged = merged[::-1]
+            _, keep = np.unique(merged[:, 0], return_index=True)
+            merged = merged[keep]
+            
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, merged)
+            os.replace(tmp_path, path)
+            self.versions[key] = self.version(symbol, timeframe) + 1
+        return len(merged)
+
+
+class CandleWindowCache:
+    """按固定大小的窗口从 CandleStore 懒加载K线并计算指标
+
+    每个窗口向前多取 warmup 根K线用于指标预热，计算后丢弃；已加载的窗口按 LRU 保留
+    最多 max_windows 个，每次取数后在后台预取左右相邻的窗口。
+    """
+
+    def __init__(self, store, window_bars=2000, warmup=100, max_windows=16):
+        self.store = store
+        self.window_bars = window_bars
+        self.warmup = warmup
+        self.max_windows = max_windows
+        self._windows = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='candle-prefetch')
+        self.stats = {'hits': 0, 'misses': 0, 'prefetched': 0, 'evicted': 0}
+
+    def _load_window(self, symbol, timeframe, index):
+        candles = self.store.load(symbol, timeframe)
+        start = index * self.window_bars
+        low = max(0, start - self.warmup)
+        high = min(len(candles), start + self.window_bars)
+        df = pd.DataFrame(np.array(candles[low:high]), columns=CandleStore.COLUMNS)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        df.set_index('timestamp', inplace=True)
+        return compute_indicators(df).iloc[start - low:]
+
+    def window(self, symbol, timeframe, index, prefetch=False):
+        """取一个窗口（含指标），正在后台加载时等待其完成"""
+        key = (symbol, timeframe, self.store.version(symbol, timeframe), index)
+        with self._lock:
+            if key in self._windows:
+                self._windows.move_to_end(key)
+                if not prefetch:
+                    self.stats['hits'] += 1
+                return self._windows[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            return future.result()
+        
+        try:
+            df = self._load_window(symbol, timeframe, index)
+            future.set_result(df)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        
+        with self._lock:
+            self._windows[key] = df
+            self.stats['prefetched' if prefetch else 'misses'] += 1
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+                self.stats['evicted'] += 1
+        return df
+
+    def get_range(self, symbol, timeframe, start_ms, end_ms):
+        """取时间范围内的K线和指标；范围过宽时以中心为准截取，最多占用一半的缓存窗口"""
+        candles = self.store.load(symbol, timeframe)
+        if candles is None or len(candles) == 0:
+            return None
+        timestamps = candles[:, 0]
+        low = int(np.searchsorted(timestamps, start_ms, 'left'))
+        high = int(np.searchsorted(timestamps, end_ms, 'right'))
+        max_bars = self.window_bars * max(1, self.max_windows // 2)
+        if high - low > max_bars:
+            center = (low + high) // 2
+            low, high = center - max_bars // 2, center + max_bars // 2
+        if high <= low:
+            return None
+        
+        first, last = low // self.window_bars, (high - 1) // self.window_bars
+        df = pd.concat([self.window(symbol, timeframe, i) for i in range(first, last + 1)])
+        
+        # 后台预取相邻窗口
+        n_windows = -(-len(candles) // self.window_bars)
+        for index in (first - 1, last + 1):
+            if 0 <= index < n_windows:
+                self._executor.submit(self.window, symbol, timeframe, index, True)
+        
+        offset = first * self.window_bars
+        return df.iloc[low - offset:high - offset]
+
+
+def date_num_to_ms(value):
+    """matplotlib 日期数值转换为毫秒时间戳"""
+    return mdates.num2date(value).timestamp() * 1000
+
+
+class ChartNavigator:
+    """图表的滚轮缩放、拖动平移和双击复位；视图超出已载入数据时通过 loader 按需加载"""
+
+    ZOOM_STEP = 1.25
+    MIN_BARS = 10
+
+    def __init__(self, renderer, loader=None, on_reset=None, max_bars=16000):
+        self.renderer = renderer
+        self.loader = loader  # loader(x_low, x_high) -> DataFrame 或 None
+        self.on_reset = on_reset
+        self.max_bars = max_bars
+        self.detached = False  # 用户移动过视图后，实时刷新不再重置视图
+        self._drag = None
+        self._requested = None  # 最近一次向 loader 请求的范围，避免重复加载
+        canvas = renderer.fig.canvas
+        canvas.mpl_connect('scroll_event', self.on_scroll)
+        canvas.mpl_connect('button_press_event', self.on_press)
+        canvas.mpl_connect('motion_notify_event', self.on_motion)
+        canvas.mpl_connect('button_release_event', self.on_release)
+
+    def on_scroll(self, event):
+        """以鼠标位置为中心缩放"""
+        if event.inaxes is None or event.xdata is None or self.renderer.x is None:
+            return
+        low, high = self.renderer.axes['price'].get_xlim()
+        factor = 1 / self.ZOOM_STEP if event.button == 'up' else self.ZOOM_STEP
+        span = min(max((high - low) * factor, self.renderer.step * self.MIN_BARS),
+                   self.renderer.step * self.max_bars)
+        ratio = (event.xdata - low) / (high - low)
+        self.set_view(event.xdata - span * ratio, event.xdata + span * (1 - ratio))
+
+    def on_press(self, event):
+        if event.button != 1 or event.inaxes is None:
+            return
+        if event.dblclick:
+            self.reset()
+            return
+        self._drag = (event.x, self.renderer.axes['price'].get_xlim())
+
+    def on_motion(self, event):
+        """按像素位移平移视图"""
+        if self._drag is None or event.x is None:
+            return
+        start_x, (low, high) = self._drag
+        shift = -(event.x - start_x) / self.renderer.axes['price'].bbox.width * (high - low)
+        self.set_view(low + shift, high + shift)
+
+    def on_release(self, event):
+        self._drag = None
+
+    def set_view(self, low, high):
+        self.detached = True
+        self.renderer.axes['price'].set_xlim(low, high)
+        self.ensure_loaded()
+
+    def ensure_loaded(self):
+        """视图超出已载入的数据时加载当前视图左右各一屏的数据"""
+        if self.loader is None or self.renderer.x is None or len(self.renderer.x) == 0:
+            return
+        low, high = self.renderer.axes['price'].get_xlim()
+        x = self.renderer.x
+        if low >= x[0] and high <= x[-1]:
+            return
+        if self._requested is not None and self._requested[0] <= low and high <= self._requested[1]:
+            return
+        span = high - low
+        self._requested = (low - span, high + span)
+        try:
+            df = self.loader(*self._requested)
+        except Exception as e:
+            print(f"加载图表数据错误: {str(e)}")
+            return
+        if df is not None and len(df):
+            self.renderer.set_data(df)
+
+    def invalidate(self):
+        """数据源变化后清除加载记录"""
+        self._requested = None
+
+    def reset(self):
+        """回到实时视图"""
+        self.detached = False
+        self.invalidate()
+        if self.on_reset is not None:
+            self.on_reset()
+
+
+SNAPSHOT_POLL_MS = 100  # 界面检查新快照的间隔
+
+
+# 界面线程发布给工作线程的当前选择；工作线程只读这个元组，不访问 Tk 变量
+MonitorSelection = namedtuple('MonitorSelection', [
+    'symbol',
+    'timeframe',
+    'model_type',
+    'proxy',        # proxy_settings() 的结果
+])
+
+
+# 工作线程发布给界面的一帧行情；发布后任何一方都不再修改其中的数据
+MarketSnapshot = namedtuple('MarketSnapshot', [
+    'version',      # 单调递增的版本号
+    'symbol',
+    'timeframe',
+    'change',       # new / tick / book / stale
+    'frame',        # 含指标列的 DataFrame；DataFrame 无法设为只读，使用方按约定不得修改，需要时先 copy()
+    'arrays',       # 只读的 1×T 数值数组，同 frame_fields
+    'price',
+    'price_digits',
+    'scores',       # 策略评分，计算失败时为 None
+    'book',         # 订单簿指标（OrderBook.metrics），没有盘口数据时为 None
+    'levels',       # 按强度排序的支撑/压力位（SupportResistanceEngine.levels）
+    'support',
+    'resistance',
+    'stale_age',    # 数据延迟秒数，正常数据为 0
+    'created',
+])
+
+
+def freeze_fields(fields):
+    """把数值数组设为只读，误改时直接报错而不是静默地产生竞争"""
+    for values in fields.values():
+        values.flags.writeable = False
+    return fields
+
+
+class SnapshotMailbox:
+    """单槽信箱：工作线程发布最新快照，界面线程只取最新的一个
+
+    发布只是一次引用赋值（在 GIL 下是原子的），不需要锁；
+    界面来不及处理的中间快照会被直接覆盖，计入 dropped。
+    """
+
+    def __init__(self):
+        self._slot = None
+        self.published = 0
+        self.consumed = 0
+
+    def publish(self, snapshot):
+        self._slot = snapshot
+        self.published += 1
+
+    def take(self, after_version=0):
+        """取出比 after_version 新的快照，没有则返回 None"""
+        snapshot = self._slot
+        if snapshot is None or snapshot.version <= after_version:
+            return None
+        self.consumed += 1
+        return snapshot
+
+    def peek(self):
+        return self._slot
+
+    @property
+    def dropped(self):
+        return self.published - self.consumed
+
+
+# 配置项及默认值，读取时按默认值的类型校验
+DEFAULT_CONFIG = {
+    'proxy_host': '127.0.0.1',
+    'proxy_port': '7890',
+    'proxy_type': 'http',
+    'use_proxy': False,  # 默认不使用代理
+    'price_alert': True,
+    'ma_cross_alert': True,
+    'bollinger_alert': True,
+    'rsi_alert': True,
+    'volume_alert': True,
+    'trend_alert': True,
+    'momentum_alert': True,
+    'macd_cross_alert': True,
+    'symbol': 'BTC/USDT',
+    'timeframe': '1h',
+    'max_signals': 100,  # 默认保存100条信号
+    'recent_signals': [],  # 保存的信号列表
+    'theme': 'VSCode',
+    'use_ml_model': True,
+    'model_type': 'random_forest',
+    'online_decay': 0.01,
+    'refresh_intervals': {},  # 覆盖默认的各周期刷新间隔
+    'score_weights': {},  # 覆盖默认的策略评分权重
+    'watchlist': [],  # 筛选器的观察列表，为空时使用全部 USDT 交易对
+    'alert_snapshots': False,  # 信号触发时保存图表快照
+    'screener_processes': 0,  # 筛选器分析进程数，0 表示在界面进程的后台线程中计算
+    'sr_params': {}  # 覆盖默认的支撑/压力位引擎参数
+}
+
+
+class ConfigStore:
+    """配置存储：带类型的默认值，内存中记录改动，延迟合并写盘
+
+    update 只在值真正变化时标记改动，并在 delay 秒后统一写入一次；
+    写入先写临时文件再原子替换，避免写到一半时程序退出导致配置丢失。
+    文件中只保存与默认值不同的项，未知的键原样保留。
+    """
+
+    def __init__(self, path, defaults=None, delay=2.0):
+        self.path = path
+        self.defaults = copy.deepcopy(DEFAULT_CONFIG if defaults is None else defaults)
+        self.delay = delay
+        self.values = copy.deepcopy(self.defaults)
+        self.extra = {}  # 文件中不认识的键
+        self.saved = None  # 上次写入的内容，相同则不再写
+        self.writes = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def coerce(self, key, value):
+        """按默认值的类型校验，类型不符时返回默认值"""
+        default = self.defaults[key]
+        if isinstance(default, bool):
+            valid = isinstance(value, bool)
+        elif isinstance(default, float):
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+            value = float(value) if valid else value
+        elif isinstance(default, int):
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, type(default))
+        if not valid:
+            print(f"配置项 {key} 类型错误，使用默认值: {value!r}")
+            return copy.deepcopy(default)
+        return value
+
+    def load(self):
+        """从文件加载配置，文件不存在或损坏时使用默认值"""
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"读取配置文件错误: {str(e)}")
+        with self._lock:
+            self.values = copy.deepcopy(self.defaults)
+            self.extra = {}
+            for key, value in data.items():
+                if key in self.defaults:
+                    self.values[key] = self.coerce(key, value)
+                else:
+                    self.extra[key] = value
+            self.saved = self.serialize()
+        return self.values
+
+    def get(self, key):
+        return self.values.get(key, self.defaults.get(key))
+
+    def update(self, values):
+        """更新配置，返回实际变化的键；有变化时安排一次延迟写入"""
+        with self._lock:
+            changed = [key for key, value in values.items() if self.values.get(key) != value]
+            for key in changed:
+                self.values[key] = copy.deepcopy(values[key])
+        if changed:
+            self.schedule()
+        return changed
+
+    def schedule(self):
+        """延迟写入，期间的多次修改合并为一次"""
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def serialize(self):
+        data = dict(self.extra)
+        data.update({key: value for key, value in self.values.items() if self.defaults.get(key) != value})
+        return json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True)
+
+    def flush(self):
+        """立即写入未保存的修改，返回是否写了文件"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            text = self.serialize()
+            if text == self.saved:
+                return False
+            try:
+                tmp_path = f'{self.path}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"保存配置文件错误: {str(e)}")
+                return False
+            self.saved = text
+            self.writes += 1
+            return True
+
 
 class CryptoMonitor:
     def __init__(self):
@@ -59,12 +3851,24 @@ class CryptoMonitor:
         self.style = ttk.Style()
         self.style.theme_use('clam')
         
-        # 初始化 matplotlib 图形
-        self.fig, self.ax = plt.subplots(figsize=(10, 6), constrained_layout=True)
+        # matplotlib 图形在主窗口显示后再创建
+        self.fig = None
+        self.ax = None
+        self.canvas = None
+        self.chart_renderer = None
+        self.chart_navigator = None
+        
+        # 本地K线库，图表平移/缩放时按窗口懒加载
+        self.candle_store = CandleStore()
+        self.candle_windows = CandleWindowCache(self.candle_store)
+        
+        # 信号快照的后台渲染进程池，首次使用时创建
+        self.snapshot_dir = 'snapshots'
+        self.snapshot_executor = None
         
         # 初始化交易对和时间周期
         self.symbols = ['BTC/USDT', 'ETH/USDT']
-        self.timeframes = ['1m', '5m', '15m', '30m', '1h', '4h', '1d']
+        self.timeframes = ['1s', '5s', '15s', '1m', '5m', '15m', '30m', '1h', '4h', '1d']
         
         # 初始化变量
         self.symbol_var = tk.StringVar(value='BTC/USDT')
@@ -72,6 +3876,7 @@ class CryptoMonitor:
         self.use_proxy = tk.BooleanVar(value=False)
         self.proxy_host = tk.StringVar(value='127.0.0.1')
         self.proxy_port = tk.StringVar(value='7890')
+        self.proxy_type = tk.StringVar(value='http')  # http 或 socks5
         self.max_signals = tk.IntVar(value=100)
         
         # 初始化价格提醒设置
@@ -83,6 +3888,7 @@ class CryptoMonitor:
         self.trend_alert = tk.BooleanVar(value=True)
         self.momentum_alert = tk.BooleanVar(value=True)
         self.macd_cross_alert = tk.BooleanVar(value=True)
+        self.alert_snapshots = tk.BooleanVar(value=False)  # 信号触发时保存图表快照
         
         # 初始化图表显示设置
         self.show_price = tk.BooleanVar(value=True)
@@ -91,6 +3897,9 @@ class CryptoMonitor:
         self.show_bollinger = tk.BooleanVar(value=True)
         self.show_rsi = tk.BooleanVar(value=True)
         self.show_macd = tk.BooleanVar(value=True)
+        self.show_candles = tk.BooleanVar(value=True)
+        self.show_volume = tk.BooleanVar(value=True)
+        self.show_levels = tk.BooleanVar(value=True)
         
         # 初始化支撑位和压力位变量
         self.support_level = tk.StringVar(value='--')
@@ -100,8 +3909,11 @@ class CryptoMonitor:
         self.running = False
         self.recent_signals = []
         self.use_ml_model = tk.BooleanVar(value=True)  # 默认启用机器学习模型
+        self.model_type = tk.StringVar(value='random_forest')  # random_forest 或 online
+        self.online_decay = tk.DoubleVar(value=0.01)
         
-        # 加载设置
+        # 加载设置，配置文件的读写都经由配置存储
+        self.config_store = ConfigStore('config.json')
         self.load_settings()
         
         # 现在可以安全地应用主题
@@ -111,14 +3923,64 @@ class CryptoMonitor:
         self.create_widgets()
         
         # 加载配置
-        self.config_file = 'config.json'
-        self.load_config_without_display()
+        self.load_config()
+        
+        # 工作线程使用的选择由界面线程在变量变化时发布
+        self.selection = None
+        for var in (self.symbol_var, self.timeframe_var, self.model_type,
+                    self.use_proxy, self.proxy_type, self.proxy_host, self.proxy_port):
+            var.trace_add('write', self.publish_selection)
+        self.publish_selection()
         
         # 更新信号显示
         self.update_signal_display()
         
-        # 初始化数据
-        self.exchange = ccxt.binance()  # 例如，使用 Binance 交易所
+        # 交易所实例在首次使用时创建，所有请求经由全局调度器限流
+        self._exchange = None
+        self._alternate_exchanges = None
+        self._exchange_lock = threading.Lock()  # 界面线程和工作线程都可能首次访问
+        self.transport = ExchangeTransport()
+        self.scheduler = RequestScheduler()
+        self.fetcher = ResilientFetcher(self.scheduler, lambda: self.exchange, self.alternate_exchanges)
+        
+        # 轮询按K线收盘时刻对齐，停止监控时立即唤醒
+        self.candle_clock = CandleClock()
+        self.stop_event = threading.Event()
+        self.closed_candle_tick = False
+        
+        # 数据变化检测：未变化时跳过计算和重绘，并按阶段计数
+        self._last_fingerprint = None
+        self.stage_stats = {stage: {'run': 0, 'partial': 0, 'skipped': 0}
+                            for stage in ('indicators', 'scores', 'signals', 'chart')}
+        
+        # 获取失败时继续使用最后一次成功的数据并标记为延迟
+        self.data_stale = False
+        self.last_good_time = None
+        
+        # 秒级周期的本地K线聚合，只在工作线程中读写
+        self.trade_builder = None
+        self.trade_builder_key = None
+        
+        # 当前交易对/周期的支撑压力位引擎，只在工作线程中读写
+        self.sr_engine = None
+        self.sr_engine_key = None
+        
+        # 当前交易对的订单簿，只在工作线程中读写
+        self.order_book = OrderBook()
+        self.order_book_symbol = None
+        
+        # 工作线程只发布不可变的行情快照，界面线程定时取最新的一帧
+        self.market_mailbox = SnapshotMailbox()
+        self.market_versions = itertools.count(1)
+        self.market_snapshot = None  # 界面线程最后应用的快照
+        self.last_df = None
+        self.root.after(SNAPSHOT_POLL_MS, self.poll_market_snapshot)
+        
+        # 观察列表行情筛选，只在筛选窗口打开时刷新
+        self.screener = MarketScreener(self.score_weights)
+        self.screener_window = None
+        self.screener_thread = None
+        self.screener_stop = threading.Event()
         
         # 添加醒目的按钮样式
         self.style.configure('Accent.TButton',
@@ -130,112 +3992,167 @@ class CryptoMonitor:
         # 初始化信号记录
         self.last_signal_times = {}
         
+        # 声明式信号规则：内置规则 + signal_rules.json 中的用户规则
+        self.signal_rules_file = 'signal_rules.json'
+        self.signal_rules = SignalRuleSet(*load_signal_rules(self.signal_rules_file))
+        
         # 绑定窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
         # 初始化随机森林模型
-        self.model = RandomForestClassifier(n_estimators=100, random_state=42)
+        self.model_params = dict(DEFAULT_MODEL_PARAMS)
+        self.feature_params = dict(DEFAULT_FEATURE_PARAMS)
+        self.model = None  # 训练时才创建，避免启动时导入sklearn
         self.is_model_trained = False
-    
-    def load_config_without_display(self):
-        """从文件加载配置，但不更新显示"""
-        self.config = {
-            'proxy_host': '127.0.0.1',
-            'proxy_port': '7890',
-            'use_proxy': False,
-            'price_alert': True,
-            'ma_cross_alert': True,
-            'bollinger_alert': True,
-            'rsi_alert': True,
-            'volume_alert': True,
-            'trend_alert': True,
-            'momentum_alert': True,
-            'macd_cross_alert': True,
-            'symbol': 'BTC/USDT',
-            'timeframe': '1h',
-            'max_signals': 100,
-            'recent_signals': [],
-            'theme': 'VSCode'
-        }
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.config.update(json.load(f))
-            except:
-                pass
         
-        # 初始化代理设置
-        self.use_proxy.set(self.config.get('use_proxy', False))
-        self.proxy_host.set(self.config.get('proxy_host', '127.0.0.1'))
-        self.proxy_port.set(self.config.get('proxy_port', '7890'))
+        # 模型登记表，记录模型格式、加载耗时和内存占用
+        self.model_registry_file = 'model_registry.json'
+        self.model_registry = self.load_model_registry()
         
-        # 初始化交易设置
-        self.symbol_var.set(self.config.get('symbol', 'BTC/USDT'))
-        self.timeframe_var.set(self.config.get('timeframe', '1h'))
+        # 初始化在线学习模型
+        self.online_model_file = 'online_model.pkl'
+        self.online_min_updates = 50  # 至少学习这么多根K线后才参与预测
+        self.online_model = self.load_online_model()
         
-        # 加载信号设置
-        self.max_signals.set(self.config.get('max_signals', 100))
-        self.recent_signals = self.config.get('recent_signals', [])
+        # 主窗口出现后再创建图表
+        self.root.after(100, self.ensure_chart)
         
-        # 初始化主题
-        self.current_theme.set(self.config.get('theme', 'VSCode'))
-        self.apply_theme()
+        # 交易对元数据先读磁盘缓存，过期时后台刷新
+        self.market_catalog = MarketCatalog()
+        self.root.after(200, self.init_market_catalog)
+    
+    @property
+    def exchange(self):
+        """交易所实例，首次访问时创建"""
+        if self._exchange is None:
+            with self._exchange_lock:
+                if self._exchange is None:
+                    # 例如，使用 Binance 交易所；限流交给调度器统一处理
+                    exchange = ccxt.binance({'enableRateLimit': False})
+                    # 可能在工作线程中首次访问，代理设置取界面线程发布的选择
+                    self.transport.configure(*self.selection.proxy)
+                    self.transport.attach(exchange)
+                    self.scheduler.set_weight_limit(exchange_weight_limit(exchange))
+                    self._exchange = exchange
+        return self._exchange
+    
+    @exchange.setter
+    def exchange(self, value):
+        with self._exchange_lock:
+            if self._exchange is not None and self._exchange is not value:
+                self.transport.detach(self._exchange)
+            self._exchange = value
+    
+    def init_market_catalog(self):
+        """加载交易对缓存并在需要时后台刷新"""
+        if self.market_catalog.load_cache():
+            self.on_markets_updated()
+        if self.market_catalog.is_stale():
+            self.refresh_markets()
+    
+    def refresh_markets(self):
+        """在后台从交易所刷新交易对元数据"""
+        self.market_catalog.refresh_async(
+            lambda: self.exchange_call('load_markets', True, priority=PRIORITY_BACKFILL),
+            on_done=lambda: self.root.after(0, self.on_markets_updated),
+            precision_mode=lambda: self.exchange.precisionMode)
+    
+    def on_markets_updated(self):
+        """交易对列表更新后，下拉框列出全部交易对；输入时再按内容过滤"""
+        self.symbol_cb['values'] = self.market_catalog.symbols()
+    
+    def filter_symbols(self, event=None):
+        """按输入内容过滤交易对下拉框"""
+        if event is not None and event.keysym in ('Return', 'Up', 'Down', 'Escape'):
+            return
+        if len(self.market_catalog.index) == 0:
+            return
+        self.symbol_cb['values'] = self.market_catalog.index.search(self.symbol_cb.get(), limit=100)
+    
+    def alternate_exchanges(self):
+        """使用备用API域名的交易所实例，用于对冲请求"""
+        if self._alternate_exchanges is None:
+            with self._exchange_lock:
+                if self._alternate_exchanges is None:
+                    exchanges = []
+                    for host in BINANCE_ALTERNATE_HOSTS:
+                        exchange = ccxt.binance({'enableRateLimit': False})
+                        exchange.urls['api'] = replace_api_host(exchange.urls['api'], host)
+                        self.transport.configure(*self.selection.proxy)
+                        self.transport.attach(exchange)
+                        exchanges.append(exchange)
+                    self._alternate_exchanges = exchanges
+        return self._alternate_exchanges
+    
+    def exchange_call(self, method, *args, priority=PRIORITY_LIVE, **kwargs):
+        """通过全局调度器调用交易所接口"""
+        return self.scheduler.call(getattr(self.exchange, method), *args, priority=priority, **kwargs)
+    
+    def exchange_submit(self, method, *args, priority=PRIORITY_LIVE, **kwargs):
+        """通过全局调度器异步调用交易所接口，返回 Future"""
+        return self.scheduler.submit(getattr(self.exchange, method), *args, priority=priority, **kwargs)
+    
+    def ensure_chart(self):
+        """创建matplotlib图形和画布（首次调用时导入matplotlib）"""
+        if self.canvas is not None:
+            return
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         
-        # 更新信号显示
-        self.update_signal_display()
+        self.fig, self.ax = plt.subplots(figsize=(10, 6), constrained_layout=True)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.chart_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.chart_renderer = ChartRenderer(self.fig)
+        self.chart_navigator = ChartNavigator(self.chart_renderer, loader=self.load_chart_range,
+                                              on_reset=self.update_chart_visibility)
+        self.apply_theme()
     
     def load_config(self):
-        """从文件加载配置"""
-        self.config = {
-            'proxy_host': '127.0.0.1',
-            'proxy_port': '7890',
-            'use_proxy': False,  # 默认不使用代理
-            'price_alert': True,
-            'ma_cross_alert': True,
-            'bollinger_alert': True,
-            'rsi_alert': True,
-            'volume_alert': True,
-            'trend_alert': True,
-            'momentum_alert': True,
-            'macd_cross_alert': True,
-            'symbol': 'BTC/USDT',
-            'timeframe': '1h',
-            'max_signals': 100,  # 默认保存100条信号
-            'recent_signals': [],  # 保存的信号列表
-            'theme': 'VSCode'
-        }
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.config.update(json.load(f))
-            except:
-                pass
+        """把配置存储中的设置应用到界面变量"""
+        config = self.config_store.values
         
         # 初始化代理设置
-        self.use_proxy.set(self.config.get('use_proxy', False))
-        self.proxy_host.set(self.config.get('proxy_host', '127.0.0.1'))
-        self.proxy_port.set(self.config.get('proxy_port', '7890'))
+        self.use_proxy.set(config['use_proxy'])
+        self.proxy_host.set(config['proxy_host'])
+        self.proxy_port.set(config['proxy_port'])
+        self.proxy_type.set(config['proxy_type'])
+        
+        # 初始化信号提醒开关
+        for key in ('price_alert', 'ma_cross_alert', 'bollinger_alert', 'rsi_alert',
+                    'volume_alert', 'trend_alert', 'momentum_alert', 'macd_cross_alert'):
+            getattr(self, key).set(config[key])
         
         # 初始化交易设置
-        self.symbol_var.set(self.config.get('symbol', 'BTC/USDT'))
-        self.timeframe_var.set(self.config.get('timeframe', '1h'))
+        self.symbol_var.set(config['symbol'])
+        self.timeframe_var.set(config['timeframe'])
         
         # 加载信号设置
-        self.max_signals.set(self.config.get('max_signals', 100))
-        self.recent_signals = self.config.get('recent_signals', [])
+        self.max_signals.set(config['max_signals'])
+        self.recent_signals = list(config['recent_signals'])
         
         # 初始化主题
-        self.current_theme.set(self.config.get('theme', 'VSCode'))
+        self.current_theme.set(config['theme'])
         self.apply_theme()
         
+        # 初始化模型设置
+        self.use_ml_model.set(config['use_ml_model'])
+        self.model_type.set(config['model_type'])
+        self.online_decay.set(config['online_decay'])
+        self.refresh_intervals = dict(DEFAULT_REFRESH_INTERVALS, **config['refresh_intervals'])
+        self.score_weights = dict(DEFAULT_SCORE_WEIGHTS, **config['score_weights'])
+        self.watchlist = list(config['watchlist'])
+        self.alert_snapshots.set(config['alert_snapshots'])
+        self.screener_processes = config['screener_processes']
+        self.sr_params = dict(DEFAULT_SR_PARAMS, **config['sr_params'])
+        
         # 更新信号显示
         self.update_signal_display()
     
-    def save_config(self):
-        """保存配置到文件"""
-        self.config.update({
+    def save_config(self, flush=False):
+        """更新配置存储，有变化时延迟写盘；flush 为真时立即写入"""
+        self.config_store.update({
             'proxy_host': self.proxy_host.get(),
             'proxy_port': self.proxy_port.get(),
+            'proxy_type': self.proxy_type.get(),
             'use_proxy': self.use_proxy.get(),
             'price_alert': self.price_alert.get(),
             'ma_cross_alert': self.ma_cross_alert.get(),
@@ -248,26 +4165,44 @@ class CryptoMonitor:
             'symbol': self.symbol_var.get(),
             'timeframe': self.timeframe_var.get(),
             'max_signals': self.max_signals.get(),
-            'recent_signals': self.recent_signals,
-            'theme': self.current_theme.get()
+            'recent_signals': list(self.recent_signals),
+            'theme': self.current_theme.get(),
+            'model_type': self.model_type.get(),
+            'online_decay': self.online_decay.get(),
+            'refresh_intervals': {tf: sec for tf, sec in self.refresh_intervals.items()
+                                  if DEFAULT_REFRESH_INTERVALS.get(tf) != sec},
+            'score_weights': {key: weight for key, weight in self.score_weights.items()
+                              if DEFAULT_SCORE_WEIGHTS.get(key) != weight},
+            'watchlist': self.watchlist,
+            'alert_snapshots': self.alert_snapshots.get(),
+            'use_ml_model': self.use_ml_model.get(),
+            'screener_processes': self.screener_processes,
+            'sr_params': {key: value for key, value in self.sr_params.items()
+                          if DEFAULT_SR_PARAMS.get(key) != value}
         })
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False)
+        if flush:
+            self.config_store.flush()
     
-    def update_exchange(self):
-        """更新交易所实例的代理设置"""
+    def proxy_settings(self):
+        """当前代理设置 (是否启用, 类型, 地址, 端口)"""
+        return (self.use_proxy.get(), self.proxy_type.get(),
+                self.proxy_host.get().strip(), self.proxy_port.get().strip())
+
+    def publish_selection(self, *args):
+        """发布当前交易对、周期、模型类型和代理设置，只在界面线程中调用"""
+        self.selection = MonitorSelection(self.symbol_var.get(), self.timeframe_var.get(),
+                                          self.model_type.get(), self.proxy_settings())
+
+    def update_exchange(self, proxy=None):
+        """更新交易所实例的代理设置，仅在设置变化时重建连接池
+
+        工作线程传入 selection.proxy；不传时读取界面上的设置，只能在界面线程中这样调用。
+        """
         try:
             if self.exchange is not None:
-                if self.use_proxy.get():
-                    # 使用代理
-                    proxy = f'http://{self.proxy_host.get()}:{self.proxy_port.get()}'
-                    self.exchange.proxies = {
-                        'http': proxy,
-                        'https': proxy
-                    }
-                else:
-                    # 不使用代理
-                    self.exchange.proxies = None
+                if self.transport.configure(*(proxy or self.proxy_settings())):
+                    for exchange in [self.exchange] + (self._alternate_exchanges or []):
+                        self.transport.attach(exchange)
             else:
                 print("交易所实例未初始化")
         except Exception as e:
@@ -284,6 +4219,9 @@ class CryptoMonitor:
         menubar.add_cascade(label="文件", menu=file_menu)
         file_menu.add_command(label="设置", command=self.show_settings_window)
         file_menu.add_command(label="训练模型", command=self.show_training_window)
+        file_menu.add_command(label="行情筛选", command=self.show_screener_window)
+        file_menu.add_command(label="处理统计", command=self.show_stage_stats)
+        file_menu.add_checkbutton(label="信号快照", variable=self.alert_snapshots, command=self.save_config)
         file_menu.add_separator()
         file_menu.add_command(label="退出", command=self.root.quit)
         
@@ -298,9 +4236,7 @@ class CryptoMonitor:
         # 创建图表区域
         chart_frame = ttk.LabelFrame(middle_frame, text='价格走势图', padding=5)
         chart_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        
-        self.canvas = FigureCanvasTkAgg(self.fig, master=chart_frame)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.chart_frame = chart_frame
         
         # 添加最近信号显示框架
         signal_frame = ttk.LabelFrame(middle_frame, text='最近信号', padding=2)
@@ -329,6 +4265,8 @@ class CryptoMonitor:
             values=self.symbols, width=10)
         symbol_cb.pack(side=tk.LEFT, padx=2)
         symbol_cb.bind('<<ComboboxSelected>>', lambda e: self.save_config())
+        symbol_cb.bind('<KeyRelease>', self.filter_symbols)
+        self.symbol_cb = symbol_cb
         
         timeframe_frame = ttk.Frame(trade_frame)
         timeframe_frame.pack(fill=tk.X, padx=2, pady=2)
@@ -375,6 +4313,9 @@ class CryptoMonitor:
         self.show_bollinger = tk.BooleanVar(value=True)
         self.show_rsi = tk.BooleanVar(value=True)
         self.show_macd = tk.BooleanVar(value=True)  # 添加MACD控制变量
+        self.show_candles = tk.BooleanVar(value=True)
+        self.show_volume = tk.BooleanVar(value=True)
+        self.show_levels = tk.BooleanVar(value=True)
         
         checks_frame = ttk.Frame(chart_control_frame)
         checks_frame.pack(fill=tk.X, padx=2)
@@ -392,6 +4333,16 @@ class CryptoMonitor:
         ttk.Checkbutton(checks_frame, text='MACD', variable=self.show_macd,
             command=self.update_chart_visibility).pack(side=tk.LEFT, padx=2)
         
+        checks_frame2 = ttk.Frame(chart_control_frame)
+        checks_frame2.pack(fill=tk.X, padx=2)
+        
+        ttk.Checkbutton(checks_frame2, text='K线', variable=self.show_candles,
+            command=self.update_chart_visibility).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(checks_frame2, text='成交量', variable=self.show_volume,
+            command=self.update_chart_visibility).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(checks_frame2, text='支撑/压力', variable=self.show_levels,
+            command=self.update_chart_visibility).pack(side=tk.LEFT, padx=2)
+        
         # 添加提醒设置框
         alert_frame = ttk.LabelFrame(control_frame, text='提醒设置', padding=2)
         alert_frame.pack(pady=2, padx=2, fill=tk.X)
@@ -479,6 +4430,9 @@ class CryptoMonitor:
         self.tech_score_label = ttk.Label(details_frame, text='技术指标: --')
         self.tech_score_label.pack(fill=tk.X, padx=2)
         
+        self.book_score_label = ttk.Label(details_frame, text='盘口: --')
+        self.book_score_label.pack(fill=tk.X, padx=2)
+        
         # 启动按钮
         self.start_btn = ttk.Button(control_frame, text='启动监控', 
             command=self.start_monitoring, style='Accent.TButton')
@@ -509,135 +4463,53 @@ class CryptoMonitor:
         self.style.configure('TLabelframe.Label', background=self.colors['bg'], foreground=self.colors['fg'])
         
         # 更新 matplotlib 图形背景
-        if hasattr(self, 'fig') and hasattr(self, 'ax'):
+        if self.fig is not None and self.ax is not None:
             self.fig.patch.set_facecolor(self.colors['bg'])
             self.ax.set_facecolor(self.colors['bg'])
-            if hasattr(self, 'canvas'):
+            if self.canvas is not None:
                 self.canvas.draw()
 
     def change_theme(self, event):
         """更改主题"""
         self.apply_theme()
         self.save_config()  # 保存当前主题设置
-    
-    def calculate_indicators(self, df):
-        # 计算MA
-        df['MA5'] = df['close'].rolling(window=5).mean()
-        df['MA10'] = df['close'].rolling(window=10).mean()
-        
-        # 计算布林带
-        df['MA20'] = df['close'].rolling(window=20).mean()
-        df['std'] = df['close'].rolling(window=20).std()
-        df['upper'] = df['MA20'] + (df['std'] * 2)
-        df['lower'] = df['MA20'] - (df['std'] * 2)
-        
-        # 计算RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        df['RSI'] = 100 - (100 / (1 + rs))
-        
-        # 计算MACD
-        exp1 = df['close'].ewm(span=12, adjust=False).mean()
-        exp2 = df['close'].ewm(span=26, adjust=False).mean()
-        df['MACD'] = exp1 - exp2
-        df['Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
-        df['Histogram'] = df['MACD'] - df['Signal']
-        
-        # 计算支撑位和压力位
-        self.support_level.set(f"{df['low'].min():.2f}")
-        self.resistance_level.set(f"{df['high'].max():.2f}")
-        
-        return df
-        
-    def check_signals(self, df):
-        """检查各种信号"""
+    
+    def check_alert_rules(self, df):
+        """按提醒开关求值信号规则，最后一根K线满足条件即触发"""
         try:
             current_time = time.time()
-            
-            # 检查金叉死叉
-            if self.ma_cross_alert.get():
-                if df['MA5'].iloc[-2] <= df['MA10'].iloc[-2] and df['MA5'].iloc[-1] > df['MA10'].iloc[-1]:
-                    self.trigger_signal('金叉', current_time)
-                elif df['MA5'].iloc[-2] >= df['MA10'].iloc[-2] and df['MA5'].iloc[-1] < df['MA10'].iloc[-1]:
-                    self.trigger_signal('死叉', current_time)
-            
-            # 检查布林带突破
-            if self.bollinger_alert.get():
-                if df['close'].iloc[-1] > df['upper'].iloc[-1]:
-                    self.trigger_signal('突破布林上轨', current_time)
-                elif df['close'].iloc[-1] < df['lower'].iloc[-1]:
-                    self.trigger_signal('突破布林下轨', current_time)
-            
-            # 检查价格变动
-            if self.price_alert.get():
-                monitor_minutes = int(self.monitor_minutes.get())
-                threshold = float(self.price_threshold.get())
-                
-                minutes_ago = df.index[-1] - timedelta(minutes=monitor_minutes)
-                old_price = df.loc[df.index >= minutes_ago].iloc[0]['close']
-                current_price = df['close'].iloc[-1]
-                
-                # ���价格变动百分
-                price_change = ((current_price - old_price) / old_price) * 100
-                
-                if abs(price_change) >= threshold:
-                    direction = "上涨" if price_change > 0 else "下跌"
-                    self.trigger_signal(f'价格变动{direction}', current_time)
-            
-            # 检查成交量异常
-            if self.volume_alert.get():
-                # 计算成交量的移动平均
-                volume_ma = df['volume'].rolling(window=20).mean()
-                current_volume = df['volume'].iloc[-1]
-                
-                # 如果当前成交量超平均的2倍
-                if current_volume > volume_ma.iloc[-1] * 2:
-                    self.trigger_signal('成交量异常放', current_time)
-            
-            # 检查趋势突破
-            if self.trend_alert.get():
-                # 使用20日均线作为趋势线
-                ma20 = df['close'].rolling(window=20).mean()
-                price = df['close'].iloc[-1]
-                prev_price = df['close'].iloc[-2]
-                
-                if prev_price <= ma20.iloc[-2] and price > ma20.iloc[-1]:
-                    self.trigger_signal('向上突破20日均线', current_time)
-                elif prev_price >= ma20.iloc[-2] and price < ma20.iloc[-1]:
-                    self.trigger_signal('向下突破20日均线', current_time)
-            
-            # 检查动量背离
-            if self.momentum_alert.get():
-                # 价格创新高但RSI未创新高，可能出现顶背离
-                if (df['close'].iloc[-1] > df['close'].iloc[-2:-6].max() and 
-                    df['RSI'].iloc[-1] < df['RSI'].iloc[-2:-6].max()):
-                    self.trigger_signal('可能出现顶背离', current_time)
-                
-                # 价格创新低但RSI未创新低，可能出现底背离
-                if (df['close'].iloc[-1] < df['close'].iloc[-2:-6].min() and 
-                    df['RSI'].iloc[-1] > df['RSI'].iloc[-2:-6].min()):
-                    self.trigger_signal('可能出现底背离', current_time)
-            
-            # 检查MACD交叉
-            if self.macd_cross_alert.get():
-                # MACD金叉
-                if (df['MACD'].iloc[-2] <= df['Signal'].iloc[-2] and 
-                    df['MACD'].iloc[-1] > df['Signal'].iloc[-1]):
-                    self.trigger_signal('MACD金叉', current_time)
-                
-                # MACD死叉
-                elif (df['MACD'].iloc[-2] >= df['Signal'].iloc[-2] and 
-                      df['MACD'].iloc[-1] < df['Signal'].iloc[-1]):
-                    self.trigger_signal('MACD死叉', current_time)
-                    
-            # 检查经典形态
-            self.check_patterns(df)
-            
+            fired = self.signal_rules.latest(frame_fields(df), self.rule_params(), self.active_rule_groups())
+            for signal_name in fired[0]:
+                self.trigger_signal(signal_name, current_time)
         except Exception as e:
             print(f"策略检查错误: {str(e)}")
     
+    def active_rule_groups(self):
+        """根据提醒开关返回需要求值的规则分组
+
+        只排除被关闭的内置分组和由 check_indicators 单独求值的 indicators 分组，
+        用户规则无论使用什么分组名都会求值。
+        """
+        switches = {
+            'ma_cross': self.ma_cross_alert,
+            'bollinger': self.bollinger_alert,
+            'price': self.price_alert,
+            'volume': self.volume_alert,
+            'trend': self.trend_alert,
+            'momentum': self.momentum_alert,
+            'macd_cross': self.macd_cross_alert,
+        }
+        disabled = {group for group, var in switches.items() if not var.get()}
+        return self.signal_rules.groups() - disabled - {'indicators'}
+    
+    def rule_params(self):
+        """规则中 $参数 的当前取值"""
+        bar_minutes = timeframe_to_seconds(self.timeframe_var.get()) / 60
+        return {
+            'price_bars': max(1, int(int(self.monitor_minutes.get()) // bar_minutes)),
+            'price_threshold': float(self.price_threshold.get()),
+        }
+    
     def trigger_signal(self, signal_name, current_time):
         """触发信号提醒"""
         # 检查信号是否在5分钟内重复
@@ -660,9 +4532,44 @@ class CryptoMonitor:
             # 保存配置
             self.save_config()
             
+            # 保存信号时刻的图表快照
+            if self.alert_snapshots.get():
+                self.save_signal_snapshot(signal_name)
+            
             # 弹出提醒
             self.root.after(0, lambda: messagebox.showinfo('信号提醒', f'{self.symbol_var.get()} {signal_name}！'))
     
+    def save_signal_snapshot(self, signal_name):
+        """在后台进程中渲染当前图表的快照，不阻塞界面"""
+        df = self.last_df
+        if df is None or not len(df):
+            return None
+        try:
+            if self.snapshot_executor is None:
+                self.snapshot_executor = create_snapshot_executor(2)
+            symbol = self.symbol_var.get()
+            timeframe = self.timeframe_var.get()
+            name = re.sub(r'[^\w.-]+', '_', f"{symbol}_{timeframe}_{time.strftime('%Y%m%d_%H%M%S')}_{signal_name}")
+            job = {
+                'df': df,
+                'path': os.path.join(self.snapshot_dir, f'{name}.png'),
+                'title': f'{symbol} {timeframe} {signal_name}',
+                'options': self.chart_options(),
+                'colors': self.colors,
+            }
+            future = self.snapshot_executor.submit(_render_snapshot_job, job)
+            future.add_done_callback(self.on_snapshot_done)
+            return future
+        except Exception as e:
+            print(f"保存信号快照错误: {str(e)}")
+            return None
+    
+    def on_snapshot_done(self, future):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"保存信号快照错误: {str(e)}")
+    
     def update_signal_display(self):
         """更新最近信号显示"""
         # 获取当前交易对和时间周期
@@ -686,123 +4593,319 @@ class CryptoMonitor:
         self.signal_text.see(tk.END)  # 滚动到最后一行
     
     def update_chart(self, df):
-        self.fig.clear()
-        
-        # 创建子图，比例为3:1:1
-        gs = self.fig.add_gridspec(3, 1, height_ratios=[3, 1, 1], hspace=0.1)
-        ax1 = self.fig.add_subplot(gs[0])  # 主图
-        ax2 = self.fig.add_subplot(gs[1], sharex=ax1)  # RSI，共享x轴
-        ax3 = self.fig.add_subplot(gs[2], sharex=ax1)  # MACD，共享x轴
-        
-        # 设置图表式
-        for ax in [ax1, ax2, ax3]:
-            ax.set_facecolor(self.colors['bg'])
-            ax.grid(True, color='#404040', linestyle='--', linewidth=0.5)
-            ax.tick_params(colors=self.colors['fg'])
-        
-        # 绘制主图
-        if self.show_price.get():
-            ax1.plot(df.index, df['close'], label='价格', color='#569cd6')
-        if self.show_ma5.get():
-            ax1.plot(df.index, df['MA5'], label='MA5', color='#4ec9b0')
-        if self.show_ma10.get():
-            ax1.plot(df.index, df['MA10'], label='MA10', color='#ce9178')
-        if self.show_bollinger.get():
-            ax1.plot(df.index, df['upper'], label='布林上轨', color='#c586c0', linestyle='--')
-            ax1.plot(df.index, df['lower'], label='布林下轨', color='#c586c0', linestyle='--')
-        
-        # 绘制RSI
-        if self.show_rsi.get():
-            ax2.plot(df.index, df['RSI'], label='RSI', color='#dcdcaa')
-            ax2.axhline(y=70, color='#f14c4c', linestyle='--', alpha=0.5)
-            ax2.axhline(y=30, color='#23d18b', linestyle='--', alpha=0.5)
-            ax2.set_ylim(0, 100)
-            ax2.set_ylabel('RSI')
-        
-        # 绘制MACD
-        if self.show_macd.get():
-            # 绘制柱状图
-            colors = np.where(df['Histogram'] >= 0, '#23d18b', '#f14c4c')
-            ax3.bar(df.index, df['Histogram'], color=colors, label='MACD柱状', alpha=0.7, width=0.6)
-            # 绘制MACD线和信号线
-            ax3.plot(df.index, df['MACD'], label='MACD', color='#569cd6')
-            ax3.plot(df.index, df['Signal'], label='Signal', color='#ce9178')
-            ax3.set_ylabel('MACD')
-        
-        # 设置标题和标签
-        ax1.set_title(f'{self.symbol_var.get()} {self.timeframe_var.get()}', 
-            color=self.colors['fg'])
-        
-        # 只最底部显示时间轴
-        ax1.tick_params(labelbottom=False)  # 隐藏上面两个图的x轴标签
-        ax2.tick_params(labelbottom=False)  # 隐藏间的x轴标签
-        
-        # 调整时间轴��式
-        ax3.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%H:%M'))
-        
-        # 设置图例
-        for ax in [ax1, ax2, ax3]:
-            if ax.get_legend():
-                ax.get_legend().remove()
-            legend = ax.legend(loc='upper left')
-            if legend:
-                legend.get_frame().set_facecolor(self.colors['bg'])
-                for text in legend.get_texts():
-                    text.set_color(self.colors['fg'])
-        
-        self.canvas.draw()
+        self.ensure_chart()
+        # 用户正在浏览历史时不重置视图，双击图表回到实时视图
+        if self.chart_navigator.detached:
+            return
+        self.chart_navigator.invalidate()
+        levels = self.market_snapshot.levels if self.market_snapshot is not None else None
+        self.chart_renderer.render(df, f'{self.symbol_var.get()} {self.timeframe_var.get()}',
+                                   self.chart_options(), self.colors, levels)
 
-        # 更新支撑位和压力位显示
-        self.support_level.set(f"{df['low'].min():.2f}")
-        self.resistance_level.set(f"{df['high'].max():.2f}")
+    def load_chart_range(self, low, high):
+        """图表移动到已载入范围之外时，从本地K线库加载该范围，并接上实时数据"""
+        history = self.candle_windows.get_range(self.symbol_var.get(), self.timeframe_var.get(),
+                                                date_num_to_ms(low), date_num_to_ms(high))
+        if history is None:
+            return None
+        live = self.last_df
+        if live is not None and len(live) and mdates.date2num(live.index[0]) <= high:
+            history = pd.concat([history[history.index < live.index[0]], live])
+        return history
+
+    def chart_options(self):
+        """图表各元素的显示开关"""
+        return {
+            'candles': self.show_candles.get(),
+            'volume': self.show_volume.get(),
+            'price': self.show_price.get(),
+            'ma5': self.show_ma5.get(),
+            'ma10': self.show_ma10.get(),
+            'bollinger': self.show_bollinger.get(),
+            'rsi': self.show_rsi.get(),
+            'macd': self.show_macd.get(),
+            'levels': self.show_levels.get(),
+        }
+
+    def update_chart_tail(self, df):
+        """只有未收盘K线变化时，滚动指标也只有最后一个值变化，只更新数据末尾"""
+        if self.canvas is None or not self.chart_renderer.update_tail(df):
+            self.update_chart(df)
 
     def update_chart_visibility(self):
         """更新图表显示状态"""
-        if hasattr(self, 'last_df') and self.last_df is not None:
+        if self.chart_navigator is not None:
+            self.chart_navigator.detached = False
+        if self.last_df is not None:
             self.update_chart(self.last_df)
 
     def fetch_data(self):
+        failures = 0
         while self.running:
             try:
-                # 确保交易所实例使用最新的代理设置
-                self.update_exchange()
-                
-                # 取K线数据
-                ohlcv = self.exchange.fetch_ohlcv(
-                    self.symbol_var.get(),
-                    self.timeframe_var.get(),
-                    limit=100
-                )
-                
-                df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-                df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-                df.set_index('timestamp', inplace=True)
+                # 本轮使用界面线程最近发布的选择
+                selection = self.selection
+                symbol, timeframe = selection.symbol, selection.timeframe
                 
-                # 更新当前价格显示
-                current_price = df['close'].iloc[-1]
-                self.root.after(0, lambda: self.price_label.config(text=f'{current_price:.2f} USDT'))
-                
-                # 计算指标
-                df = self.calculate_indicators(df)
-                self.calculate_strategy_scores(df)
+                # 确保交易所实例使用最新的代理设置
+                self.update_exchange(selection.proxy)
                 
-                # 检查信号
-                self.root.after(0, lambda: self.check_signals(df))
+                # 订单簿与K线并发获取
+                book_future = self.exchange_submit('fetch_order_book', symbol, limit=ORDER_BOOK_DEPTH,
+                                                   priority=PRIORITY_LIVE)
                 
-                # 保存最新的数据用于图表更新
-                self.last_df = df
+                # 取K线数据（失败时自动重试、熔断并向备用域名对冲）；秒级周期由成交在本地聚合
+                if timeframe in TRADE_TIMEFRAMES:
+                    ohlcv = self.fetch_trade_candles(symbol, timeframe)
+                else:
+                    ohlcv = self.fetcher.fetch(
+                        'fetch_ohlcv',
+                        symbol,
+                        timeframe,
+                        limit=100,
+                        priority=PRIORITY_LIVE
+                    )
+                failures = 0
+                self.data_stale = False
+                self.last_good_time = time.time()
+                book = self.update_order_book(symbol, book_future)
                 
-                # 更新图表
-                self.root.after(0, lambda: self.update_chart(df))
+                # 与上次数据完全相同时跳过所有下游计算和重绘，只更新盘口
+                change = self.detect_change(ohlcv, (symbol, timeframe)) if ohlcv else 'unchanged'
+                if change == 'unchanged':
+                    for stats in self.stage_stats.values():
+                        stats['skipped'] += 1
+                    self.publish_order_book(book)
+                else:
+                    self.process_candles(ohlcv, change, book, selection)
                 
-                time.sleep(10)  # 每10秒更新一次
+                # 睡到下一次K线内刷新或K线收盘之后
+                self.candle_clock.sync(self.exchange)
+                delay, self.closed_candle_tick = self.candle_clock.next_wakeup(
+                    timeframe, self.refresh_intervals.get(timeframe, 10))
+                self.stop_event.wait(delay)
                 
             except Exception as e:
-                print(f"错误: {str(e)}")
-                self.root.after(0, lambda: messagebox.showerror("错误", f"获取数据失败: {str(e)}\n请检查网络和代理设置"))
-                self.running = False
-                self.root.after(0, lambda: self.start_btn.config(text='启动监控'))
-                time.sleep(5)  # 出错后等待5秒重试
+                # 不中断监控：继续展示最后一次成功的数据，退避后重试
+                failures += 1
+                print(f"获取数据失败(第{failures}次): {str(e)}")
+                self.serve_stale_data()
+                if isinstance(e, CircuitOpenError):
+                    delay = e.retry_after
+                else:
+                    delay = backoff_delay(failures, base=1.0, cap=30.0)
+                self.stop_event.wait(max(1.0, delay))
+    
+    def fetch_trade_candles(self, symbol, timeframe):
+        """拉取最近的逐笔成交，聚合进当前交易对的秒级K线，返回最近100根"""
+        key = (symbol, timeframe)
+        if self.trade_builder is None or self.trade_builder_key != key:
+            self.trade_builder = TradeCandleBuilder(timeframe)
+            self.trade_builder_key = key
+        builder = self.trade_builder
+        trades = self.fetcher.fetch('fetch_trades', symbol, limit=1000, priority=PRIORITY_LIVE)
+        
+        # 成交快于轮询时，最近1000笔之前的部分会漏掉：按编号从上次处理到的位置向后补取
+        missed = builder.missed_trades
+        first_id = min((int(trade['id']) for trade in trades if str(trade.get('id', '')).isdigit()), default=None)
+        for _ in range(TRADE_BACKFILL_PAGES):
+            if builder.next_id is None or first_id is None or builder.next_id >= first_id:
+                break
+            page = self.fetcher.fetch('fetch_trades', symbol, limit=1000, params={'fromId': builder.next_id},
+                                      priority=PRIORITY_LIVE)
+            if not builder.add_trades(page):
+                break
+        builder.add_trades(trades)
+        if builder.missed_trades > missed:
+            print(f"{symbol} 逐笔成交缺失 {builder.missed_trades - missed} 笔，"
+                  f"累计 {builder.missed_trades} 笔，相应秒级K线的量价不完整")
+        return builder.ohlcv(100)
+    
+    def detect_change(self, ohlcv, key):
+        """根据K线尾部指纹判断数据变化：unchanged / tick(仅未收盘K线变化) / new(新K线)，key 为 (交易对, 周期)"""
+        fingerprint = (key, len(ohlcv), tuple(ohlcv[0]),
+                       tuple(ohlcv[-2]) if len(ohlcv) > 1 else None, tuple(ohlcv[-1]))
+        previous = self._last_fingerprint
+        self._last_fingerprint = fingerprint
+        
+        if previous == fingerprint:
+            return 'unchanged'
+        if previous is not None and previous[:4] == fingerprint[:4] \
+                and previous[4][0] == fingerprint[4][0]:
+            return 'tick'
+        return 'new'
+    
+    def update_order_book(self, symbol, future):
+        """把订单簿快照写入本地订单簿并返回盘口指标；获取失败时返回 None"""
+        try:
+            snapshot = future.result()
+        except Exception as e:
+            print(f"获取订单簿错误: {str(e)}")
+            return None
+        if self.order_book_symbol != symbol:
+            self.order_book.clear()
+            self.order_book_symbol = symbol
+        self.order_book.apply_snapshot(snapshot)
+        return self.order_book.metrics()
+    
+    def publish_order_book(self, book):
+        """K线未变化时只用新的盘口指标重算评分并重新发布最后一帧"""
+        last = self.market_mailbox.peek()
+        if book is None or last is None or last.symbol != self.order_book_symbol or last.book == book:
+            return
+        self.market_mailbox.publish(last._replace(
+            version=next(self.market_versions),
+            change='book',
+            scores=self.calculate_strategy_scores(last.arrays, book, last.levels),
+            book=book,
+            stale_age=0,
+            created=time.time(),
+        ))
+    
+    def update_levels(self, symbol, timeframe, ohlcv):
+        """增量更新支撑/压力位；切换交易对或周期时先用本地K线库的历史建立成交量分布"""
+        try:
+            key = (symbol, timeframe)
+            if self.sr_engine is None or self.sr_engine_key != key:
+                self.sr_engine = SupportResistanceEngine(self.sr_params)
+                self.sr_engine_key = key
+                history = self.candle_store.load(symbol, timeframe)
+                if history is not None and len(history):
+                    history = history[history[:, 0] < ohlcv[-1][0]]
+                    self.sr_engine.add_closed(history[-self.sr_engine.params['volume_lookback']:])
+            self.sr_engine.update(ohlcv)
+            return self.sr_engine.levels(ohlcv[-1][4])
+        except Exception as e:
+            print(f"支撑压力位计算错误: {str(e)}")
+            return []
+    
+    def process_candles(self, ohlcv, change, book, selection):
+        """在工作线程中计算指标和评分，结果作为不可变快照发布给界面线程"""
+        symbol, timeframe = selection.symbol, selection.timeframe
+        
+        # 只有未收盘K线变化且上一帧与本次的已收盘K线相同时，只重算指标的最后一行
+        last = self.market_mailbox.peek()
+        if change == 'tick' and last is not None and (last.symbol, last.timeframe) == (symbol, timeframe) \
+                and len(last.frame) == len(ohlcv) >= 20 \
+                and last.frame.index[-1] == pd.Timestamp(ohlcv[-1][0], unit='ms') \
+                and last.frame['close'].iat[-2] == ohlcv[-2][4]:
+            df = update_indicators_tail(last.frame, ohlcv[-1])
+            self.stage_stats['indicators']['partial'] += 1
+        else:
+            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+            df.set_index('timestamp', inplace=True)
+            df = compute_indicators(df)
+            self.stage_stats['indicators']['run'] += 1
+        
+        # 支撑/压力位
+        levels = self.update_levels(symbol, timeframe, ohlcv)
+        fields = freeze_fields(frame_fields(df))
+        scores = self.calculate_strategy_scores(fields, book, levels)
+        self.stage_stats['scores']['run'] += 1
+        price = float(df['close'].iloc[-1])
+        support, resistance = nearest_levels(levels, price)
+        
+        # 用新收盘的K线增量更新在线模型
+        if selection.model_type == 'online' and (
+                self.closed_candle_tick or (symbol, timeframe) not in self.online_model.last_timestamps):
+            self.update_online_model(df, (symbol, timeframe))
+        
+        # 发布快照，此后工作线程不再修改 df
+        self.market_mailbox.publish(MarketSnapshot(
+            version=next(self.market_versions),
+            symbol=symbol,
+            timeframe=timeframe,
+            change=change,
+            frame=df,
+            arrays=fields,
+            price=price,
+            price_digits=self.market_catalog.price_digits(symbol),
+            scores=scores,
+            book=book,
+            levels=levels,
+            # 没有识别出价位时退回到区间最低/最高价
+            support=support['price'] if support else float(df['low'].min()),
+            resistance=resistance['price'] if resistance else float(df['high'].max()),
+            stale_age=0,
+            created=time.time(),
+        ))
+    
+    def poll_market_snapshot(self):
+        """界面线程定时取最新快照；中间来不及显示的快照直接丢弃"""
+        try:
+            current = self.market_snapshot
+            snapshot = self.market_mailbox.take(current.version if current is not None else 0)
+            if snapshot is not None:
+                self.apply_market_snapshot(snapshot)
+        except Exception as e:
+            print(f"更新行情显示错误: {str(e)}")
+        finally:
+            self.root.after(SNAPSHOT_POLL_MS, self.poll_market_snapshot)
+    
+    def apply_market_snapshot(self, snapshot):
+        """把一帧快照应用到界面，只在界面线程中调用"""
+        previous = self.market_snapshot
+        self.market_snapshot = snapshot
+        # 切换交易对或周期后，旧的在途快照不再显示
+        if (snapshot.symbol, snapshot.timeframe) != (self.symbol_var.get(), self.timeframe_var.get()):
+            return
+        self.last_df = snapshot.frame
+        
+        # 更新当前价格显示
+        text = f'{snapshot.price:.{snapshot.price_digits}f} USDT'
+        if snapshot.stale_age:
+            text += f' (延迟 {snapshot.stale_age}s)'
+        self.price_label.config(text=text)
+        self.update_score_display(snapshot.scores)
+        
+        # 更新支撑位和压力位显示
+        self.support_level.set(f"{snapshot.support:.2f}")
+        self.resistance_level.set(f"{snapshot.resistance:.2f}")
+        if snapshot.change in ('stale', 'book'):
+            return
+        
+        # 检查信号
+        self.check_signals(snapshot.frame)
+        self.stage_stats['signals']['run'] += 1
+        
+        # 更新图表：新K线全量重绘；仅未收盘K线变化且没有漏掉中间快照时只更新最后一个点
+        contiguous = previous is not None and previous.version + 1 == snapshot.version \
+            and previous.change != 'stale'
+        if snapshot.change == 'tick' and contiguous:
+            self.update_chart_tail(snapshot.frame)
+            self.stage_stats['chart']['partial'] += 1
+        else:
+            self.update_chart(snapshot.frame)
+            self.stage_stats['chart']['run'] += 1
+    
+    def format_stage_stats(self):
+        """格式化各处理阶段的执行/局部更新/跳过次数"""
+        names = {'indicators': '指标', 'scores': '评分', 'signals': '信号', 'chart': '图表'}
+        lines = [f"{names[stage]}: 执行 {stats['run']} 次, 局部更新 {stats['partial']} 次, 跳过 {stats['skipped']} 次"
+                 for stage, stats in self.stage_stats.items()]
+        mailbox = self.market_mailbox
+        lines.append(f"快照: 发布 {mailbox.published} 个, 显示 {mailbox.consumed} 个, 丢弃 {mailbox.dropped} 个")
+        return '\n'.join(lines)
+    
+    def show_stage_stats(self):
+        """显示数据变化检测的处理统计"""
+        messagebox.showinfo('处理统计', self.format_stage_stats())
+    
+    def serve_stale_data(self):
+        """用最后一次成功获取的数据继续计算评分，并在界面上标记数据延迟"""
+        self.data_stale = True
+        last = self.market_mailbox.peek()
+        if last is None or self.last_good_time is None:
+            return
+        
+        # 重新发布最后一帧数据，只更新版本和延迟时间
+        self.market_mailbox.publish(last._replace(
+            version=next(self.market_versions),
+            change='stale',
+            stale_age=int(time.time() - self.last_good_time),
+            created=time.time(),
+        ))
     
     def start_monitoring(self):
         """启动监控前先测试连接"""
@@ -813,6 +4916,7 @@ class CryptoMonitor:
                 return
             
             self.running = True
+            self.stop_event.clear()
             self.start_btn.config(text='停止监控')
             threading.Thread(target=self.fetch_data, daemon=True).start()
         else:
@@ -821,6 +4925,7 @@ class CryptoMonitor:
     def stop_monitoring(self):
         """停止监控"""
         self.running = False
+        self.stop_event.set()
         self.start_btn.config(text='启动监控')
         print("监控已停止")
     
@@ -832,9 +4937,13 @@ class CryptoMonitor:
             print(f"程序异常: {str(e)}")
         finally:
             self.running = False
-            self.save_config()  # 保存配置
-            if hasattr(self, 'exchange'):
-                self.exchange = None
+            self.save_config(flush=True)  # 保存配置
+            self.save_online_model()
+            self.scheduler.stop()
+            self.exchange = None
+            for exchange in self._alternate_exchanges or []:
+                self.transport.detach(exchange)
+            self._alternate_exchanges = None
             print("程序已安全退出")
     
     def test_exchange_connection(self):
@@ -844,7 +4953,7 @@ class CryptoMonitor:
             self.update_exchange()
             
             # 尝试获取服务器时间来测试连接
-            self.exchange.load_time_difference()
+            self.exchange_call('load_time_difference', priority=PRIORITY_LIVE)
             return True
         except Exception as e:
             print(f"连接测试失败: {str(e)}")
@@ -854,9 +4963,6 @@ class CryptoMonitor:
         """保存并试代理设置"""
         try:
             # 存配置
-            self.config['proxy_host'] = self.proxy_host.get()
-            self.config['proxy_port'] = self.proxy_port.get()
-            self.config['use_proxy'] = self.use_proxy.get()
             self.save_config()
             
             # 测试连接
@@ -872,103 +4978,36 @@ class CryptoMonitor:
         if self.running:
             if messagebox.askokcancel("确认退出", "监控正在行中，确定要退出吗？"):
                 self.running = False
+                self.stop_event.set()
+                self.screener_stop.set()
                 time.sleep(1)  # 给线程一点时间来结束
-                self.save_config()  # 保存配置
+                self.save_config(flush=True)  # 保存配置
+                self.shutdown_snapshots()
                 self.root.destroy()
         else:
-            self.save_config()  # 保存配置
+            self.screener_stop.set()
+            self.save_config(flush=True)  # 保存配置
+            self.shutdown_snapshots()
             self.root.destroy()
+    
+    def shutdown_snapshots(self):
+        """等待未完成的快照写完后关闭渲染进程池"""
+        if self.snapshot_executor is not None:
+            self.snapshot_executor.shutdown(wait=True)
+            self.snapshot_executor = None
+
+    def calculate_strategy_scores(self, fields, book=None, levels=None):
+        """计算各项策略得分；fields 为 frame_fields 的结果，book 为盘口指标，levels 为支撑/压力位
 
-    def calculate_strategy_scores(self, df):
-        """计算各项策略得分"""
+        不访问界面，可在工作线程调用。
+        """
         try:
-            scores = {}
-            
-            # 1. 趋势得分 (0-100)
-            ma20 = df['close'].rolling(window=20).mean()
-            ma50 = df['close'].rolling(window=50).mean()
-            current_price = df['close'].iloc[-1]
-            
-            trend_score = 50  # 基础分
-            # 价格在均线上方，加分
-            if current_price > ma20.iloc[-1]:
-                trend_score += 15
-            if current_price > ma50.iloc[-1]:
-                trend_score += 15
-            # 短期均线在长期均线上方，加分
-            if ma20.iloc[-1] > ma50.iloc[-1]:
-                trend_score += 20
-            
-            scores['trend'] = min(100, max(0, trend_score))
-            
-            # 2. 动量得分 (0-100)
-            momentum_score = 50
-            
-            # RSI指标评分
-            rsi = df['RSI'].iloc[-1]
-            if 40 <= rsi <= 60:  # 中性
-                momentum_score += 10
-            elif 30 <= rsi < 40 or 60 < rsi <= 70:  # 轻微超买/超卖
-                momentum_score += 20
-            elif rsi < 30 or rsi > 70:  # 强烈超买/超卖
-                momentum_score += 30
-            
-            # MACD评分
-            if df['MACD'].iloc[-1] > df['Signal'].iloc[-1]:
-                momentum_score += 20
-            
-            scores['momentum'] = min(100, max(0, momentum_score))
-            
-            # 3. 成交量评分 (0-100)
-            volume_score = 50
-            volume_ma = df['volume'].rolling(window=20).mean()
-            current_volume = df['volume'].iloc[-1]
-            
-            # 成交量比较
-            volume_ratio = current_volume / volume_ma.iloc[-1]
-            if volume_ratio > 2:
-                volume_score += 30
-            elif volume_ratio > 1.5:
-                volume_score += 20
-            elif volume_ratio > 1:
-                volume_score += 10
-            
-            # 成交量趋势
-            if df['volume'].iloc[-3:].mean() > volume_ma.iloc[-3:].mean():
-                volume_score += 20
-            
-            scores['volume'] = min(100, max(0, volume_score))
-            
-            # 4. 技术指标得分 (0-100)
-            tech_score = 50
-            
-            # 布林带位置
-            upper = df['upper'].iloc[-1]
-            lower = df['lower'].iloc[-1]
-            if lower <= current_price <= upper:
-                tech_score += 20
-            
-            # 均线金叉/死叉
-            if df['MA5'].iloc[-1] > df['MA10'].iloc[-1] and \
-               df['MA5'].iloc[-2] <= df['MA10'].iloc[-2]:
-                tech_score += 30
-            
-            scores['tech'] = min(100, max(0, tech_score))
-            
-            # 计算总分 (加权平均)
-            weights = {
-                'trend': 0.35,
-                'momentum': 0.25,
-                'volume': 0.2,
-                'tech': 0.2
-            }
-            
-            total_score = sum(score * weights[key] for key, score in scores.items())
-            scores['total'] = round(total_score, 1)
-            
-            # 更新界面显示
-            self.root.after(0, lambda: self.update_score_display(scores))
-            
+            matrix = score_matrix(fields, self.score_weights, tail=1)
+            scores = {key: float(value[0, -1]) for key, value in matrix.items()}
+            if levels:
+                scores = add_level_score(scores, float(fields['close'][0, -1]), levels, self.score_weights)
+            if book is not None:
+                scores = add_book_score(scores, book, self.score_weights)
             return scores
             
         except Exception as e:
@@ -998,6 +5037,12 @@ class CryptoMonitor:
         self.tech_score_label.config(
             text=f'技术指标: {scores["tech"]:.0f}',
             foreground=self.get_score_color(scores["tech"]))
+        if 'book' in scores:
+            self.book_score_label.config(
+                text=f'盘口: {scores["book"]:.0f}',
+                foreground=self.get_score_color(scores["book"]))
+        else:
+            self.book_score_label.config(text='盘口: --', foreground=self.colors['fg'])
 
     def get_score_color(self, score):
         """根据分数返回显示颜色"""
@@ -1043,6 +5088,12 @@ class CryptoMonitor:
 5. 技术指标评分 (权重20%)
 - 价格在布林带内：+20分
 - 均线金叉：+30分
+- 贴近强支撑位：最多+15分，贴近强压力位：最多-15分
+- 基础分：50分
+
+6. 盘口评分 (权重15%，有订单簿数据时参与总分)
+- 中间价上下1%内买卖深度的不平衡度：-30 ~ +30分
+- 1%以内的买单墙：+10分，卖单墙：-10分
 - 基础分：50分
 
 使用建议：
@@ -1288,12 +5339,230 @@ class CryptoMonitor:
         
         return True
 
+    def screener_symbols(self):
+        """筛选器的交易对：观察列表为空时使用全部 USDT 交易对"""
+        if self.watchlist:
+            return list(self.watchlist)
+        return [symbol for symbol in self.market_catalog.symbols() if symbol.endswith('/USDT')]
+    
+    def start_screener(self):
+        """启动筛选器后台刷新线程"""
+        if self.screener_thread is not None and self.screener_thread.is_alive():
+            return
+        self.screener_stop.clear()
+        self.screener_thread = threading.Thread(target=self.screener_loop, daemon=True)
+        self.screener_thread.start()
+    
+    def screener_loop(self):
+        """分批低优先级拉取观察列表的K线，只重算有变化的交易对"""
+        while not self.screener_stop.is_set():
+            timeframe = kline_timeframe(self.selection.timeframe)
+            if timeframe != self.screener.timeframe:
+                self.screener.reset(timeframe)
+            symbols = self.screener_symbols()
+            self.screener.retain(symbols)
+            if self.screener_processes > 0 and symbols:
+                self.run_screener_pipeline(symbols, timeframe)
+                continue
+            
+            for start in range(0, len(symbols), SCREENER_BATCH):
+                if self.screener_stop.is_set():
+                    return
+                futures = {symbol: self.exchange_submit('fetch_ohlcv', symbol, timeframe,
+                                                        limit=SCREENER_CANDLE_LIMIT,
+                                                        priority=PRIORITY_BACKFILL)
+                           for symbol in symbols[start:start + SCREENER_BATCH]}
+                candles = {}
+                for symbol, future in futures.items():
+                    try:
+                        candles[symbol] = future.result()
+                    except Exception as e:
+                        print(f"筛选器获取 {symbol} 数据错误: {str(e)}")
+                try:
+                    self.screener.ingest(candles)
+                except Exception as e:
+                    print(f"筛选器计算错误: {str(e)}")
+            
+            self.screener_stop.wait(self.refresh_intervals.get(timeframe, 10))
+    
+    def run_screener_pipeline(self, symbols, timeframe):
+        """用采集进程和分析进程池刷新筛选器，观察列表或周期变化时返回"""
+        # 采集进程与界面共用同一个 IP 的额度：运行期间界面调度器让出一半
+        weight_limit = self.scheduler.weight_limit
+        share = weight_limit // 2
+        pipeline = MarketPipeline(symbols, timeframe, self.selection.proxy, self.score_weights,
+                                  workers=self.screener_processes,
+                                  interval=self.refresh_intervals.get(timeframe, 10),
+                                  weight_budget=(weight_limit, share))
+        self.scheduler.reserve(share)
+        try:
+            pipeline.start()
+            while not self.screener_stop.is_set():
+                pipeline.step()
+                self.screener.update_rows(pipeline.rows())
+                if kline_timeframe(self.selection.timeframe) != timeframe or self.screener_symbols() != symbols:
+                    return
+                self.screener_stop.wait(0.5)
+        except Exception as e:
+            print(f"筛选器进程错误: {str(e)}")
+            self.screener_stop.wait(self.refresh_intervals.get(timeframe, 10))
+        finally:
+            pipeline.close()
+            self.scheduler.release(share)
+    
+    def show_screener_window(self):
+        """显示行情筛选窗口"""
+        if self.screener_window is not None and self.screener_window.winfo_exists():
+            self.screener_window.lift()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title('行情筛选')
+        window.geometry('860x600')
+        window.configure(bg=self.colors['bg'])
+        self.screener_window = window
+        
+        # 名称过滤和状态
+        top_frame = ttk.Frame(window, padding=5)
+        top_frame.pack(fill=tk.X)
+        ttk.Label(top_frame, text='筛选:').pack(side=tk.LEFT)
+        self.screener_filter = tk.StringVar()
+        ttk.Entry(top_frame, textvariable=self.screener_filter, width=20).pack(side=tk.LEFT, padx=5)
+        self.screener_status = ttk.Label(top_frame, text='')
+        self.screener_status.pack(side=tk.RIGHT)
+        
+        # 虚拟化表格：只创建可见行，滚动时替换行内容
+        table_frame = ttk.Frame(window)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        columns = [key for key, _ in SCREENER_COLUMNS]
+        self.screener_tree = ttk.Treeview(table_frame, columns=columns, show='headings', selectmode='browse')
+        for key, title in SCREENER_COLUMNS:
+            self.screener_tree.heading(key, text=title, command=lambda k=key: self.sort_screener(k))
+            self.screener_tree.column(key, width=110 if key == 'symbol' else 75,
+                                      anchor=tk.W if key == 'symbol' else tk.E)
+        self.screener_scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=self.scroll_screener)
+        self.screener_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.screener_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.screener_sort = 'total'
+        self.screener_descending = True
+        self.screener_offset = 0
+        self.screener_rendered = None
+        self.screener_filter.trace_add('write', lambda *args: self.render_screener(reset=True))
+        self.screener_tree.bind('<Configure>', lambda e: self.render_screener())
+        self.screener_tree.bind('<MouseWheel>', lambda e: self.scroll_screener('scroll', -1 if e.delta > 0 else 1, 'units'))
+        self.screener_tree.bind('<Button-4>', lambda e: self.scroll_screener('scroll', -1, 'units'))
+        self.screener_tree.bind('<Button-5>', lambda e: self.scroll_screener('scroll', 1, 'units'))
+        self.screener_tree.bind('<Double-1>', self.on_screener_select)
+        window.protocol('WM_DELETE_WINDOW', self.close_screener_window)
+        
+        self.start_screener()
+        self.poll_screener()
+    
+    def close_screener_window(self):
+        """关闭筛选窗口并停止后台刷新"""
+        self.screener_stop.set()
+        if self.screener_window is not None:
+            self.screener_window.destroy()
+        self.screener_window = None
+    
+    def poll_screener(self):
+        """定时检查筛选结果版本，有变化时重绘可见行"""
+        if self.screener_window is None or not self.screener_window.winfo_exists():
+            return
+        self.render_screener()
+        self.root.after(500, self.poll_screener)
+    
+    def screener_visible_rows(self):
+        """表格当前高度能显示的行数"""
+        row_height = int(self.style.lookup('Treeview', 'rowheight') or 20)
+        return max(1, (self.screener_tree.winfo_height() - 25) // row_height)
+    
+    def render_screener(self, reset=False):
+        """只渲染可见区域的行"""
+        if self.screener_window is None:
+            return
+        if reset:
+            self.screener_offset = 0
+        
+        rows = self.screener_visible_rows()
+        state = (self.screener.version, self.screener_sort, self.screener_descending,
+                 self.screener_filter.get(), self.screener_offset, rows)
+        if state == self.screener_rendered:
+            return
+        self.screener_rendered = state
+        
+        symbols = self.screener.ranked(self.screener_sort, self.screener_descending, self.screener_filter.get())
+        total = len(symbols)
+        self.screener_offset = max(0, min(self.screener_offset, total - rows))
+        visible = symbols[self.screener_offset:self.screener_offset + rows]
+        
+        # 复用已有的行，数量不够时补充，多余的删除
+        items = list(self.screener_tree.get_children())
+        for _ in range(len(visible) - len(items)):
+            items.append(self.screener_tree.insert('', tk.END))
+        for item in items[len(visible):]:
+            self.screener_tree.delete(item)
+        
+        for item, symbol in zip(items, visible):
+            row = self.screener.row(symbol) or {}
+            digits = self.market_catalog.price_digits(symbol)
+            values = [symbol] + [self.format_screener_value(metric, row.get(metric), digits)
+                                 for metric in SCREENER_METRICS]
+            self.screener_tree.item(item, values=values)
+        
+        if total:
+            self.screener_scrollbar.set(self.screener_offset / total,
+                                        min(1.0, (self.screener_offset + rows) / total))
+        else:
+            self.screener_scrollbar.set(0, 1)
+        self.screener_status.config(text=f'{total} / {len(self.screener_symbols())} 个交易对')
+    
+    def format_screener_value(self, metric, value, digits=2):
+        """格式化筛选表格中的数值"""
+        if value is None or math.isnan(value):
+            return '-'
+        if metric == 'price':
+            return f'{value:.{digits}f}'
+        if metric in ('volume_ratio', 'change'):
+            return f'{value:.2f}'
+        return f'{value:.1f}' if metric == 'total' else f'{value:.0f}'
+    
+    def sort_screener(self, metric):
+        """点击表头：同一列切换升降序，换列时默认降序"""
+        if self.screener_sort == metric:
+            self.screener_descending = not self.screener_descending
+        else:
+            self.screener_sort = metric
+            self.screener_descending = metric != 'symbol'
+        self.render_screener(reset=True)
+    
+    def scroll_screener(self, action, amount, unit=None):
+        """处理滚动条和鼠标滚轮"""
+        total = len(self.screener.ranked(self.screener_sort, self.screener_descending, self.screener_filter.get()))
+        rows = self.screener_visible_rows()
+        if action == 'moveto':
+            self.screener_offset = int(float(amount) * total)
+        elif action == 'scroll':
+            step = rows if unit == 'pages' else 1
+            self.screener_offset += int(amount) * step
+        self.screener_offset = max(0, min(self.screener_offset, total - rows))
+        self.render_screener()
+    
+    def on_screener_select(self, event):
+        """双击切换主界面的交易对"""
+        item = self.screener_tree.focus()
+        if not item:
+            return
+        symbol = self.screener_tree.item(item, 'values')[0]
+        self.symbol_var.set(symbol)
+    
     def show_settings_window(self):
         """显示设置窗口"""
         # 创建设置窗口
         settings_window = tk.Toplevel(self.root)
         settings_window.title('设置')
-        settings_window.geometry('400x500')
+        settings_window.geometry('400x620')
         settings_window.transient(self.root)  # 设置为主窗口的子窗口
         settings_window.grab_set()  # 模态窗口
         
@@ -1324,6 +5593,18 @@ class CryptoMonitor:
         ttk.Label(proxy_port_frame, text='端口:').pack(side=tk.LEFT)
         ttk.Entry(proxy_port_frame, textvariable=self.proxy_port).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
+        # 代理类型
+        proxy_type_frame = ttk.Frame(proxy_frame)
+        proxy_type_frame.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Label(proxy_type_frame, text='类型:').pack(side=tk.LEFT)
+        ttk.Combobox(proxy_type_frame, textvariable=self.proxy_type,
+            values=['http', 'socks5'], width=10, state='readonly').pack(side=tk.LEFT, padx=5)
+        
+        # 连接复用统计
+        stats = self.transport.stats()
+        ttk.Label(proxy_frame, text=f"请求: {stats['requests']}  复用: {stats['reused']}  "
+                  f"TLS握手: {stats['tls_handshakes']}  重建: {stats['rebuilds']}").pack(padx=5, pady=2)
+        
         # 主题设置
         theme_frame = ttk.LabelFrame(main_frame, text='界面主题', padding=5)
         theme_frame.pack(fill=tk.X, pady=5)
@@ -1353,6 +5634,19 @@ class CryptoMonitor:
         ttk.Checkbutton(ml_frame, text='启用机器学习模型', 
             variable=self.use_ml_model).pack(padx=5, pady=2)
         
+        # 模型类型选择
+        model_type_frame = ttk.Frame(ml_frame)
+        model_type_frame.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Label(model_type_frame, text='模型类型:').pack(side=tk.LEFT)
+        ttk.Combobox(model_type_frame, textvariable=self.model_type,
+            values=['random_forest', 'online'], width=15, state='readonly').pack(side=tk.LEFT, padx=5)
+        
+        # 在线模型衰减系数
+        decay_frame = ttk.Frame(ml_frame)
+        decay_frame.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Label(decay_frame, text='在线衰减系数:').pack(side=tk.LEFT)
+        ttk.Entry(decay_frame, textvariable=self.online_decay, width=10).pack(side=tk.LEFT, padx=5)
+        
         # 按钮区域
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
@@ -1389,7 +5683,17 @@ class CryptoMonitor:
                 messagebox.showerror('错误', '信号数量必须是正整数')
                 return
             
-            # 保存设置
+            # 验证在线衰减系数
+            try:
+                decay = float(self.online_decay.get())
+                if not 0 < decay < 1:
+                    raise ValueError
+            except (ValueError, tk.TclError):
+                messagebox.showerror('错误', '在线衰减系数必须在0到1之间')
+                return
+            self.online_model.decay = decay
+            
+            # 保存设置，包括机器学习模型启用状态
             self.save_config()
             
             # 更新代理
@@ -1401,15 +5705,6 @@ class CryptoMonitor:
             # 更新信号显示
             self.update_signal_display()
             
-            # 保存机器学习模型启用状态
-            config = {
-                'use_ml_model': self.use_ml_model.get(),
-                # 其他配置项...
-            }
-            
-            with open('config.json', 'w') as f:
-                json.dump(config, f)
-            
             if settings_window:
                 settings_window.destroy()
             
@@ -1419,19 +5714,17 @@ class CryptoMonitor:
             print(f"保存设置时出错：{str(e)}")
 
     def load_settings(self):
-        """加载设置"""
+        """读取配置文件，界面创建后由 load_config 应用到各个控件"""
         try:
-            with open('config.json', 'r', encoding='utf-8') as f:  # 指定编码为utf-8
-                config = json.load(f)
+            if not os.path.exists(self.config_store.path):
+                print("配置文件未找到，使用默认设置")
+            config = self.config_store.load()
             
             # 加载机器学习模型启用状态
-            self.use_ml_model.set(config.get('use_ml_model', True))
-            # 加载其他配置项...
+            self.use_ml_model.set(config['use_ml_model'])
             
             print("设置已加载")
         
-        except FileNotFoundError:
-            print("配置文件未找到，使用默认设置")
         except Exception as e:
             print(f"加载设置时出错：{str(e)}")
 
@@ -1463,6 +5756,10 @@ class CryptoMonitor:
             trends = {}
             patterns = {}
             
+            # 一次性提交所有周期的请求，重复的周期只请求一次
+            unique_timeframes = sorted({tf for group in timeframe_groups for tf in group})
+            frames = self.fetch_ohlcv_batch(symbol, unique_timeframes, priority=PRIORITY_MTF)
+            
             # 分析每个时间框架
             for timeframes in timeframe_groups:
                 group_trends = []
@@ -1470,7 +5767,7 @@ class CryptoMonitor:
                 
                 for tf in timeframes:
                     # 获取对应时间框架的数据
-                    df = self.fetch_ohlcv_data(symbol, tf)
+                    df = frames.get(tf)
                     if df is None or len(df) < 50:
                         continue
                     
@@ -1621,6 +5918,9 @@ class CryptoMonitor:
             for signal, timestamp in multi_tf_signals:
                 self.trigger_signal(signal, timestamp)
             
+            # 按提醒开关检查规则信号
+            self.check_alert_rules(df)
+            
             if self.use_ml_model.get():
                 # 使用机器学习模型检查信号
                 predictions = self.predict_market_behavior(df)
@@ -1638,51 +5938,78 @@ class CryptoMonitor:
         except Exception as e:
             print(f"信号检查错误: {str(e)}")
 
-    def fetch_ohlcv_data(self, symbol, timeframe):
+    def fetch_ohlcv_data(self, symbol, timeframe, priority=PRIORITY_MTF):
         """获取OHLCV数据"""
         try:
             # 使用ccxt库从交易所获取数据
-            ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe)
-            # 将数据转换为DataFrame
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            return df
+            ohlcv = self.exchange_call('fetch_ohlcv', symbol, timeframe, priority=priority)
+            return self.ohlcv_to_frame(ohlcv)
         except Exception as e:
             print(f"获取OHLCV数据错误: {str(e)}")
             return None
 
+    def fetch_ohlcv_batch(self, symbol, timeframes, priority=PRIORITY_MTF):
+        """并发获取多个周期的OHLCV数据，返回 {周期: DataFrame}"""
+        futures = {tf: self.exchange_submit('fetch_ohlcv', symbol, tf, priority=priority)
+                   for tf in timeframes}
+        frames = {}
+        for tf, future in futures.items():
+            try:
+                frames[tf] = self.ohlcv_to_frame(future.result())
+            except Exception as e:
+                print(f"获取OHLCV数据错误({tf}): {str(e)}")
+        return frames
+
+    def ohlcv_to_frame(self, ohlcv):
+        """将OHLCV列表转换为DataFrame"""
+        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        return df
+
+    def update_online_model(self, df, key):
+        """用 key（交易对, 周期）上新收盘的K线更新在线模型"""
+        try:
+            features, labels = self.prepare_data(df)
+            # 最后一根K线尚未收盘；倒数第二行的标签依赖未收盘价格，也不能使用
+            features = features.iloc[:-2]
+            labels = labels.loc[features.index]
+            self.online_model.learn(key, features.values, labels.values, features.index)
+        except Exception as e:
+            print(f"在线模型更新错误: {str(e)}")
+
+    def load_online_model(self):
+        """加载在线模型状态"""
+        import pickle
+        
+        if os.path.exists(self.online_model_file):
+            try:
+                with open(self.online_model_file, 'rb') as f:
+                    model = pickle.load(f)
+                model.decay = self.online_decay.get()
+                return model
+            except Exception as e:
+                print(f"加载在线模型错误: {str(e)}")
+        return OnlineSignalModel(decay=self.online_decay.get())
+
+    def save_online_model(self):
+        """保存在线模型状态"""
+        import pickle
+        
+        if self.online_model.n_updates == 0:
+            return
+        try:
+            with open(self.online_model_file, 'wb') as f:
+                pickle.dump(self.online_model, f)
+        except Exception as e:
+            print(f"保存在线模型错误: {str(e)}")
+
     def check_indicators(self, df):
         """检查技术指标信号"""
         try:
-            closes = df['close'].values
-            volumes = df['volume'].values
-            
-            # 动态计算布林带
-            ma, upper_band, lower_band = self.calculate_dynamic_bollinger_bands(closes)
-            
-            # 动态计算RSI
-            rsi, overbought_threshold, oversold_threshold = self.calculate_dynamic_rsi(closes)
-            
-            # 计算OBV
-            obv = self.calculate_obv(closes, volumes)
-            
-            # 检查布林带突破
-            if closes[-1] > upper_band:
-                self.trigger_signal('价格突破布林带上轨，可能回调', time.time())
-            elif closes[-1] < lower_band:
-                self.trigger_signal('价格跌破布林带下轨，可能反弹', time.time())
-            
-            # 检查RSI超买超卖
-            if rsi > overbought_threshold:
-                self.trigger_signal(f'RSI超买（>{overbought_threshold}），可能回调', time.time())
-            elif rsi < oversold_threshold:
-                self.trigger_signal(f'RSI超卖（<{oversold_threshold}），可能反弹', time.time())
-            
-            # 检查OBV趋势
-            if obv > 0:
-                self.trigger_signal('OBV上升，可能看涨', time.time())
-            elif obv < 0:
-                self.trigger_signal('OBV下降，可能看跌', time.time())
+            current_time = time.time()
+            fired = self.signal_rules.latest(frame_fields(df), self.rule_params(), {'indicators'})
+            for signal_name in fired[0]:
+                self.trigger_signal(signal_name, current_time)
             
             # 检查蜡烛图形态
             self.check_candlestick_patterns(df)
@@ -1761,70 +6088,20 @@ class CryptoMonitor:
     def check_candlestick_patterns(self, df):
         """检查蜡烛图形态"""
         try:
-            opens = df['open'].values
-            closes = df['close'].values
-            highs = df['high'].values
-            lows = df['low'].values
-            
-            # 检查锤子线
-            if self.is_hammer(opens, closes, highs, lows):
-                self.trigger_signal('检测到锤子线，可能反转', time.time())
-            
-            # 检查吞没形态
-            if self.is_engulfing(opens, closes):
-                self.trigger_signal('检测到吞没形态，可能反转', time.time())
+            hints = {'bullish': '可能看涨', 'bearish': '可能看跌', 'neutral': '可能变盘'}
+            current_time = time.time()
+            for name in latest_candlestick_patterns(df['open'].values, df['high'].values,
+                                                    df['low'].values, df['close'].values):
+                _, _, label, direction = CANDLESTICK_PATTERNS[name]
+                self.trigger_signal(f'检测到{label}，{hints[direction]}', current_time)
         
         except Exception as e:
             print(f"蜡烛图形态检查错误: {str(e)}")
 
-    def is_hammer(self, opens, closes, highs, lows, threshold=0.3):
-        """检测锤子线形态"""
-        if len(opens) < 2:
-            return False
-        
-        # 检查最后一个蜡烛
-        body = abs(closes[-1] - opens[-1])
-        lower_shadow = opens[-1] - lows[-1] if closes[-1] > opens[-1] else closes[-1] - lows[-1]
-        upper_shadow = highs[-1] - closes[-1] if closes[-1] > opens[-1] else highs[-1] - opens[-1]
-        
-        # 锤子线条件
-        if lower_shadow > 2 * body and upper_shadow < body * threshold:
-            return True
-        
-        return False
-
-    def is_engulfing(self, opens, closes):
-        """检测吞没形态"""
-        if len(opens) < 2:
-            return False
-        
-        # 检查最后两个蜡烛
-        prev_body = abs(closes[-2] - opens[-2])
-        curr_body = abs(closes[-1] - opens[-1])
-        
-        # 看涨吞没
-        if closes[-1] > opens[-1] and opens[-1] < closes[-2] and closes[-1] > opens[-2]:
-            return True
-        
-        # 看跌吞没
-        if closes[-1] < opens[-1] and opens[-1] > closes[-2] and closes[-1] < opens[-2]:
-            return True
-        
-        return False
-
     def prepare_data(self, df):
         """准备特征和标签"""
         # 提取特征
-        features = pd.DataFrame()
-        features['close'] = df['close']
-        features['volume'] = df['volume']
-        features['rsi'] = self.calculate_rsi(df['close'].values)
-        features['obv'] = self.calculate_obv(df['close'].values, df['volume'].values)
-        
-        # 计算布林带
-        ma, upper_band, lower_band = self.calculate_bollinger_bands(df['close'].values)
-        features['bollinger_upper'] = upper_band
-        features['bollinger_lower'] = lower_band
+        features = build_feature_frame(df, **self.feature_params)
         
         # 标签：假设我们有一个二分类问题，1表示看涨，0表示看跌
         labels = (df['close'].shift(-1) > df['close']).astype(int)
@@ -1835,15 +6112,82 @@ class CryptoMonitor:
         
         return features, labels
 
-    def train_model(self, df):
+    def train_model(self, df, key=None):
+        """训练模型；在线模式下用历史数据预热在线模型，key 为数据所属的 (交易对, 周期)
+
+        可能在后台线程中调用，模型类型取界面线程发布的选择。
+        """
+        if self.selection.model_type == 'online':
+            # 按时间顺序预热，不替换随机森林；记录学到的位置，实时更新时不再重复学习这些K线
+            features, labels = self.prepare_data(df)
+            features, labels = features.iloc[:-1], labels.iloc[:-1]
+            if key is None:
+                self.online_model.partial_fit(features.values, labels.values)
+            else:
+                timestamps = df.loc[features.index, 'timestamp'] if 'timestamp' in df.columns else features.index
+                self.online_model.learn(key, features.values, labels.values, timestamps)
+            print(f"在线模型预热完成，已学习 {self.online_model.n_updates} 根K线")
+            return
+        self.train_forest(df)
+
+    def train_forest(self, df):
         """训练随机森林模型"""
         features, labels = self.prepare_data(df)
+        from sklearn.ensemble import RandomForestClassifier
+        self.model = RandomForestClassifier(**self.model_params)
         self.model.fit(features, labels)
         self.is_model_trained = True
         print("模型训练完成")
 
+    def run_hyperparameter_search(self, filename, search='grid', n_iter=20, n_folds=5):
+        """对历史数据做前推验证参数搜索，并将最优配置写入模型存储"""
+        try:
+            df = self.load_historical_data(filename)
+            if df is None:
+                print("无法加载数据进行参数搜索")
+                return None
+            
+            start = time.perf_counter()
+            results = hyperparameter_search(df, search=search, n_iter=n_iter, n_folds=n_folds)
+            elapsed = time.perf_counter() - start
+            best = results[0]
+            
+            for result in results[:5]:
+                summary = result['summary']
+                print(f"参数 {result['model_params']} 特征 {result['feature_params']}: "
+                      f"准确率 {summary['accuracy']:.3f}, 精确率 {summary['precision']:.3f}, "
+                      f"收益加权准确率 {summary['return_weighted_accuracy']:.3f}, "
+                      f"策略收益 {summary['strategy_return']:.2%}")
+            print(f"参数搜索完成，共 {len(results)} 组，耗时 {elapsed:.1f} 秒")
+            
+            # 用最优参数在全部数据上重新训练并保存
+            self.model_params = dict(best['model_params'])
+            self.feature_params = dict(best['feature_params'])
+            self.train_forest(df)
+            model_path = os.path.splitext(filename)[0] + '.forest'
+            self.save_model(model_path)
+            self.update_model_registry(model_path,
+                walk_forward={
+                    'search': search,
+                    'configs': len(results),
+                    'seconds': round(elapsed, 1),
+                    'summary': best['summary'],
+                    'folds': best['folds']
+                })
+            return best
+        except Exception as e:
+            print(f"参数搜索错误: {str(e)}")
+            return None
+
     def predict_market_behavior(self, df):
         """使用模型预测市场行为"""
+        if self.model_type.get() == 'online':
+            if self.online_model.n_updates < self.online_min_updates:
+                print("在线模型学习样本不足")
+                return None
+            features, _ = self.prepare_data(df)
+            return self.online_model.predict(features.values)
+        
         if not self.is_model_trained:
             print("模型尚未训练")
             return None
@@ -1852,57 +6196,32 @@ class CryptoMonitor:
         predictions = self.model.predict(features)
         return predictions
 
-    def check_indicators(self, df):
-        """检查技术指标信号"""
-        try:
-            closes = df['close'].values
-            volumes = df['volume'].values
-            
-            # 动态计算布林带
-            ma, upper_band, lower_band = self.calculate_dynamic_bollinger_bands(closes)
-            
-            # 动态计算RSI
-            rsi, overbought_threshold, oversold_threshold = self.calculate_dynamic_rsi(closes)
-            
-            # 计算OBV
-            obv = self.calculate_obv(closes, volumes)
-            
-            # 检查布林带突破
-            if closes[-1] > upper_band:
-                self.trigger_signal('价格突破布林带上轨，可能回调', time.time())
-            elif closes[-1] < lower_band:
-                self.trigger_signal('价格跌破布林带下轨，可能反弹', time.time())
-            
-            # 检查RSI超买超卖
-            if rsi > overbought_threshold:
-                self.trigger_signal(f'RSI超买（>{overbought_threshold}），可能回调', time.time())
-            elif rsi < oversold_threshold:
-                self.trigger_signal(f'RSI超卖（<{oversold_threshold}），可能反弹', time.time())
-            
-            # 检查OBV趋势
-            if obv > 0:
-                self.trigger_signal('OBV上升，可能看涨', time.time())
-            elif obv < 0:
-                self.trigger_signal('OBV下降，可能看跌', time.time())
-            
-            # 检查蜡烛图形态
-            self.check_candlestick_patterns(df)
-        
-        except Exception as e:
-            print(f"技术指标检查错误: {str(e)}")
-
     def fetch_and_save_historical_data(self, symbol, timeframe, since, filename):
         """抓取并保存历史数据"""
         try:
-            # 使用ccxt库从交易所获取数据
-            ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, since=since)
+            # 分页下载，以最低优先级排队，不挤占实时行情的请求额度
+            ohlcv = []
+            page_limit = 1000
+            while True:
+                batch = self.exchange_call('fetch_ohlcv', symbol, timeframe, since=since,
+                                           limit=page_limit, priority=PRIORITY_HISTORY)
+                if not batch:
+                    break
+                ohlcv.extend(batch)
+                if len(batch) < page_limit or batch[-1][0] + 1 <= since:
+                    break
+                since = batch[-1][0] + 1
+            
             # 将数据转换为DataFrame
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+            df = self.ohlcv_to_frame(ohlcv).drop_duplicates('timestamp')
             
             # 保存数据到CSV文件
             df.to_csv(filename, index=False)
             print(f"数据已保存到 {filename}")
+            
+            # 同时写入本地K线库，供图表浏览历史
+            if ohlcv:
+                self.candle_store.write(symbol, timeframe, ohlcv)
         except Exception as e:
             print(f"抓取历史数据错误: {str(e)}")
 
@@ -1932,7 +6251,7 @@ class CryptoMonitor:
         """显示训练窗口"""
         training_window = tk.Toplevel(self.root)
         training_window.title('训练模型')
-        training_window.geometry('400x300')
+        training_window.geometry('400x500')
         training_window.transient(self.root)
         training_window.grab_set()
         
@@ -1951,6 +6270,7 @@ class CryptoMonitor:
         # 开始时间选择
         since_label = ttk.Label(training_window, text='开始时间:')
         since_label.pack(pady=5)
+        from tkcalendar import DateEntry
         since_entry = DateEntry(training_window, width=12, background='darkblue',
                             foreground='white', borderwidth=2, year=2023)
         since_entry.pack(pady=5)
@@ -1963,46 +6283,180 @@ class CryptoMonitor:
         
         # 抓取并训练按钮
         fetch_button = ttk.Button(training_window, text='抓取并训练',
-                              command=lambda: self.fetch_and_train(
-                                  symbol_combobox.get(), timeframe_combobox.get(), since_entry.get_date(), filename_entry.get()))
+                              command=lambda: threading.Thread(
+                                  target=self.fetch_and_train,
+                                  args=(symbol_combobox.get(), timeframe_combobox.get(), since_entry.get_date(),
+                                        filename_entry.get()), daemon=True).start())
         fetch_button.pack(pady=10)
         
         # 从文件训练按钮
         train_button = ttk.Button(training_window, text='从文件训练',
                               command=lambda: self.train_model_from_file(filename_entry.get()))
         train_button.pack(pady=10)
+        
+        # 参数搜索按钮
+        search_button = ttk.Button(training_window, text='参数搜索',
+                              command=lambda: threading.Thread(
+                                  target=self.run_hyperparameter_search,
+                                  args=(filename_entry.get(),), daemon=True).start())
+        search_button.pack(pady=10)
+        
+        # 加载模型按钮
+        load_button = ttk.Button(training_window, text='加载模型',
+                              command=self.choose_and_load_model)
+        load_button.pack(pady=10)
 
     def fetch_and_train(self, symbol, timeframe, since, filename):
-        """抓取数据并训练模型"""
+        """抓取数据并训练模型；在后台线程中运行，结果经 root.after 交回界面线程"""
         since_timestamp = int(since.timestamp() * 1000)  # 转换为时间戳
         self.fetch_and_save_historical_data(symbol, timeframe, since_timestamp, filename)
         df = self.load_historical_data(filename)
-        if df is not None:
-            self.train_model(df)
-            self.save_model(filename.replace('.csv', '.pkl'))  # 保存模型
+        if df is None:
+            self.root.after(0, lambda: messagebox.showerror('训练模型', f'{symbol} {timeframe} 历史数据获取失败'))
+            return
+        self.train_model(df, (symbol, timeframe))
+        if self.selection.model_type == 'online':
+            self.save_online_model()
+        else:
+            self.save_model(os.path.splitext(filename)[0] + '.forest')  # 保存模型
+        self.root.after(0, lambda: messagebox.showinfo('训练模型', f'{symbol} {timeframe} 模型训练完成（{len(df)} 根K线）'))
 
     def save_model(self, filename):
-        """保存训练好的模型"""
-        with open(filename, 'wb') as f:
-            pickle.dump(self.model, f)
-        print(f"模型已保存到 {filename}")
+        """保存训练好的模型，.pkl 使用pickle，其他路径使用内存映射格式"""
+        import pickle
+        
+        if self.model is None or not self.is_model_trained:
+            print("模型尚未训练，无法保存")
+            return
+        try:
+            if filename.endswith('.pkl'):
+                self.model.feature_version_ = FEATURE_SET_VERSION
+                with open(filename, 'wb') as f:
+                    pickle.dump(self.model, f)
+                self.update_model_registry(filename, format='pickle', feature_version=FEATURE_SET_VERSION)
+            else:
+                meta = save_mapped_forest(self.model, filename, extra_meta={
+                    'model_params': self.model_params,
+                    'feature_params': self.feature_params,
+                    'feature_version': FEATURE_SET_VERSION
+                })
+                self.update_model_registry(filename, format='mmap',
+                    n_trees=meta['n_trees'], n_nodes=meta['n_nodes'],
+                    model_params=self.model_params,
+                    feature_params=self.feature_params,
+                    feature_version=FEATURE_SET_VERSION)
+            print(f"模型已保存到 {filename}")
+        except Exception as e:
+            print(f"保存模型错误: {str(e)}")
 
     def load_model(self, filename):
-        """加载已保存的模型"""
+        """加载已保存的模型，目录格式以只读内存映射方式加载"""
+        import pickle
+        
         try:
-            with open(filename, 'rb') as f:
-                self.model = pickle.load(f)
+            rss_before = get_process_rss()
+            start = time.perf_counter()
+            
+            if os.path.isdir(filename):
+                model = MappedForest(filename)
+                feature_version = model.meta.get('feature_version', 1)
+                model_format = 'mmap'
+                mapped_bytes = model.nbytes
+            else:
+                with open(filename, 'rb') as f:
+                    model = pickle.load(f)
+                feature_version = getattr(model, 'feature_version_', 1)
+                model_format = 'pickle'
+                mapped_bytes = 0
+            
+            # 特征计算方式不同的模型给出的预测没有意义，拒绝加载，需要重新训练
+            if feature_version != FEATURE_SET_VERSION:
+                raise ValueError(f"模型的特征版本为 {feature_version}，当前为 {FEATURE_SET_VERSION}，请重新训练")
+            self.model = model
+            if model_format == 'mmap':
+                self.model_params = dict(model.meta.get('model_params', DEFAULT_MODEL_PARAMS))
+                self.feature_params = dict(model.meta.get('feature_params', DEFAULT_FEATURE_PARAMS))
+            
+            load_seconds = time.perf_counter() - start
+            rss_after = get_process_rss()
+            resident_bytes = None
+            if rss_before is not None and rss_after is not None:
+                resident_bytes = max(0, rss_after - rss_before)
+            
             self.is_model_trained = True
-            print(f"模型已从 {filename} 加载")
+            self.update_model_registry(filename, format=model_format,
+                load_seconds=round(load_seconds, 4),
+                resident_bytes=resident_bytes,
+                mapped_bytes=mapped_bytes)
+            print(f"模型已从 {filename} 加载，耗时 {load_seconds * 1000:.1f} ms")
         except Exception as e:
             print(f"加载模型错误: {str(e)}")
 
+    def load_model_registry(self):
+        """加载模型登记表"""
+        if os.path.exists(self.model_registry_file):
+            try:
+                with open(self.model_registry_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"加载模型登记表错误: {str(e)}")
+        return {}
+
+    def update_model_registry(self, filename, **info):
+        """更新模型登记表中某个模型的记录"""
+        entry = self.model_registry.setdefault(os.path.abspath(filename), {})
+        entry.update(info)
+        entry['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with open(self.model_registry_file, 'w', encoding='utf-8') as f:
+                json.dump(self.model_registry, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存模型登记表错误: {str(e)}")
+
+    def choose_and_load_model(self):
+        """选择并加载模型目录"""
+        path = filedialog.askdirectory(title='选择模型目录')
+        if path:
+            self.load_model(path)
+
     def get_available_symbols(self):
         """获取可用的交易对列表"""
-        # 这里可以从交易所API获取可用的交易对列表
-        return ['BTC/USDT', 'ETH/USDT', 'XRP/USDT']  # 示例
+        symbols = self.market_catalog.symbols()
+        if symbols:
+            return symbols
+        # 缓存尚未就绪时使用默认列表
+        return ['BTC/USDT', 'ETH/USDT', 'XRP/USDT']
 
-if __name__ == '__main__':
+_MODULE_IMPORT_SECONDS = time.perf_counter() - _MODULE_IMPORT_START
+
+
+def benchmark_startup():
+    """测量模块导入、主窗口出现以及各重型依赖首次导入的耗时"""
+    results = {'import btc': _MODULE_IMPORT_SECONDS}
+    
+    start = time.perf_counter()
     app = CryptoMonitor()
-    app.run()
+    results['CryptoMonitor()'] = time.perf_counter() - start
+    app.root.update()  # 处理挂起事件，使主窗口完成绘制
+    results['主窗口显示'] = time.perf_counter() - start
+    
+    # 依赖按需导入时各自的首次导入耗时
+    for name in ('numpy', 'pandas', 'matplotlib.pyplot', 'ccxt', 'sklearn.ensemble', 'tkcalendar'):
+        if name in sys.modules:
+            continue
+        t = time.perf_counter()
+        importlib.import_module(name)
+        results[f'import {name}'] = time.perf_counter() - t
+    
+    app.root.destroy()
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1000:.1f} ms")
+    return results
+
+if __name__ == '__main__':
+    if '--benchmark-startup' in sys.argv:
+        benchmark_startup()
+    else:
+        app = CryptoMonitor()
+        app.run()
 